@@ -39,6 +39,8 @@ INSTALLED_APPS = [
 # ============================================
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',   # MUST BE FIRST
+    'downloader.middleware.RequestMetricsMiddleware',
+    'downloader.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -102,6 +104,17 @@ AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator'},
 ]
 
+# The first hasher hashes new passwords; logins re-hash older or
+# differently-costed hashes with it. 0 keeps Django's default iterations.
+PASSWORD_HASHERS = [
+    'users.hashers.ConfigurablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+PASSWORD_PBKDF2_ITERATIONS = config('PASSWORD_PBKDF2_ITERATIONS', default=0, cast=int)
+
 # ============================================
 # INTERNATIONALIZATION
 # ============================================
@@ -167,16 +180,22 @@ CSRF_TRUSTED_ORIGINS = [
 # ============================================
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.StatelessJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
+        'downloader.renderers.ORJSONRenderer',
     ),
 }
 
+# Access tokens are trusted for identity; only the user's active flag and
+# role are re-read, at most once per STATE_TTL seconds per process
+USERS_AUTH = {
+    'STATE_TTL': config('USERS_AUTH_STATE_TTL', default=30, cast=int),
+}
+
 # ============================================
 # SECURITY SETTINGS (Production only)
 # ============================================
@@ -187,3 +206,329 @@ if not DEBUG:
     SECURE_HSTS_SECONDS = config('SECURE_HSTS_SECONDS', default=31536000, cast=int)
     SECURE_HSTS_INCLUDE_SUBDOMAINS = True
     SECURE_HSTS_PRELOAD = True
+
+# ============================================
+# DOWNLOADER — METADATA CACHE
+# ============================================
+# BACKEND: "lru" (per worker), "django" (shared via CACHES) or "none"
+DOWNLOADER_METADATA_CACHE = {
+    'BACKEND': config('METADATA_CACHE_BACKEND', default='lru'),
+    'CACHE_ALIAS': config('METADATA_CACHE_ALIAS', default='default'),
+    'MAX_ENTRIES': config('METADATA_CACHE_MAX_ENTRIES', default=512, cast=int),
+    # Seconds per extractor; always capped by the signed format URLs' expiry
+    'TTL': {
+        'default': 600,
+        'youtube': 4 * 3600,
+        'youtubetab': 1800,
+        'tiktok': 900,
+        'instagram': 900,
+    },
+    'EXPIRY_MARGIN': 300,
+}
+
+# ============================================
+# DOWNLOADER — REQUEST COALESCING
+# ============================================
+# Identical concurrent fetches are always collapsed within a worker. Set
+# CACHE_ALIAS to a cache shared by all workers (redis, db, file) to also
+# hand results over between gunicorn workers.
+DOWNLOADER_SINGLEFLIGHT = {
+    'CACHE_ALIAS': config('SINGLEFLIGHT_CACHE_ALIAS', default=''),
+    'LOCK_TIMEOUT': 120,
+    'RESULT_TTL': 30,
+    'POLL_INTERVAL': 0.2,
+}
+
+# ============================================
+# DOWNLOADER — BACKGROUND JOBS
+# ============================================
+# Jobs are processed by `python manage.py run_download_workers`; WORKERS
+# bounds concurrent downloads/transcodes per worker process.
+DOWNLOADER_JOBS = {
+    'ROOT': config('DOWNLOADER_JOB_ROOT', default=str(BASE_DIR / 'jobs')),
+    'WORKERS': config('DOWNLOADER_JOB_WORKERS', default=2, cast=int),
+    'POLL_INTERVAL': 1.0,
+    'PROGRESS_INTERVAL': 1.0,
+    # Running jobs refresh heartbeat_at this often, even while transcoding;
+    # ones silent for STALE_AFTER are requeued for another worker.
+    'HEARTBEAT_INTERVAL': 30,
+    'STALE_AFTER': 300,
+    'RESULT_TTL': config('DOWNLOADER_JOB_RESULT_TTL', default=3600, cast=int),
+}
+
+# ============================================
+# DOWNLOADER — PLAYLIST PIPELINE
+# ============================================
+# Downloads run on threads of each playlist; FFmpeg transcodes go to the
+# shared transcode pool. MAX_PENDING_TRANSCODES bounds how many tracks of
+# one playlist wait on disk for a transcode slot.
+DOWNLOADER_PLAYLIST = {
+    'DOWNLOAD_WORKERS': config('PLAYLIST_DOWNLOAD_WORKERS', default=4, cast=int),
+    'MAX_PENDING_TRANSCODES': config('PLAYLIST_MAX_PENDING_TRANSCODES', default=2 * (os.cpu_count() or 2), cast=int),
+    # Window sizes for streamed metadata (fetch_link with "stream": true)
+    'PAGE_SIZE': 50,
+    'MAX_PAGE_SIZE': 200,
+}
+
+# ============================================
+# DOWNLOADER — CONVERTED FILE CACHE
+# ============================================
+# Converted MP3s are kept on disk keyed by (extractor, video id, codec,
+# quality). POLICY is "lru" or "lfu". Keep ROOT on the same filesystem as
+# the workspaces so files are hard-linked instead of copied.
+DOWNLOADER_ARTIFACTS = {
+    'ENABLED': config('ARTIFACT_CACHE_ENABLED', default=True, cast=bool),
+    'ROOT': config('ARTIFACT_CACHE_ROOT', default=str(BASE_DIR / 'artifacts')),
+    'MAX_BYTES': config('ARTIFACT_CACHE_MAX_BYTES', default=5 * 1024 ** 3, cast=int),
+    'POLICY': config('ARTIFACT_CACHE_POLICY', default='lru'),
+}
+
+# ============================================
+# DOWNLOADER — FILE DELIVERY
+# ============================================
+# OFFLOAD lets the front-end server send cached files and job results:
+#   "x-accel"    nginx; map each filesystem root to an `internal` location
+#   "x-sendfile" Apache mod_xsendfile / lighttpd
+DOWNLOADER_DELIVERY = {
+    'OFFLOAD': config('DOWNLOADER_OFFLOAD', default=''),
+    # Keyed by the configured roots, so moving one keeps offload working
+    'ACCEL_LOCATIONS': {
+        DOWNLOADER_ARTIFACTS['ROOT']: '/_protected/artifacts/',
+        DOWNLOADER_JOBS['ROOT']: '/_protected/jobs/',
+    },
+    'BLOCK_SIZE': 256 * 1024,
+}
+
+# ============================================
+# DOWNLOADER — ASYNC (ASGI) FETCH
+# ============================================
+# Used by fetch/async/ when served by an ASGI server, e.g.
+#   uvicorn backend.asgi:application
+DOWNLOADER_ASYNC = {
+    'EXECUTOR_WORKERS': config('ASYNC_EXECUTOR_WORKERS', default=32, cast=int),
+    'MAX_PENDING': config('ASYNC_MAX_PENDING', default=256, cast=int),
+    'TIMEOUT': config('ASYNC_FETCH_TIMEOUT', default=120, cast=int),
+}
+
+# ============================================
+# DOWNLOADER — BATCH FETCH
+# ============================================
+DOWNLOADER_BATCH = {
+    'MAX_URLS': config('BATCH_MAX_URLS', default=25, cast=int),
+    'WORKERS': config('BATCH_WORKERS', default=8, cast=int),
+}
+
+# ============================================
+# DOWNLOADER — YT-DLP INSTANCE POOL
+# ============================================
+# Idle YoutubeDL instances kept per option profile (metadata, flat,
+# video, audio). They keep HTTP connections and the cookies.txt jar
+# between requests; 0 builds a fresh instance for every call.
+DOWNLOADER_YDL_POOL = {
+    'MAX_IDLE': config('YDL_POOL_MAX_IDLE', default=8, cast=int),
+    # yt-dlp is imported on the first request that needs it. Set YDL_WARMUP
+    # in the web workers' environment to load and prime it at startup
+    # instead, before the worker takes traffic (costs about a second of boot).
+    'WARMUP': config('YDL_WARMUP', default=False, cast=bool),
+}
+
+# ============================================
+# DOWNLOADER — METRICS & LOGGING
+# ============================================
+# Prometheus text format at /metrics. Values are per process: with several
+# gunicorn workers, scrape each worker or run one worker per container.
+DOWNLOADER_METRICS = {
+    'ENABLED': config('METRICS_ENABLED', default=True, cast=bool),
+    'TOKEN': config('METRICS_TOKEN', default=''),
+    # Seconds a scrape reuses the previous walk of the work, job and thumbnail dirs
+    'DISK_TTL': config('METRICS_DISK_TTL', default=30, cast=int),
+    # Hosts labelled by name (subdomains included); all others are "other".
+    # Defaults to downloader.metrics.METRIC_HOSTS.
+    # 'HOSTS': ('youtube.com', 'soundcloud.com'),
+}
+
+# Every line carries the request id (X-Request-ID) or job id. Per-stage
+# timings are logged only with LOG_FORMAT "json", as fields.
+LOG_FORMAT = config('LOG_FORMAT', default='text')
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'request_id': {'()': 'downloader.log.RequestIdFilter'},
+    },
+    'formatters': {
+        'text': {'format': '%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s'},
+        'json': {'()': 'downloader.log.JsonFormatter'},
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'filters': ['request_id'],
+            'formatter': LOG_FORMAT,
+        },
+    },
+    'loggers': {
+        'downloader': {'handlers': ['console'], 'level': config('LOG_LEVEL', default='INFO'), 'propagate': False},
+        'downloader.stages': {'level': 'INFO' if LOG_FORMAT == 'json' else 'WARNING'},
+        'users': {'handlers': ['console'], 'level': config('LOG_LEVEL', default='INFO'), 'propagate': False},
+    },
+}
+
+# ============================================
+# DOWNLOADER — ADMISSION CONTROL
+# ============================================
+# Rates are (requests per minute, burst) per CustomUser.role and kind:
+# "metadata" (fetch, batch counts one per link), "download" (MP3
+# conversions and jobs) and "stream" (proxied downloads, one per Range
+# request). ROLE_RATES buckets are shared by all users of a
+# role. DOWNLOAD_SLOTS caps concurrent conversions per process; callers
+# wait fairly (round-robin per user) up to QUEUE_TIMEOUT seconds, and
+# beyond MAX_WAITING get 429 with Retry-After right away. Each waiter holds
+# a web worker, so keep both small; QUEUE_TIMEOUT 0 never queues.
+DOWNLOADER_ADMISSION = {
+    'ENABLED': config('ADMISSION_ENABLED', default=True, cast=bool),
+    'USER_RATES': {
+        'user': {'metadata': (60, 20), 'download': (6, 3), 'stream': (120, 30)},
+        'admin': {'metadata': (600, 100), 'download': (60, 20), 'stream': (600, 100)},
+    },
+    'ROLE_RATES': {},
+    'DOWNLOAD_SLOTS': config('DOWNLOAD_SLOTS', default=4, cast=int),
+    'MAX_WAITING': config('DOWNLOAD_MAX_WAITING', default=4, cast=int),
+    'MAX_WAITING_PER_USER': 2,
+    'QUEUE_TIMEOUT': config('DOWNLOAD_QUEUE_TIMEOUT', default=2, cast=float),
+    'MAX_ACTIVE_JOBS_PER_USER': config('MAX_ACTIVE_JOBS_PER_USER', default=5, cast=int),
+}
+
+# ============================================
+# DOWNLOADER — WORKSPACES
+# ============================================
+# Every conversion and job downloads into its own directory under ROOT.
+# A new one is refused (503 / job requeued) once the reservations of live
+# workspaces would pass MAX_BYTES or the disk would drop below
+# MIN_FREE_BYTES; a single job may not write more than JOB_MAX_BYTES.
+# Single-track MP3s use TMPFS_ROOT (e.g. /dev/shm/fetchmate) when set.
+# Live workspaces count as the larger of RESERVE_BYTES and what they have
+# written, and a download that pushes the total past MAX_BYTES is stopped.
+# Directories left by crashed workers are swept after STALE_AFTER seconds,
+# by a thread each serving process starts at boot (unless SWEEP_ON_START is
+# off) or on its first allocation; other manage.py commands than runserver
+# and run_download_workers start it only if they allocate.
+DOWNLOADER_WORKSPACE = {
+    'ROOT': config('WORKSPACE_ROOT', default=str(BASE_DIR / 'work')),
+    'MAX_BYTES': config('WORKSPACE_MAX_BYTES', default=20 * 1024 ** 3, cast=int),
+    'JOB_MAX_BYTES': config('WORKSPACE_JOB_MAX_BYTES', default=2 * 1024 ** 3, cast=int),
+    'RESERVE_BYTES': config('WORKSPACE_RESERVE_BYTES', default=256 * 1024 ** 2, cast=int),
+    'MIN_FREE_BYTES': config('WORKSPACE_MIN_FREE_BYTES', default=1024 ** 3, cast=int),
+    'TMPFS_ROOT': config('WORKSPACE_TMPFS_ROOT', default=''),
+    'TMPFS_MAX_BYTES': config('WORKSPACE_TMPFS_MAX_BYTES', default=512 * 1024 ** 2, cast=int),
+    'TMPFS_JOB_MAX_BYTES': 128 * 1024 ** 2,
+    'STALE_AFTER': 15 * 60,
+    'SWEEP_INTERVAL': 5 * 60,
+    'SWEEP_ON_START': config('WORKSPACE_SWEEP_ON_START', default=True, cast=bool),
+}
+
+# ============================================
+# DOWNLOADER — TRANSCODING
+# ============================================
+# All FFmpeg conversions in a process share WORKERS threads; single
+# tracks are served before playlist tracks. Clients pick "audio_codec"
+# (mp3, m4a, opus) and "audio_quality" (kbit/s); sources already in the
+# requested codec are stream-copied instead of re-encoded.
+DOWNLOADER_TRANSCODE = {
+    'WORKERS': config('TRANSCODE_WORKERS', default=os.cpu_count() or 2, cast=int),
+    'DEFAULT_CODEC': config('AUDIO_DEFAULT_CODEC', default='mp3'),
+    'DEFAULT_QUALITY': {'mp3': '192', 'm4a': '192', 'opus': '128'},
+    'MIN_QUALITY': 64,
+    'MAX_QUALITY': 320,
+}
+
+# ============================================
+# DOWNLOADER — PROXY STREAMING
+# ============================================
+# GET /api/downloader/stream/?url=...&format_id=... relays a format from
+# the source without writing it to disk. Each stream holds at most
+# CHUNK_SIZE bytes; keep-alive connections to source hosts are reused.
+# Sources resolving to loopback, private or link-local addresses are
+# refused unless ALLOW_PRIVATE_HOSTS (local testing only).
+DOWNLOADER_PROXY = {
+    'CHUNK_SIZE': config('PROXY_CHUNK_SIZE', default=64 * 1024, cast=int),
+    'MAX_IDLE_PER_HOST': 4,
+    'IDLE_TIMEOUT': 30,
+    'TIMEOUT': config('PROXY_TIMEOUT', default=15, cast=int),
+    'MAX_REDIRECTS': 5,
+    'ALLOW_PRIVATE_HOSTS': config('PROXY_ALLOW_PRIVATE_HOSTS', default=False, cast=bool),
+}
+
+# ============================================
+# DOWNLOADER — THUMBNAILS
+# ============================================
+# Fetch payloads carry a signed "thumbnail_proxy" path per track. The
+# proxy fetches each image once into ROOT (LRU-trimmed to MAX_BYTES) and,
+# when Pillow is installed, serves WebP variants at the nearest of WIDTHS.
+DOWNLOADER_THUMBNAILS = {
+    'ENABLED': config('THUMBNAILS_ENABLED', default=True, cast=bool),
+    'ROOT': config('THUMBNAILS_ROOT', default=str(BASE_DIR / 'thumbnails')),
+    'MAX_BYTES': config('THUMBNAILS_MAX_BYTES', default=256 * 1024 ** 2, cast=int),
+    'WIDTHS': (160, 320, 640),
+    'DEFAULT_WIDTH': 320,
+    'MAX_SOURCE_BYTES': 5 * 1024 ** 2,
+    'MAX_PIXELS': 25 * 1000 ** 2,
+    'QUALITY': 80,
+    'MAX_AGE': 7 * 24 * 3600,
+    'PREFETCH_WORKERS': 4,
+    # Fetch payloads warm the cache for their thumbnails; past this many
+    # pending images (e.g. a burst of large playlists) the rest are skipped.
+    'PREFETCH_QUEUE': 256,
+}
+
+# ============================================
+# DOWNLOADER — SEGMENTED DOWNLOADS
+# ============================================
+# Files of at least MIN_SIZE with a known size are fetched as parallel
+# Range segments (DASH/HLS as concurrent fragments), on up to
+# CONNECTIONS_PER_FILE connections. MAX_CONNECTIONS caps the total across
+# all downloads in a process; past it, downloads use one connection.
+DOWNLOADER_SEGMENTED = {
+    'ENABLED': config('SEGMENTED_ENABLED', default=True, cast=bool),
+    'CONNECTIONS_PER_FILE': config('SEGMENTED_CONNECTIONS_PER_FILE', default=4, cast=int),
+    'MAX_CONNECTIONS': config('SEGMENTED_MAX_CONNECTIONS', default=32, cast=int),
+    'SEGMENT_SIZE': 8 * 1024 ** 2,
+    'MIN_SIZE': 16 * 1024 ** 2,
+    'SEGMENT_RETRIES': 5,
+    'BLOCK_SIZE': 64 * 1024,
+}
+
+# ============================================
+# DOWNLOADER — HOST SCHEDULER
+# ============================================
+# yt-dlp calls run at most PER_HOST at a time per host (per process).
+# HTTP 429s and bot checks, or FAILURE_THRESHOLD consecutive 5xx/network
+# errors, pause a host for BASE_BACKOFF seconds, doubling up to
+# MAX_BACKOFF while it keeps failing; requests fail fast with 503 meanwhile.
+# Health is kept in CACHE_ALIAS, so use a shared cache (e.g. Redis) for it
+# to apply across workers.
+DOWNLOADER_HOSTS = {
+    'PER_HOST': config('HOSTS_PER_HOST', default=4, cast=int),
+    'OVERRIDES': {},
+    'ACQUIRE_TIMEOUT': 30,
+    'FAILURE_THRESHOLD': config('HOSTS_FAILURE_THRESHOLD', default=5, cast=int),
+    'BASE_BACKOFF': config('HOSTS_BASE_BACKOFF', default=30, cast=int),
+    'MAX_BACKOFF': config('HOSTS_MAX_BACKOFF', default=15 * 60, cast=int),
+    'PROBE_TIMEOUT': 120,
+    'CACHE_ALIAS': config('HOSTS_CACHE_ALIAS', default='default'),
+}
+
+# ============================================
+# DOWNLOADER — RESPONSE COMPRESSION
+# ============================================
+# JSON and NDJSON under PATHS are brotli- or gzip-compressed when the
+# client accepts it (brotli needs the Brotli package). Clients can also
+# pass "fields" and "compact" to fetch endpoints to trim the payload.
+DOWNLOADER_COMPRESSION = {
+    'ENABLED': config('COMPRESSION_ENABLED', default=True, cast=bool),
+    'PATHS': ('/api/downloader/',),
+    'CONTENT_TYPES': ('application/json', 'application/x-ndjson'),
+    'MIN_SIZE': 1024,
+    'GZIP_LEVEL': config('COMPRESSION_GZIP_LEVEL', default=6, cast=int),
+    'BROTLI_QUALITY': config('COMPRESSION_BROTLI_QUALITY', default=5, cast=int),
+}
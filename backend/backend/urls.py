@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.urls import path, include
 from django.http import JsonResponse
+from downloader.views import metrics_view
 
 def health_check(request):
     return JsonResponse({"status": "ok", "message": "FetchMate backend running!"})
@@ -9,6 +10,7 @@ def health_check(request):
 urlpatterns = [
     path('', health_check, name='health_check'),
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('api/users/', include('users.urls')),
     path('api/downloader/', include('downloader.urls')),
 ]
@@ -0,0 +1,9 @@
+"""
+Offline benchmarks for the downloader and auth endpoints.
+
+Requests go through the full Django stack against a throwaway test
+database; yt-dlp resolves synthetic ``FakeIE`` URLs whose media is served
+by a local HTTP stub, so no network access is needed. Run with::
+
+    python manage.py benchmark --output after.json --compare before.json
+"""
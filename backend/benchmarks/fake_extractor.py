@@ -0,0 +1,100 @@
+import time
+from contextlib import contextmanager
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import yt_dlp
+from yt_dlp.extractor.common import InfoExtractor
+
+from downloader.extraction import ydl_pool
+
+# (format_id, ext, vcodec, acodec, height, kbit/s)
+FORMATS = [
+    ("251", "webm", "none", "opus", None, 130),
+    ("140", "m4a", "none", "mp4a.40.2", None, 128),
+    ("18", "mp4", "avc1.42001E", "mp4a.40.2", 360, 500),
+    ("22", "mp4", "avc1.64001F", "mp4a.40.2", 720, 1500),
+    ("137", "mp4", "avc1.640028", "none", 1080, 4000),
+]
+
+
+class FakeIE(InfoExtractor):
+    """
+    Stand-in extractor producing synthetic info dicts without network access.
+
+    ``/watch/<id>`` is a single video, ``/playlist/<id>?size=N`` a playlist
+    of N videos. ``latency`` (seconds) simulates page and API round trips,
+    ``bytes`` sets the size of every media file served by the stub.
+    """
+
+    IE_NAME = "fake"
+    _VALID_URL = r"https?://127\.0\.0\.1:\d+/(?P<kind>watch|playlist)/(?P<id>[\w-]+)"
+
+    def _real_extract(self, url):
+        kind, item_id = self._match_valid_url(url).group("kind", "id")
+        parts = urlsplit(url)
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        base = f"{parts.scheme}://{parts.netloc}"
+        latency = float(query.get("latency", 0))
+        if latency:
+            time.sleep(latency)
+
+        if kind == "playlist":
+            size = int(query.pop("size", 10))
+            entries = [
+                self.url_result(
+                    f"{base}/watch/{item_id}-{i}?{urlencode(query)}", FakeIE,
+                    f"{item_id}-{i}", f"Synthetic track {item_id}-{i}",
+                )
+                for i in range(1, size + 1)
+            ]
+            return self.playlist_result(entries, item_id, f"Synthetic playlist {item_id}")
+
+        media_bytes = int(query.get("bytes", 256 * 1024))
+        duration = 60
+        formats = []
+        for format_id, ext, vcodec, acodec, height, tbr in FORMATS:
+            formats.append({
+                "format_id": format_id,
+                "url": f"{base}/media/{item_id}-{format_id}.{ext}?bytes={media_bytes}",
+                "ext": ext,
+                "vcodec": vcodec,
+                "acodec": acodec,
+                "height": height,
+                "width": height and height * 16 // 9,
+                "tbr": tbr,
+                "abr": tbr if vcodec == "none" else None,
+                "filesize": media_bytes,
+            })
+        return {
+            "id": item_id,
+            "title": f"Synthetic track {item_id}",
+            "uploader": "FetchMate Bench",
+            "thumbnail": f"{base}/thumb/{item_id}.jpg",
+            "duration": duration,
+            "webpage_url": url,
+            "formats": formats,
+        }
+
+
+def install(ydl):
+    ydl.add_info_extractor(FakeIE())
+    # The generic extractor matches any URL, so FakeIE has to be tried first
+    ydl._ies = {FakeIE.ie_key(): ydl._ies.pop(FakeIE.ie_key()), **ydl._ies}
+
+
+@contextmanager
+def fake_extractor():
+    """Make every YoutubeDL created inside the block (pooled ones included) know ``FakeIE``."""
+    original = yt_dlp.YoutubeDL.__init__
+
+    def __init__(self, *args, **kwargs):
+        original(self, *args, **kwargs)
+        install(self)
+
+    yt_dlp.YoutubeDL.__init__ = __init__
+    ydl_pool.clear()
+    try:
+        yield
+    finally:
+        yt_dlp.YoutubeDL.__init__ = original
+        ydl_pool.clear()
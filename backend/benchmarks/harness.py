@@ -0,0 +1,95 @@
+import os
+import resource
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from downloader.metrics import dir_size
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss():
+    """Resident set size of this process in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        # ru_maxrss is the peak, in KiB on Linux and bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class ResourceSampler:
+    """Polls RSS and the size of ``temp_dirs()`` on a thread and keeps the peaks."""
+
+    def __init__(self, temp_dirs, interval=0.05):
+        self.temp_dirs = temp_dirs
+        self.interval = interval
+        self.peak_rss = self.start_rss = current_rss()
+        self.peak_disk = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        self.peak_rss = max(self.peak_rss, current_rss())
+        self.peak_disk = max(self.peak_disk, sum(dir_size(d) for d in self.temp_dirs()))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def run_scenario(call, requests, concurrency, temp_dirs=lambda: []):
+    """
+    Invoke ``call(i)`` ``requests`` times from ``concurrency`` threads.
+
+    ``call`` returns True on success. Returns latency percentiles (ms),
+    throughput (requests/s), error count, peak RSS and peak temp disk (MiB).
+    """
+    def timed(i):
+        start = time.perf_counter()
+        try:
+            ok = call(i)
+        except Exception:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    with ResourceSampler(temp_dirs) as sampler:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            outcomes = list(pool.map(timed, range(requests)))
+        wall = time.perf_counter() - started
+
+    latencies = sorted(latency * 1000 for latency, _ in outcomes)
+    mib = 1024 * 1024
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": sum(1 for _, ok in outcomes if not ok),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": sum(latencies) / len(latencies),
+        "max_ms": latencies[-1],
+        "throughput_rps": requests / wall if wall else None,
+        "peak_rss_mb": sampler.peak_rss / mib,
+        "rss_growth_mb": (sampler.peak_rss - sampler.start_rss) / mib,
+        "peak_temp_disk_mb": sampler.peak_disk / mib,
+    }
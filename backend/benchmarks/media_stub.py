@@ -0,0 +1,137 @@
+import functools
+import io
+import re
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+@functools.lru_cache(maxsize=32)
+def synthetic_wav(size):
+    """Silent mono 8 kHz WAV of roughly ``size`` bytes, so FFmpeg has something real to decode."""
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(8000)
+        w.writeframes(b"\0\0" * max((size - 44) // 2, 1))
+    return buf.getvalue()
+
+
+@functools.lru_cache(maxsize=32)
+def synthetic_bytes(size):
+    pattern = bytes(range(256))
+    return (pattern * (size // len(pattern) + 1))[:size]
+
+
+@functools.lru_cache(maxsize=8)
+def synthetic_jpeg(size):
+    """A decodable JPEG for the resizing thumbnail proxy; arbitrary bytes when Pillow is missing."""
+    if Image is None:
+        return synthetic_bytes(size)
+    buf = io.BytesIO()
+    Image.new("RGB", (1280, 720), (90, 120, 200)).save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.handle_media(send_body=False)
+
+    def do_GET(self):
+        self.handle_media(send_body=True)
+
+    def handle_media(self, send_body):
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        size = int(query.get("bytes", ["65536"])[0])
+        delay = float(query.get("delay", ["0"])[0])
+        if parts.path.startswith("/media/"):
+            body = synthetic_wav(size) if query.get("kind", ["wav"])[0] == "wav" else synthetic_bytes(size)
+            content_type = "audio/wav"
+        elif parts.path.startswith("/thumb/"):
+            body, content_type = synthetic_jpeg(size), "image/jpeg"
+        else:
+            self.send_error(404)
+            return
+        if delay:
+            time.sleep(delay)
+
+        # Misbehaving servers for tests: "ranges=ignore" answers a Range request
+        # with the whole body, "total" misreports the size in Content-Range and
+        # "cut" drops the connection that many bytes into responses from byte 0
+        ignore_ranges = query.get("ranges", [""])[0] == "ignore"
+        total = query.get("total", [str(len(body))])[0]
+        cut = int(query.get("cut", ["0"])[0])
+
+        status, start, end = 200, 0, len(body) - 1
+        match = RANGE_RE.match(self.headers.get("Range", ""))
+        if match and match.group(1) and not ignore_ranges:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or end), end)
+            if start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(body)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{total}")
+        self.end_headers()
+        if send_body and cut and start == 0:
+            self.wfile.write(body[:cut])
+            self.close_connection = True
+        elif send_body:
+            self.wfile.write(body[start:end + 1])
+
+
+class MediaStub:
+    """
+    Local HTTP server for synthetic media and thumbnails.
+
+    ``FakeIE`` page URLs also point at it, though they are never fetched.
+    Use as a context manager; it listens on an ephemeral port of 127.0.0.1.
+    """
+
+    def __init__(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), MediaHandler)
+        self._server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def watch_url(self, video_id, **params):
+        return f"{self.base_url}/watch/{video_id}?{urlencode(params)}"
+
+    def media_url(self, name, **params):
+        """A direct link to a WAV file, which only yt-dlp's generic extractor handles."""
+        return f"{self.base_url}/media/{name}.wav?{urlencode(params)}"
+
+    def playlist_url(self, playlist_id, size, **params):
+        return f"{self.base_url}/playlist/{playlist_id}?{urlencode(dict(params, size=size))}"
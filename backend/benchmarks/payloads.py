@@ -0,0 +1,143 @@
+"""
+Size and serialization cost of playlist metadata responses.
+
+``manage.py benchmark_payloads`` builds a YouTube-like playlist info dict
+(about 25 formats per track, each with a long signed URL) and measures the
+response body in each shape the fetch endpoint can produce: the raw
+formats arrays the endpoint used to forward, the ranked format list, and
+the ``fields``/``compact`` options. Every shape is timed with DRF's
+JSONRenderer and with ``ORJSONRenderer``, and sized as sent identity,
+gzip and brotli encoded.
+"""
+import hashlib
+import time
+
+from rest_framework.renderers import JSONRenderer
+
+from downloader.middleware import Compressor, brotli, compression_settings
+from downloader.payloads import metadata_payload, payload_options
+from downloader.renderers import ORJSONRenderer
+
+# (format_id, ext, vcodec, acodec, height, kbit/s), like a YouTube watch page
+FORMATS = [
+    ("sb2", "mhtml", "none", "none", 45, 0), ("sb1", "mhtml", "none", "none", 90, 0),
+    ("sb0", "mhtml", "none", "none", 180, 0),
+    ("139", "m4a", "none", "mp4a.40.5", None, 49), ("249", "webm", "none", "opus", None, 53),
+    ("250", "webm", "none", "opus", None, 70), ("140", "m4a", "none", "mp4a.40.2", None, 129),
+    ("251", "webm", "none", "opus", None, 134), ("18", "mp4", "avc1.42001E", "mp4a.40.2", 360, 480),
+    ("160", "mp4", "avc1.4d400c", "none", 144, 80), ("278", "webm", "vp9", "none", 144, 70),
+    ("394", "mp4", "av01.0.00M.08", "none", 144, 70), ("133", "mp4", "avc1.4d4015", "none", 240, 180),
+    ("242", "webm", "vp9", "none", 240, 150), ("395", "mp4", "av01.0.00M.08", "none", 240, 150),
+    ("134", "mp4", "avc1.4d401e", "none", 360, 400), ("243", "webm", "vp9", "none", 360, 300),
+    ("396", "mp4", "av01.0.01M.08", "none", 360, 300), ("135", "mp4", "avc1.4d401f", "none", 480, 750),
+    ("244", "webm", "vp9", "none", 480, 550), ("397", "mp4", "av01.0.04M.08", "none", 480, 550),
+    ("136", "mp4", "avc1.4d401f", "none", 720, 1500), ("247", "webm", "vp9", "none", 720, 1100),
+    ("398", "mp4", "av01.0.05M.08", "none", 720, 1100), ("137", "mp4", "avc1.640028", "none", 1080, 3000),
+    ("248", "webm", "vp9", "none", 1080, 2200), ("399", "mp4", "av01.0.08M.08", "none", 1080, 2200),
+]
+
+# What a client rendering a track list with download buttons needs
+SHAPES = {
+    "raw formats": None,
+    "ranked": {},
+    "compact": {"compact": True},
+    "fields+compact": {"fields": "title,thumbnail_proxy,formats.url,formats.type,formats.resolution", "compact": True},
+}
+
+
+def signed_url(video_id, format_id, i):
+    # googlevideo URLs carry ~1 KB of signatures and tokens, which do not compress
+    tokens = "&".join(
+        f"p{n}={hashlib.sha256(f'{video_id}-{format_id}-{n}'.encode()).hexdigest()}" for n in range(14)
+    )
+    return f"https://rr{i % 9}---sn-a5mekn7s.googlevideo.com/videoplayback?expire=1700000000&itag={format_id}&{tokens}"
+
+
+def track(i):
+    video_id = f"vid{i:08d}"
+    formats = []
+    for format_id, ext, vcodec, acodec, height, tbr in FORMATS:
+        formats.append({
+            "format_id": format_id,
+            "format_note": f"{height}p" if height else "medium",
+            "url": signed_url(video_id, format_id, i),
+            "ext": ext,
+            "vcodec": vcodec,
+            "acodec": acodec,
+            "height": height,
+            "width": height and height * 16 // 9,
+            "fps": 30 if vcodec != "none" else None,
+            "tbr": tbr,
+            "abr": tbr if vcodec == "none" else None,
+            "filesize": tbr * 1000 * 240 // 8 or None,
+            "protocol": "mhtml" if ext == "mhtml" else "https",
+            "http_headers": {"User-Agent": "Mozilla/5.0", "Accept-Language": "en-us,en;q=0.5"},
+            "downloader_options": {"http_chunk_size": 10485760},
+        })
+    return {
+        "id": video_id,
+        "title": f"Representative track {i}",
+        "uploader": "FetchMate Bench",
+        "thumbnail": f"https://i.ytimg.com/vi/{video_id}/maxresdefault.jpg",
+        "formats": formats,
+    }
+
+
+def playlist(tracks):
+    return {
+        "title": "Representative playlist",
+        "uploader": "FetchMate Bench",
+        "entries": [track(i) for i in range(tracks)],
+    }
+
+
+def raw_payload(info):
+    """The response before formats were ranked: every track's full yt-dlp formats array."""
+    return {
+        "playlist_title": info.get("title"),
+        "uploader": info.get("uploader"),
+        "tracks": [{
+            "title": e.get("title"),
+            "uploader": e.get("uploader"),
+            "thumbnail": e.get("thumbnail"),
+            "formats": e.get("formats", []),
+        } for e in info["entries"]],
+    }
+
+
+def encoded_size(body, coding):
+    compressor = Compressor(coding, compression_settings())
+    return len(compressor.compress(body) + compressor.finish())
+
+
+def best_time(render, data, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        render(data)
+        times.append(time.perf_counter() - started)
+    return min(times) * 1000
+
+
+def measure(tracks=200, repeat=5):
+    """``{shape: {metric: value}}`` for a playlist of ``tracks`` entries."""
+    info = playlist(tracks)
+    drf, fast = JSONRenderer(), ORJSONRenderer()
+    results = {}
+    for name, options in SHAPES.items():
+        if options is None:
+            data = raw_payload(info)
+        else:
+            prefs = payload_options(options)
+            data = metadata_payload(info, **prefs)
+        body = fast.render(data)
+        result = {
+            "drf_ms": best_time(drf.render, data, repeat),
+            "orjson_ms": best_time(fast.render, data, repeat),
+            "identity_kb": len(body) / 1024,
+            "gzip_kb": encoded_size(body, "gzip") / 1024,
+        }
+        if brotli:
+            result["br_kb"] = encoded_size(body, "br") / 1024
+        results[name] = result
+    return results
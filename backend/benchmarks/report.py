@@ -0,0 +1,97 @@
+import json
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+import yt_dlp
+from django.db import connection
+
+# Metric -> True when a larger value is better
+COMPARED_METRICS = {
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+    "throughput_rps": True,
+    "peak_rss_mb": False,
+    "peak_temp_disk_mb": False,
+}
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_report(results, options):
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "yt_dlp": yt_dlp.version.__version__,
+            "platform": platform.platform(),
+            "database": connection.vendor,
+        },
+        "options": options,
+        "results": results,
+    }
+
+
+def save_report(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+def load_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_reports(baseline, current, threshold=0.1):
+    """
+    Compare scenario metrics; returns ``(rows, regressions)``.
+
+    A regression is a metric at least ``threshold`` (relative) worse than
+    the baseline. Skipped scenarios and metrics missing on either side are
+    not compared.
+    """
+    rows, regressions = [], []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if not base or "skipped" in base or "skipped" in result:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            row = (name, metric, old, new, change)
+            rows.append(row)
+            if worse >= threshold:
+                regressions.append(row)
+    return rows, regressions
+
+
+def format_results(results):
+    lines = [f"{'scenario':<28}{'p50':>9}{'p95':>9}{'p99':>9}{'rps':>9}{'err':>5}{'rss MiB':>9}{'tmp MiB':>9}"]
+    for name, r in results.items():
+        if "skipped" in r:
+            lines.append(f"{name:<28}  skipped: {r['skipped']}")
+            continue
+        lines.append(
+            f"{name:<28}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}"
+            f"{r['throughput_rps']:>9.1f}{r['errors']:>5}{r['peak_rss_mb']:>9.1f}{r['peak_temp_disk_mb']:>9.1f}"
+        )
+    return "\n".join(lines)
+
+
+def format_comparison(rows):
+    lines = [f"{'scenario':<28}{'metric':<20}{'baseline':>12}{'current':>12}{'change':>9}"]
+    for name, metric, old, new, change in rows:
+        lines.append(f"{name:<28}{metric:<20}{old:>12.2f}{new:>12.2f}{change:>+9.1%}")
+    return "\n".join(lines)
@@ -0,0 +1,191 @@
+import shutil
+import threading
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.test import Client
+
+from downloader.artifacts import artifact_store
+from downloader.jobs import job_settings
+from downloader.thumbnails import thumbnail_cache
+from downloader.workspace import workspaces
+from users.views import get_tokens_for_user
+
+FETCH_URL = "/api/downloader/fetch/"
+BATCH_URL = "/api/downloader/fetch/batch/"
+STREAM_URL = "/api/downloader/stream/"
+SIGNUP_URL = "/api/users/signup/"
+LOGIN_URL = "/api/users/login/"
+PASSWORD = "bench-password-123"
+
+
+class Skip(Exception):
+    pass
+
+
+class BenchContext:
+    """Shared state for one benchmark run: the media stub, a user and per-thread clients."""
+
+    def __init__(self, stub, options):
+        self.stub = stub
+        self.options = options
+        self.run_id = uuid.uuid4().hex[:8]
+        self._local = threading.local()
+        user = self.create_user("bench")
+        self.token = get_tokens_for_user(user)["accessToken"]
+
+    def create_user(self, name):
+        return get_user_model().objects.create_user(
+            username=f"{name}-{self.run_id}", email=f"{name}-{self.run_id}@bench.local", password=PASSWORD,
+        )
+
+    def client(self):
+        if not hasattr(self._local, "client"):
+            self._local.client = Client()
+        return self._local.client
+
+    def post(self, path, data, auth=True):
+        """POST JSON and drain the response; returns ``(status, saw_error_item)``."""
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {self.token}"} if auth else {}
+        response = self.client().post(path, data, content_type="application/json", secure=True, **headers)
+        return self.drain(response)
+
+    def get(self, path, params, **headers):
+        headers["HTTP_AUTHORIZATION"] = f"Bearer {self.token}"
+        return self.drain(self.client().get(path, params, secure=True, **headers))
+
+    def drain(self, response):
+        saw_error = False
+        if response.streaming:
+            for chunk in response.streaming_content:
+                saw_error = saw_error or b'"error"' in chunk
+        response.close()
+        return response.status_code, saw_error
+
+    def ok(self, path, data, status=200, auth=True):
+        code, saw_error = self.post(path, data, auth)
+        return code == status and not saw_error
+
+    def watch(self, name):
+        return self.stub.watch_url(
+            f"{name}-{self.run_id}", latency=self.options["latency"], bytes=self.options["media_bytes"],
+        )
+
+    def playlist(self, name):
+        return self.stub.playlist_url(
+            f"{name}-{self.run_id}", self.options["playlist_size"],
+            latency=self.options["latency"], bytes=self.options["media_bytes"],
+        )
+
+    def temp_dirs(self):
+        dirs = list(workspaces.roots)
+        dirs.append(job_settings()["ROOT"])
+        if artifact_store:
+            dirs.append(artifact_store.root)
+        if thumbnail_cache:
+            dirs.append(thumbnail_cache.root)
+        return dirs
+
+
+def require_ffmpeg():
+    if not shutil.which("ffmpeg"):
+        raise Skip("ffmpeg not found")
+
+
+def metadata_cold(ctx):
+    return lambda i: ctx.ok(FETCH_URL, {"url": ctx.watch(f"cold-{i}")})
+
+
+def metadata_warm(ctx):
+    url = ctx.watch("warm")
+    ctx.post(FETCH_URL, {"url": url})
+    return lambda i: ctx.ok(FETCH_URL, {"url": url})
+
+
+def batch(ctx):
+    size = ctx.options["batch_size"]
+    return lambda i: ctx.ok(BATCH_URL, {"urls": [ctx.watch(f"batch-{i}-{j}") for j in range(size)]})
+
+
+def playlist_stream(ctx):
+    size = ctx.options["playlist_size"]
+    return lambda i: ctx.ok(FETCH_URL, {"url": ctx.playlist(f"stream-{i}"), "stream": True, "limit": size})
+
+
+def proxy_stream(ctx):
+    url = ctx.watch("proxy")
+    ctx.post(FETCH_URL, {"url": url})
+
+    def call(i):
+        # Alternate whole-file and ranged reads, as players seeking would
+        headers = {"HTTP_RANGE": "bytes=1024-"} if i % 2 else {}
+        status, _ = ctx.get(STREAM_URL, {"url": url, "format_id": "18"}, **headers)
+        return status == (206 if i % 2 else 200)
+    return call
+
+
+def thumbnail(ctx):
+    url = ctx.watch("thumb")
+    path = ctx.client().post(
+        FETCH_URL, {"url": url}, content_type="application/json", secure=True,
+        HTTP_AUTHORIZATION=f"Bearer {ctx.token}",
+    ).json()["thumbnail_proxy"]
+    return lambda i: ctx.get(path, {"w": 320})[0] == 200
+
+
+def mp3_cold(ctx):
+    require_ffmpeg()
+    return lambda i: ctx.ok(FETCH_URL, {"url": ctx.watch(f"mp3-{i}"), "convert_mp3": True})
+
+
+def mp3_cached(ctx):
+    require_ffmpeg()
+    if not artifact_store:
+        raise Skip("artifact cache disabled")
+    url = ctx.watch("mp3-cached")
+    ctx.post(FETCH_URL, {"url": url, "convert_mp3": True})
+    return lambda i: ctx.ok(FETCH_URL, {"url": url, "convert_mp3": True})
+
+
+def playlist_zip(ctx):
+    require_ffmpeg()
+    return lambda i: ctx.ok(FETCH_URL, {"url": ctx.playlist(f"zip-{i}"), "convert_mp3": True})
+
+
+def signup(ctx):
+    def call(i):
+        name = f"signup-{i}-{ctx.run_id}"
+        data = {"username": name, "email": f"{name}@bench.local", "password": PASSWORD}
+        return ctx.ok(SIGNUP_URL, data, status=201, auth=False)
+    return call
+
+
+def signup_taken(ctx):
+    user = ctx.create_user("taken")
+
+    def call(i):
+        data = {"username": f"taken-{i}-{ctx.run_id}", "email": user.email, "password": PASSWORD}
+        return ctx.ok(SIGNUP_URL, data, status=400, auth=False)
+    return call
+
+
+def login(ctx):
+    user = ctx.create_user("login")
+    return lambda i: ctx.ok(LOGIN_URL, {"email": user.email, "password": PASSWORD}, auth=False)
+
+
+# name -> setup(ctx) returning the per-request call
+SCENARIOS = {
+    "fetch.metadata.cold": metadata_cold,
+    "fetch.metadata.warm": metadata_warm,
+    "fetch.batch": batch,
+    "fetch.playlist.stream": playlist_stream,
+    "fetch.proxy.stream": proxy_stream,
+    "fetch.thumbnail": thumbnail,
+    "fetch.mp3.cold": mp3_cold,
+    "fetch.mp3.cached": mp3_cached,
+    "fetch.playlist.zip": playlist_zip,
+    "users.signup": signup,
+    "users.signup.taken": signup_taken,
+    "users.login": login,
+}
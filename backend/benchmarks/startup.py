@@ -0,0 +1,84 @@
+"""
+One cold start of the app, timed; ``manage.py benchmark_startup`` runs it
+in a fresh interpreter per sample.
+
+Prints a JSON object with the milliseconds taken by ``django.setup()``,
+importing the URLconf (what every worker and management command pays),
+the optional yt-dlp warmup and the first successful fetch of a direct
+media link, which goes through the generic extractor and so has to look
+at every other extractor first. Creating the test database and the
+media stub in between is not counted.
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+from importlib import import_module
+
+STARTED = time.perf_counter()
+
+
+def elapsed_ms(since):
+    return (time.perf_counter() - since) * 1000
+
+
+def main(warm=False):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+    result = {"warm": warm}
+
+    started = time.perf_counter()
+    import django
+    from django.conf import settings
+
+    django.setup()
+    result["setup_ms"] = elapsed_ms(started)
+
+    started = time.perf_counter()
+    import_module(settings.ROOT_URLCONF)
+    result["urlconf_ms"] = elapsed_ms(started)
+    result["yt_dlp_loaded"] = "yt_dlp" in sys.modules
+
+    result["warmup_ms"] = 0.0
+    if warm:
+        from downloader.extraction import warm_up
+
+        started = time.perf_counter()
+        warm_up()
+        result["warmup_ms"] = elapsed_ms(started)
+    result["boot_ms"] = elapsed_ms(STARTED)
+
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    from benchmarks.media_stub import MediaStub
+    from benchmarks.scenarios import FETCH_URL, BenchContext
+
+    with tempfile.TemporaryDirectory(prefix="bench-startup-") as scratch:
+        if connection.vendor == "sqlite":
+            connection.settings_dict["TEST"]["NAME"] = f"{scratch}/bench.sqlite3"
+        setup_test_environment(debug=False)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with MediaStub() as stub:
+                ctx = BenchContext(stub, {})
+                url = stub.media_url("startup", bytes=64 * 1024)
+                client = Client()
+                started = time.perf_counter()
+                response = client.post(
+                    FETCH_URL, {"url": url}, content_type="application/json", secure=True,
+                    HTTP_AUTHORIZATION=f"Bearer {ctx.token}",
+                )
+                result["first_response_ms"] = elapsed_ms(started)
+                result["status"] = response.status_code
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    result["time_to_first_response_ms"] = result["boot_ms"] + result["first_response_ms"]
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main(warm="--warm" in sys.argv[1:])
@@ -1,3 +1,9 @@
 from django.contrib import admin
+from .models import DownloadJob
 
-# Register your models here.
+
+@admin.register(DownloadJob)
+class DownloadJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "user", "status", "progress", "convert_mp3", "audio_codec", "created_at", "finished_at")
+    list_filter = ("status", "convert_mp3", "audio_codec")
+    search_fields = ("url", "user__username")
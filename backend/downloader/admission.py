@@ -0,0 +1,259 @@
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+from .metrics import ADMISSION_REJECTIONS, Gauge
+from .models import DownloadJob
+
+
+def admission_settings():
+    conf = {
+        "ENABLED": True,
+        # role -> kind -> (requests per minute, burst), one bucket per user
+        "USER_RATES": {
+            "user": {"metadata": (60, 20), "download": (6, 3), "stream": (120, 30)},
+            "admin": {"metadata": (600, 100), "download": (60, 20), "stream": (600, 100)},
+        },
+        # role -> kind -> (requests per minute, burst), shared by the whole role
+        "ROLE_RATES": {},
+        "DOWNLOAD_SLOTS": 4,
+        # Waiters hold a web worker each, so the queue stays short and brief;
+        # QUEUE_TIMEOUT 0 refuses as soon as every slot is busy.
+        "MAX_WAITING": 4,
+        "MAX_WAITING_PER_USER": 2,
+        "QUEUE_TIMEOUT": 2,
+        "MAX_ACTIVE_JOBS_PER_USER": 5,
+    }
+    conf.update(getattr(settings, "DOWNLOADER_ADMISSION", {}))
+    return conf
+
+
+class RateLimited(Exception):
+    """Request refused by admission control; ``retry_after`` is in whole seconds."""
+
+    def __init__(self, message, retry_after, reason):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = max(int(math.ceil(retry_after)), 1)
+        self.reason = reason
+
+
+class TokenBucket:
+    def __init__(self, per_minute, burst):
+        self.rate = per_minute / 60.0
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def wait_time(self, cost, now):
+        """Seconds until ``cost`` tokens are available (0 if they are now)."""
+        # A request larger than the burst is admitted once the bucket is full
+        cost = min(cost, self.capacity)
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        if self.tokens >= cost:
+            return 0.0
+        if not self.rate:
+            return math.inf
+        return (cost - self.tokens) / self.rate
+
+    def take(self, cost):
+        self.tokens -= min(cost, self.capacity)
+
+    def is_full(self, now):
+        """True once the bucket has refilled, when it is no different from a new one."""
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class RateLimiter:
+    """
+    Token buckets per user and per role, by kind of request.
+
+    A request is admitted only if every bucket it draws from has enough
+    tokens, and then takes them from all of them. State is per process;
+    buckets that have refilled are dropped every ``sweep_interval``
+    seconds, so memory follows active users rather than every user seen.
+    """
+
+    def __init__(self, user_rates, role_rates, sweep_interval=60):
+        self.user_rates = user_rates
+        self.role_rates = role_rates
+        self.sweep_interval = sweep_interval
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def _sweep(self, now):
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if not bucket.is_full(now)}
+        self._last_sweep = now
+
+    def _bucket(self, key, rate):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(*rate)
+        return bucket
+
+    def check(self, user, kind, cost=1):
+        role = getattr(user, "role", "user")
+        buckets = []
+        rate = self.user_rates.get(role, {}).get(kind)
+        if rate:
+            buckets.append(("user", user.pk, kind, rate))
+        rate = self.role_rates.get(role, {}).get(kind)
+        if rate:
+            buckets.append(("role", role, kind, rate))
+
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_sweep >= self.sweep_interval:
+                self._sweep(now)
+            resolved = [(key[0], self._bucket(key[:3], key[3])) for key in buckets]
+            waits = [(bucket.wait_time(cost, now), scope) for scope, bucket in resolved]
+            wait, scope = max(waits, default=(0.0, None))
+            if wait:
+                ADMISSION_REJECTIONS.inc(reason=f"{scope}_rate")
+                raise RateLimited("Too many requests, slow down", 60 if wait == math.inf else wait, f"{scope}_rate")
+            for _, bucket in resolved:
+                bucket.take(cost)
+
+
+class _Ticket:
+    __slots__ = ("granted",)
+
+    def __init__(self):
+        self.granted = False
+
+
+class FairScheduler:
+    """
+    A fixed number of slots for expensive work, handed out fairly.
+
+    When every slot is busy, callers wait in per-user queues that are
+    served round-robin, so one user's burst cannot starve the others.
+    Waiting ties up the caller's web worker, so the wait is meant to be
+    short: callers beyond ``max_waiting`` (or ``max_waiting_per_user``),
+    or still waiting after ``timeout`` seconds, are refused with
+    ``RateLimited``, and a ``timeout`` of 0 refuses them right away.
+    """
+
+    def __init__(self, slots, max_waiting, max_waiting_per_user, timeout):
+        self.slots = slots
+        self.max_waiting = max_waiting
+        self.max_waiting_per_user = max_waiting_per_user
+        self.timeout = timeout
+        self._free = slots
+        self._queues = OrderedDict()  # user -> deque of tickets, in serving order
+        self._waiting = 0
+        self._avg_hold = 10.0  # seconds, exponentially averaged
+        self._cond = threading.Condition()
+
+    @property
+    def in_use(self):
+        return self.slots - self._free
+
+    @property
+    def waiting(self):
+        return self._waiting
+
+    def retry_after(self):
+        return self._avg_hold * (self._waiting + 1) / self.slots
+
+    def acquire(self, user_key):
+        """Wait for a slot; returns a callable that releases it (safe to call twice)."""
+        with self._cond:
+            if self._free and not self._waiting:
+                self._free -= 1
+                return self._releaser()
+
+            queue = self._queues.get(user_key)
+            if (
+                self.timeout <= 0
+                or self._waiting >= self.max_waiting
+                or (queue and len(queue) >= self.max_waiting_per_user)
+            ):
+                ADMISSION_REJECTIONS.inc(reason="queue_full")
+                raise RateLimited("Server is busy, try again shortly", self.retry_after(), "queue_full")
+
+            ticket = _Ticket()
+            self._queues.setdefault(user_key, deque()).append(ticket)
+            self._waiting += 1
+            deadline = time.monotonic() + self.timeout
+            while not ticket.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._withdraw(user_key, ticket)
+                    ADMISSION_REJECTIONS.inc(reason="queue_timeout")
+                    raise RateLimited("Server is busy, try again shortly", self.retry_after(), "queue_timeout")
+                self._cond.wait(remaining)
+            return self._releaser()
+
+    def _withdraw(self, user_key, ticket):
+        queue = self._queues[user_key]
+        queue.remove(ticket)
+        if not queue:
+            del self._queues[user_key]
+        self._waiting -= 1
+
+    def _releaser(self):
+        started = time.monotonic()
+        released = []
+
+        def release():
+            if released:
+                return
+            released.append(True)
+            with self._cond:
+                self._avg_hold = 0.8 * self._avg_hold + 0.2 * (time.monotonic() - started)
+                self._grant_next()
+        return release
+
+    def _grant_next(self):
+        # Hand the slot straight to the next user in round-robin order
+        if not self._queues:
+            self._free += 1
+            return
+        user_key, queue = next(iter(self._queues.items()))
+        queue.popleft().granted = True
+        self._waiting -= 1
+        if queue:
+            self._queues.move_to_end(user_key)
+        else:
+            del self._queues[user_key]
+        self._cond.notify_all()
+
+
+def check_active_jobs(user):
+    """Refuse a new job while ``user`` already has too many queued or running."""
+    limit = admission_settings()["MAX_ACTIVE_JOBS_PER_USER"]
+    if not limit:
+        return
+    active = DownloadJob.objects.filter(
+        user_id=user.pk, status__in=[DownloadJob.STATUS_QUEUED, DownloadJob.STATUS_RUNNING],
+    ).count()
+    if active >= limit:
+        ADMISSION_REJECTIONS.inc(reason="active_jobs")
+        raise RateLimited(f"At most {limit} jobs can be queued or running at once", 30, "active_jobs")
+
+
+def build_admission():
+    conf = admission_settings()
+    if not conf["ENABLED"]:
+        return None, None
+    limiter = RateLimiter(conf["USER_RATES"], conf["ROLE_RATES"])
+    scheduler = FairScheduler(
+        conf["DOWNLOAD_SLOTS"], conf["MAX_WAITING"], conf["MAX_WAITING_PER_USER"], conf["QUEUE_TIMEOUT"],
+    )
+    return limiter, scheduler
+
+
+rate_limiter, download_scheduler = build_admission()
+
+if download_scheduler:
+    Gauge(
+        "fetchmate_download_slots", "Expensive download slots in use and callers waiting for one.", ("state",),
+        collect=lambda: {("in_use",): download_scheduler.in_use, ("waiting",): download_scheduler.waiting},
+    )
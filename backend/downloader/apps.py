@@ -1,6 +1,32 @@
+import logging
+import os
+import sys
+
 from django.apps import AppConfig
 
+logger = logging.getLogger(__name__)
+
+
+def is_management_command():
+    """True under ``manage.py`` commands such as migrate, test or shell, which never serve requests."""
+    return os.path.basename(sys.argv[0]) == "manage.py" and sys.argv[1:2] != ["runserver"]
+
 
 class DownloaderConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'downloader'
+
+    def ready(self):
+        from .workspace import workspace_settings, workspaces
+        from .ydl_pool import ydl_pool_settings
+
+        if workspace_settings()["SWEEP_ON_START"] and not is_management_command():
+            # A worker that never allocates still reclaims directories left by crashed ones
+            workspaces.start()
+
+        # yt-dlp is otherwise imported by the first request that needs it
+        if ydl_pool_settings()["WARMUP"]:
+            from .extraction import warm_up
+
+            timings = warm_up()
+            logger.info("yt-dlp warmed up: %s", ", ".join(f"{step} {seconds:.2f}s" for step, seconds in timings.items()))
@@ -0,0 +1,195 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import uuid
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .cache import canonicalize_url
+from .metrics import ARTIFACT_CACHE
+from .models import Artifact
+
+logger = logging.getLogger(__name__)
+
+
+def artifact_settings():
+    conf = {
+        "ENABLED": True,
+        "ROOT": os.path.join(settings.BASE_DIR, "artifacts"),
+        "MAX_BYTES": 5 * 1024 ** 3,
+        "POLICY": "lru",
+    }
+    conf.update(getattr(settings, "DOWNLOADER_ARTIFACTS", {}))
+    return conf
+
+
+def artifact_key(extractor, video_id, codec, quality):
+    return f"{extractor.lower()}/{video_id}/{codec}/{quality}"
+
+
+class ArtifactStore:
+    """
+    Persistent cache of converted files, content-addressed by artifact key.
+
+    Files are published atomically (hard link or copy into the store, then
+    rename) and handed out as hard links into the caller's work dir, so an
+    eviction never pulls a file out from under a response being sent.
+
+    The store's size is tracked as a running total so a publish does not
+    sum the whole table; it is re-read from the database on the first
+    publish, every ``RESYNC_EVERY`` publishes (other workers publish too)
+    and whenever it says the store is over ``max_bytes``.
+    """
+
+    RESYNC_EVERY = 50
+
+    def __init__(self, root, max_bytes, policy="lru"):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self._total = None
+        self._publishes = 0
+        self._lock = threading.Lock()
+
+    def _account(self, added, publish=False):
+        """Add ``added`` bytes to the running total; returns it, or None when it needs re-reading."""
+        with self._lock:
+            if publish:
+                self._publishes += 1
+                if not self._publishes % self.RESYNC_EVERY:
+                    self._total = None
+            if self._total is not None:
+                self._total = max(self._total + added, 0)
+            return self._total
+
+    def path_for(self, key, ext):
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.root, digest[:2], digest[2:4], f"{digest}.{ext}")
+
+    def lookup(self, key=None, url=None, codec=None, quality=None):
+        """Return the artifact for ``key``, or for a source ``url``, if its file still exists."""
+        if key:
+            artifact = Artifact.objects.filter(key=key).first()
+        elif url:
+            artifact = Artifact.objects.filter(
+                source_url=canonicalize_url(url), codec=codec, quality=quality,
+            ).first()
+        else:
+            return None
+
+        by = "key" if key else "url"
+        if artifact is None:
+            ARTIFACT_CACHE.inc(result="miss", by=by)
+            return None
+        if not os.path.exists(artifact.path):
+            artifact.delete()
+            self._account(-artifact.size)
+            ARTIFACT_CACHE.inc(result="miss", by=by)
+            return None
+        ARTIFACT_CACHE.inc(result="hit", by=by)
+
+        Artifact.objects.filter(pk=artifact.pk).update(hits=F("hits") + 1, last_accessed_at=timezone.now())
+        return artifact
+
+    def checkout(self, artifact, dest_dir):
+        """Place ``artifact`` in ``dest_dir`` under its display filename and return the path."""
+        os.makedirs(dest_dir, exist_ok=True)
+        dest = os.path.join(dest_dir, artifact.filename)
+        try:
+            os.link(artifact.path, dest)
+        except FileExistsError:
+            pass
+        except OSError:
+            shutil.copyfile(artifact.path, dest)
+        return dest
+
+    def fetch(self, extractor, video_id, codec, quality, dest_dir):
+        """Check out the cached artifact for a video into ``dest_dir``; None on a miss."""
+        if not extractor or not video_id:
+            return None
+        artifact = self.lookup(key=artifact_key(extractor, video_id, codec, quality))
+        return self.checkout(artifact, dest_dir) if artifact else None
+
+    def publish(self, src, key, extractor, video_id, codec, quality, source_url=""):
+        """Atomically add ``src`` to the store and return its stored path; ``src`` is left in place."""
+        ext = os.path.splitext(src)[1].lstrip(".") or codec
+        final = self.path_for(key, ext)
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+
+        tmp = os.path.join(os.path.dirname(final), f".publish-{uuid.uuid4().hex}")
+        try:
+            try:
+                os.link(src, tmp)
+            except OSError:
+                shutil.copyfile(src, tmp)
+            os.replace(tmp, final)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+        fields = {
+            "source_url": canonicalize_url(source_url) if source_url else "",
+            "extractor": extractor.lower(),
+            "video_id": video_id,
+            "codec": codec,
+            "quality": quality,
+            "path": final,
+            "filename": os.path.basename(src),
+            "size": os.path.getsize(final),
+            "last_accessed_at": timezone.now(),
+        }
+        try:
+            _, created = Artifact.objects.update_or_create(key=key, defaults=fields)
+        except IntegrityError:
+            # Another worker published the same key concurrently; same content
+            created = False
+
+        total = self._account(fields["size"] if created else 0, publish=True)
+        if total is None or total > self.max_bytes:
+            self.evict()
+        return final
+
+    def evict(self):
+        """Delete artifacts until the store fits in ``max_bytes``."""
+        total = Artifact.objects.aggregate(total=Sum("size"))["total"] or 0
+        if total <= self.max_bytes:
+            with self._lock:
+                self._total = total
+            return 0
+
+        if self.policy == "lfu":
+            order = ("hits", "last_accessed_at")
+        else:
+            order = ("last_accessed_at",)
+
+        evicted = 0
+        for artifact in Artifact.objects.order_by(*order).iterator():
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(artifact.path)
+            except FileNotFoundError:
+                pass
+            artifact.delete()
+            total -= artifact.size
+            evicted += 1
+        with self._lock:
+            self._total = total
+        logger.info("Evicted %s artifacts from %s", evicted, self.root)
+        return evicted
+
+
+def build_artifact_store():
+    conf = artifact_settings()
+    if not conf["ENABLED"]:
+        return None
+    return ArtifactStore(conf["ROOT"], conf["MAX_BYTES"], conf["POLICY"])
+
+
+artifact_store = build_artifact_store()
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import AuthenticationFailed
+from users.authentication import StatelessJWTAuthentication
+
+from .admission import RateLimited, rate_limiter
+from .cache import url_host
+from .downloads import download_mp3
+from .extraction import download_error_message, extract_metadata
+from .formats import parse_flag
+from .hosts import HostUnavailable
+from .lazy import download_error
+from .metrics import record_error, tag_request
+from .payloads import is_youtube_music_url, metadata_payload, payload_options
+from .renderers import json_response
+from .thumbnails import prefetch_thumbnails
+from .transcode import audio_target
+from .views import mp3_response
+from .workspace import QuotaExceeded, StorageUnavailable
+
+logger = logging.getLogger(__name__)
+
+
+def async_settings():
+    conf = {
+        "EXECUTOR_WORKERS": 32,
+        "MAX_PENDING": 256,
+        "TIMEOUT": 120,
+    }
+    conf.update(getattr(settings, "DOWNLOADER_ASYNC", {}))
+    return conf
+
+
+class ExecutorBusy(Exception):
+    """Every executor slot is taken; the request is refused rather than queued."""
+
+    def __init__(self, message, retry_after=5):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+
+
+class BoundedExecutor:
+    """
+    Thread pool for blocking yt-dlp work with a cap on queued calls.
+
+    yt-dlp calls are mostly network waits, so threads (not processes)
+    are enough; ``max_pending`` makes overload fail fast, with
+    ``ExecutorBusy``, instead of queueing requests behind minutes of backlog.
+    """
+
+    def __init__(self, workers, max_pending):
+        self.max_pending = max_pending
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="fetch-async")
+
+    async def run(self, fn, *args, timeout=None, on_abandon=None):
+        """
+        Run ``fn(*args)`` on the pool and await it.
+
+        If the caller times out or is cancelled (client disconnect), the
+        thread cannot be interrupted; ``on_abandon(result)`` is called with
+        its result once it finishes so resources it acquired are released.
+        Raises ``ExecutorBusy`` when ``max_pending`` calls are already in.
+        """
+        with self._lock:
+            # Checked and reserved together, so concurrent callers cannot overshoot
+            if self._pending >= self.max_pending:
+                raise ExecutorBusy("Server is busy, try again shortly")
+            self._pending += 1
+        future = self._pool.submit(fn, *args)
+        future.add_done_callback(lambda f: self._done())
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if on_abandon:
+                future.add_done_callback(lambda f: f.exception() is None and on_abandon(f.result()))
+            raise
+
+    def _done(self):
+        with self._lock:
+            self._pending -= 1
+
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        conf = async_settings()
+        _executor = BoundedExecutor(conf["EXECUTOR_WORKERS"], conf["MAX_PENDING"])
+    return _executor
+
+
+async def authenticate(request):
+    """Apply the JWT authentication DRF views use; returns the user or None."""
+    try:
+        result = await sync_to_async(StatelessJWTAuthentication().authenticate)(request)
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+async def _aiter_sync(iterator):
+    # Pull chunks from a blocking iterator without buffering it all in memory
+    iterator = iter(iterator)
+    done = object()
+    while True:
+        chunk = await sync_to_async(next, thread_sensitive=False)(iterator, done)
+        if chunk is done:
+            return
+        yield chunk
+
+
+@csrf_exempt
+async def fetch_link_async(request):
+    """
+    ASGI counterpart of ``fetch_link``.
+
+    The request coroutine only awaits; yt-dlp work runs on a bounded
+    executor with a per-request timeout, so one event loop can hold many
+    slow extractions in flight.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    user = await authenticate(request)
+    if user is None or not user.is_authenticated:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+
+    try:
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        return JsonResponse({"error": "Invalid JSON body"}, status=400)
+
+    url = data.get("url")
+    convert_mp3 = parse_flag(data.get("convert_mp3", False))
+    if not url:
+        return JsonResponse({"error": "URL is required"}, status=400)
+
+    if convert_mp3:
+        try:
+            codec, quality = audio_target(data.get("audio_codec"), data.get("audio_quality"))
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+    tag_request(host=url_host(url), mode="mp3" if convert_mp3 else "metadata")
+    executor = get_executor()
+    timeout = async_settings()["TIMEOUT"]
+
+    try:
+        if rate_limiter:
+            rate_limiter.check(user, "download" if convert_mp3 else "metadata")
+        if convert_mp3:
+            claim = ExitStack()
+            download, work_dir = await executor.run(
+                claim.enter_context, download_mp3(url, user.pk, codec, quality), timeout=timeout, on_abandon=lambda _: claim.close(),
+            )
+            response = await sync_to_async(mp3_response)(request, download, work_dir, claim.close)
+            if response.streaming:
+                response.streaming_content = _aiter_sync(response.streaming_content)
+            return response
+
+        info = await executor.run(extract_metadata, url, timeout=timeout)
+        payload = metadata_payload(info, is_youtube_music_url(url), **payload_options(data))
+        if "entries" in info:
+            prefetch_thumbnails(e.get("thumbnail") for e in info["entries"])
+        return json_response(payload)
+
+    except RateLimited as e:
+        response = JsonResponse({"error": e.message}, status=429)
+        response["Retry-After"] = str(e.retry_after)
+        return response
+
+    except (ExecutorBusy, StorageUnavailable, HostUnavailable) as e:
+        response = JsonResponse({"error": e.message}, status=503)
+        response["Retry-After"] = str(e.retry_after)
+        return response
+
+    except QuotaExceeded as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    except asyncio.TimeoutError:
+        logger.warning("fetch_link_async timed out after %ss for %s", timeout, url)
+        return JsonResponse({"error": "Timed out while processing the link"}, status=504)
+
+    except download_error() as e:
+        record_error(e, url_host(url))
+        if "Sign in to confirm" not in str(e):
+            logger.warning("YT-DLP download error: %s", e)
+        return JsonResponse({"error": download_error_message(e)}, status=400)
+
+    except Exception as e:
+        logger.error("Unexpected error in fetch_link_async: %s", e)
+        return JsonResponse({"error": "Failed to process the link"}, status=400)
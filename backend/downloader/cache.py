@@ -0,0 +1,259 @@
+import hashlib
+import logging
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+YOUTUBE_HOSTS = {
+    "youtube.com", "www.youtube.com", "m.youtube.com",
+    "music.youtube.com", "youtube-nocookie.com", "www.youtube-nocookie.com",
+}
+
+# Query params that never change what yt-dlp extracts
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "igshid", "igsh", "mc_cid", "mc_eid",
+    "si", "feature", "ref", "ref_src", "spm", "_r", "is_from_webapp", "sender_device",
+}
+YOUTUBE_IGNORED_PARAMS = {"t", "start", "pp", "index", "ab_channel", "app", "embeds_referring_euri"}
+
+YOUTUBE_ID_PATH = re.compile(r"^/(?:shorts|embed|live|v)/([\w-]{11})")
+
+
+def canonicalize_url(url):
+    """Normalize a media URL so equivalent links share one cache entry."""
+    url = url.strip()
+    if "://" not in url:
+        url = "https://" + url
+
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    path = parts.path or "/"
+    params = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in TRACKING_PARAMS and not k.lower().startswith("utm_")
+    ]
+
+    if host in ("youtu.be", "www.youtu.be"):
+        video_id = path.strip("/").split("/")[0]
+        host, path = "www.youtube.com", "/watch"
+        params = [("v", video_id)] + [(k, v) for k, v in params if k != "v"]
+    elif host in YOUTUBE_HOSTS:
+        host = "www.youtube.com"
+        match = YOUTUBE_ID_PATH.match(path)
+        if match:
+            path = "/watch"
+            params = [("v", match.group(1))] + [(k, v) for k, v in params if k != "v"]
+
+    if host == "www.youtube.com":
+        params = [(k, v) for k, v in params if k not in YOUTUBE_IGNORED_PARAMS]
+    elif host.startswith("www."):
+        host = host[4:]
+
+    if len(path) > 1:
+        path = path.rstrip("/")
+
+    netloc = host if not parts.port or parts.port in (80, 443) else f"{host}:{parts.port}"
+    return urlunsplit(("https", netloc, path, urlencode(sorted(params)), ""))
+
+
+def url_host(url):
+    return urlsplit(canonicalize_url(url)).hostname or ""
+
+
+def cache_key(url, namespace="meta"):
+    digest = hashlib.sha1(canonicalize_url(url).encode()).hexdigest()
+    return f"fetchmate:{namespace}:{digest}"
+
+
+# ============================================
+# Backends
+# ============================================
+class LRUBackend:
+    """
+    Bounded in-process cache; evicts the least recently used entry.
+
+    Values are stored pickled, like Django's local-memory cache, so every
+    ``get`` returns a fresh copy that callers may mutate freely.
+    """
+
+    def __init__(self, max_entries=512, on_evict=None):
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+        return pickle.loads(value)
+
+    def set(self, key, value, ttl):
+        evicted = 0
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                evicted += 1
+        if evicted and self.on_evict:
+            self.on_evict(evicted)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class DjangoCacheBackend:
+    """Shares entries between workers through a configured Django cache."""
+
+    def __init__(self, alias="default"):
+        self.cache = caches[alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, ttl):
+        self.cache.set(key, value, timeout=ttl)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class NullBackend:
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+# ============================================
+# Metadata cache
+# ============================================
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def as_dict(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class MetadataCache:
+    """
+    Caches sanitized yt-dlp info dicts by canonical URL.
+
+    Entries never outlive the signed format URLs inside them: the TTL is
+    the per-extractor TTL capped by the earliest ``expire`` found in a URL.
+    """
+
+    def __init__(self, backend, ttls=None, expiry_margin=300):
+        self.backend = backend
+        self.ttls = ttls or {"default": 600}
+        self.expiry_margin = expiry_margin
+        self.stats = CacheStats()
+
+    def get(self, url):
+        value = self.backend.get(cache_key(url))
+        self.stats.incr("hits" if value is not None else "misses")
+        return value
+
+    def set(self, url, info):
+        ttl = self.ttl_for(info)
+        if ttl > 0:
+            self.backend.set(cache_key(url), info, ttl)
+
+    def delete(self, url):
+        self.backend.delete(cache_key(url))
+
+    def get_or_extract(self, url, extract):
+        info = self.get(url)
+        if info is None:
+            info = extract()
+            self.set(url, info)
+        return info
+
+    def ttl_for(self, info):
+        extractor = (info.get("extractor_key") or info.get("extractor") or "").lower()
+        ttl = self.ttls.get(extractor, self.ttls.get("default", 600))
+
+        expires_at = earliest_url_expiry(info)
+        if expires_at is not None:
+            ttl = min(ttl, int(expires_at - time.time() - self.expiry_margin))
+        return max(ttl, 0)
+
+
+EXPIRE_PARAM = re.compile(r"[?&/]expire[=/](\d{9,11})")
+
+
+def earliest_url_expiry(info):
+    """Return the soonest unix ``expire`` timestamp among format URLs, if any."""
+    earliest = None
+    entries = info.get("entries") or []
+    for item in [info, *[e for e in entries if e]]:
+        for f in item.get("formats") or []:
+            match = EXPIRE_PARAM.search(f.get("url") or "")
+            if match:
+                ts = int(match.group(1))
+                earliest = ts if earliest is None else min(earliest, ts)
+    return earliest
+
+
+def build_metadata_cache():
+    conf = getattr(settings, "DOWNLOADER_METADATA_CACHE", {})
+    name = conf.get("BACKEND", "lru")
+    cache = MetadataCache(
+        NullBackend(),
+        ttls=conf.get("TTL"),
+        expiry_margin=conf.get("EXPIRY_MARGIN", 300),
+    )
+
+    if name == "lru":
+        cache.backend = LRUBackend(
+            conf.get("MAX_ENTRIES", 512),
+            on_evict=lambda n: cache.stats.incr("evictions", n),
+        )
+    elif name == "django":
+        cache.backend = DjangoCacheBackend(conf.get("CACHE_ALIAS", "default"))
+    elif name != "none":
+        logger.warning("Unknown metadata cache backend %r, caching disabled", name)
+    return cache
+
+
+metadata_cache = build_metadata_cache()
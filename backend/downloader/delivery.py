@@ -0,0 +1,178 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.encoding import escape_uri_path
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def delivery_settings():
+    conf = {
+        "OFFLOAD": "",  # "", "x-accel" (nginx) or "x-sendfile" (Apache/lighttpd)
+        "ACCEL_LOCATIONS": {},  # filesystem root -> internal nginx location
+        "BLOCK_SIZE": 256 * 1024,
+    }
+    conf.update(getattr(settings, "DOWNLOADER_DELIVERY", {}))
+    return conf
+
+
+class _ClosingFile:
+    """File proxy that runs a callback once the response has closed it."""
+
+    def __init__(self, f, on_close=None):
+        self._f = f
+        self._on_close = on_close
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def close(self):
+        try:
+            self._f.close()
+        finally:
+            if self._on_close:
+                on_close, self._on_close = self._on_close, None
+                on_close()
+
+
+class _RangeFile(_ClosingFile):
+    """
+    Exposes ``length`` bytes of ``f`` from its current position.
+
+    Keeps ``fileno`` so servers with sendfile support still send the range
+    zero-copy; hides ``tell``/``seek`` so FileResponse does not recompute
+    Content-Length over the whole file.
+    """
+
+    def __init__(self, f, start, length, on_close=None):
+        super().__init__(f, on_close)
+        f.seek(start)
+        self._remaining = length
+
+    def __getattr__(self, name):
+        if name in ("tell", "seek", "seekable", "name"):
+            raise AttributeError(name)
+        return super().__getattr__(name)
+
+    def read(self, size=-1):
+        if self._remaining <= 0:
+            return b""
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._f.read(size)
+        self._remaining -= len(data)
+        return data
+
+
+def etag_for(stat):
+    return f'"{stat.st_size:x}-{int(stat.st_mtime_ns):x}"'
+
+
+def parse_range(header, size):
+    """Return ``(start, end)`` inclusive for a single byte range, None to ignore, or False if unsatisfiable."""
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None  # malformed or multi-range: serve the whole file
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def if_range_matches(request, etag, mtime):
+    value = request.headers.get("If-Range")
+    if not value:
+        return True
+    if value.startswith(('"', "W/")):
+        return value == etag
+    since = parse_http_date_safe(value)
+    return since is not None and int(mtime) <= since
+
+
+def offload_response(path, filename, content_type=None):
+    """Hand the file to the front-end server, or None if offload is off or not possible."""
+    conf = delivery_settings()
+    mode = conf["OFFLOAD"]
+    if not mode:
+        return None
+
+    content_type = content_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    response = HttpResponse(content_type=content_type)
+    response["Content-Disposition"] = content_disposition_header(True, filename)
+    if mode == "x-sendfile":
+        response["X-Sendfile"] = path
+        return response
+
+    real = os.path.realpath(path)
+    for root, location in conf["ACCEL_LOCATIONS"].items():
+        root = os.path.realpath(root)
+        if os.path.commonpath([real, root]) == root:
+            relative = os.path.relpath(real, root)
+            response["X-Accel-Redirect"] = location.rstrip("/") + "/" + escape_uri_path(relative)
+            return response
+    return None
+
+
+def serve_file(request, path, filename, on_close=None, persistent=False, content_type=None):
+    """
+    Send ``path`` as an attachment with Range/If-Range support.
+
+    ``on_close`` runs after the response is fully sent (or aborted), which
+    is when temporary files may be removed. ``persistent`` files may be
+    offloaded to the front-end server with X-Accel-Redirect/X-Sendfile.
+    """
+    if persistent:
+        response = offload_response(path, filename, content_type)
+        if response is not None:
+            if on_close:
+                on_close()
+            return response
+
+    f = open(path, "rb")
+    stat = os.fstat(f.fileno())
+    size, etag = stat.st_size, etag_for(stat)
+    block_size = delivery_settings()["BLOCK_SIZE"]
+
+    byte_range = None
+    if "Range" in request.headers and if_range_matches(request, etag, stat.st_mtime):
+        byte_range = parse_range(request.headers["Range"], size)
+
+    if byte_range is False:
+        f.close()
+        if on_close:
+            on_close()
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+
+    if byte_range:
+        start, end = byte_range
+        response = FileResponse(
+            _RangeFile(f, start, end - start + 1, on_close),
+            as_attachment=True, filename=filename, content_type=content_type, status=206,
+        )
+        response["Content-Length"] = end - start + 1
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    else:
+        response = FileResponse(
+            _ClosingFile(f, on_close), as_attachment=True, filename=filename, content_type=content_type,
+        )
+
+    response.block_size = block_size  # FileResponse defaults to 4 KiB reads
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(stat.st_mtime)
+    return response
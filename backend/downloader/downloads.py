@@ -0,0 +1,252 @@
+import contextvars
+import os
+import threading
+from contextlib import contextmanager
+
+from .admission import download_scheduler
+from .artifacts import artifact_key, artifact_store
+from .cache import cache_key, url_host
+from .extraction import normalize_url, ydl_pool
+from .hosts import host_scheduler
+from .metrics import Stopwatch, record_stage, stage
+from .playlist import PlaylistPipeline, flatten_entries, is_playlist, looks_like_playlist
+from .singleflight import SingleFlight
+from .transcode import PRIORITY_SINGLE, audio_target, download_format, transcode, transcode_pool
+from .workspace import workspaces
+from .zipstream import stream_zip, unique_arcname
+
+download_flight = SingleFlight()
+
+
+class PlaylistRun:
+    """
+    Runs a ``PlaylistPipeline`` on a background thread.
+
+    Finished tracks are kept in order of completion and can be replayed by
+    any number of readers, so coalesced requests all stream the same
+    playlist while it is still being downloaded.
+    """
+
+    def __init__(self, playlist, work_dir, convert_mp3=True, progress_hooks=None, codec=None, quality=None):
+        self.playlist = playlist
+        self.work_dir = work_dir
+        self.results = []
+        self.finished = False
+        self.stopped = False
+        self._cancelled = False
+        self._on_finish = []
+        self._cond = threading.Condition()
+        self._pipeline = PlaylistPipeline(
+            playlist["entries"], work_dir, convert_mp3, progress_hooks, codec=codec, quality=quality,
+        )
+        threading.Thread(target=contextvars.copy_context().run, args=(self._run,), daemon=True).start()
+
+    def _run(self):
+        results = iter(self._pipeline)
+        try:
+            for result in results:
+                if result.ok:
+                    result.entry["requested_downloads"] = [{"filepath": result.path}]
+                else:
+                    result.entry["error"] = result.error
+                with self._cond:
+                    self.results.append(result)
+                    self._cond.notify_all()
+                if self._cancelled:
+                    break
+        finally:
+            results.close()
+            with self._cond:
+                self.finished = True
+                self._cond.notify_all()
+            # Tracks still downloading or converting keep writing into work_dir
+            self._pipeline.when_idle(self._stopped)
+
+    def _stopped(self):
+        with self._cond:
+            self.stopped = True
+            on_finish, self._on_finish = self._on_finish, []
+        for callback in on_finish:
+            callback()
+
+    def __iter__(self):
+        i = 0
+        while True:
+            with self._cond:
+                while i >= len(self.results) and not self.finished:
+                    self._cond.wait()
+                if i >= len(self.results):
+                    return
+                result = self.results[i]
+            i += 1
+            yield result
+
+    def when_finished(self, callback):
+        """Call ``callback`` once no track is running any more, right away if none is."""
+        with self._cond:
+            if not self.stopped:
+                self._on_finish.append(callback)
+                return
+        callback()
+
+    def close(self, then=None):
+        """Stop scheduling new tracks and call ``then`` once the running ones have drained."""
+        with self._cond:
+            self._cancelled = True
+        if then:
+            self.when_finished(then)
+
+
+def start_download(url, work_dir, convert_mp3=True, progress_hooks=None, codec=None, quality=None):
+    """
+    Start downloading ``url`` into ``work_dir``.
+
+    Single videos are downloaded with one yt-dlp call, reusing the
+    extraction, and their info dict is returned; audio is then converted
+    to ``codec``/``quality`` on the transcode pool. Playlists are
+    enumerated flat and returned as a running ``PlaylistRun``.
+    """
+    params = {}
+    if convert_mp3:
+        codec, quality = audio_target(codec, quality)
+        params["format"] = download_format(codec)
+        if artifact_store:
+            artifact = artifact_store.lookup(url=url, codec=codec, quality=quality)
+            if artifact:
+                path = artifact_store.checkout(artifact, work_dir)
+                return cached_info(path, artifact.extractor, artifact.video_id, artifact.path)
+
+    mode = "audio" if convert_mp3 else "video"
+    host = url_host(url)
+    with ydl_pool.lend(mode, tmp_dir=work_dir, progress_hooks=progress_hooks, **params) as ydl:
+        with host_scheduler.slot(host), stage("extract", host, mode):
+            ie_result = ydl.extract_info(normalize_url(url), download=False, process=False)
+        if is_playlist(ie_result):
+            info = None
+        elif convert_mp3 and artifact_store:
+            extractor, video_id = ie_result.get("extractor_key"), ie_result.get("id")
+            key = artifact_key(extractor, video_id, codec, quality)
+            artifact = artifact_store.lookup(key=key)
+            if artifact:
+                path = artifact_store.checkout(artifact, work_dir)
+                return cached_info(path, extractor, video_id, artifact.path)
+            info = process_download(ydl, ie_result, host, mode)
+        else:
+            info = process_download(ydl, ie_result, host, mode)
+
+    if info is None:
+        return PlaylistRun(flatten_entries(ie_result), work_dir, convert_mp3, progress_hooks, codec, quality)
+    if not convert_mp3:
+        return info
+
+    for download in info.get("requested_downloads") or []:
+        if not download.get("filepath"):
+            continue
+        # Waits for a free core; single tracks are served before playlist work
+        download["filepath"] = transcode_pool.submit(
+            transcode, download, codec, quality, host, mode, priority=PRIORITY_SINGLE,
+        ).result()
+        if artifact_store:
+            download["artifact_path"] = artifact_store.publish(
+                download["filepath"], key, extractor, video_id, codec, quality, source_url=url,
+            )
+    return info
+
+
+def process_download(ydl, ie_result, host="", mode=""):
+    # Downloads can run for minutes, so they only report to the host's circuit
+    with host_scheduler.slot(host, limit=False), stage("download", host, mode):
+        return ydl.process_ie_result(ie_result, download=True)
+
+
+def cached_info(path, extractor, video_id, artifact_path):
+    """Minimal info dict for a file served from the artifact store."""
+    return {
+        "id": video_id,
+        "extractor_key": extractor,
+        "title": os.path.splitext(os.path.basename(path))[0],
+        "requested_downloads": [{"filepath": path, "artifact_path": artifact_path}],
+    }
+
+
+@contextmanager
+def download_mp3(url, user_key=None, codec=None, quality=None):
+    """
+    Download and convert ``url`` to ``codec`` into its own workspace, shared by duplicates.
+
+    Use as a context manager; yields ``(info_or_run, work_dir)`` and releases
+    the workspace once every request that joined the conversion has finished.
+    The conversion holds a download slot, queued fairly by ``user_key``,
+    until it is done; duplicates joining it do not take another one.
+    """
+
+    codec, quality = audio_target(codec, quality)
+
+    def download():
+        release = download_scheduler.acquire(user_key) if download_scheduler else (lambda: None)
+        try:
+            workspace = workspaces.allocate("mp3", small=not looks_like_playlist(url))
+        except BaseException:
+            release()
+            raise
+        try:
+            download = start_download(
+                url, workspace.path, convert_mp3=True, progress_hooks=[workspace.progress_hook],
+                codec=codec, quality=quality,
+            )
+        except BaseException:
+            workspace.release()
+            release()
+            raise
+        if isinstance(download, PlaylistRun):
+            download.when_finished(release)
+        else:
+            release()
+        return download, workspace
+
+    def cleanup(result):
+        download, workspace = result
+        if isinstance(download, PlaylistRun):
+            download.close(then=workspace.release)
+        else:
+            workspace.release()
+
+    with download_flight.do(cache_key(url, f"{codec}-{quality}"), download, cleanup=cleanup) as (download, workspace):
+        yield download, workspace.path
+
+
+def playlist_members(results):
+    """Map track results to ZIP members; failures are listed in FAILED.txt."""
+    used, failed = set(), []
+    for result in results:
+        if result.ok:
+            yield unique_arcname(result.filename, used), result.path
+        else:
+            failed.append(result)
+    if failed:
+        yield "FAILED.txt", "".join(f"{r.title}: {r.error}\n" for r in failed).encode()
+
+
+def stream_playlist_zip(run, on_close=None):
+    """Yield ZIP chunks for ``run``, adding each track as soon as it is ready."""
+    members, chunks = Stopwatch(), Stopwatch()
+    try:
+        yield from chunks.timed(stream_zip(members.timed(playlist_members(run))))
+    finally:
+        # Only time spent writing the archive, not waiting for tracks
+        record_stage("package", chunks.elapsed - members.elapsed, playlist_host(run), "playlist")
+        if on_close:
+            on_close()
+
+
+def write_playlist_zip(run, zip_path):
+    members, chunks = Stopwatch(), Stopwatch()
+    with open(zip_path, "wb") as f:
+        for chunk in chunks.timed(stream_zip(members.timed(playlist_members(run)))):
+            f.write(chunk)
+    record_stage("package", chunks.elapsed - members.elapsed, playlist_host(run), "playlist")
+    return zip_path
+
+
+def playlist_host(run):
+    return url_host(run.playlist.get("webpage_url") or run.playlist.get("url") or "")
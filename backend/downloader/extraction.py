@@ -0,0 +1,133 @@
+import os
+import logging
+import time
+from importlib import import_module
+
+from .cache import cache_key, metadata_cache, url_host
+from .hosts import host_scheduler
+from .metrics import stage
+from .singleflight import SingleFlight, shared_call
+from .ydl_pool import YDLPool, ydl_pool_settings
+
+logger = logging.getLogger(__name__)
+
+metadata_flight = SingleFlight()
+
+OUTTMPL = "%(title)s.%(ext)s"
+
+BACKEND_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../"))
+COOKIES_PATH = os.path.join(BACKEND_ROOT, "cookies.txt")
+
+
+def normalize_url(url):
+    # YouTube Music pages extract the same as regular watch pages
+    if "music.youtube.com" in url.lower():
+        url = url.replace("music.youtube.com", "www.youtube.com")
+    return url
+
+
+def build_options(convert_mp3=False, tmp_dir=None, progress_hooks=None):
+    ydl_opts = {
+        "format": "bestaudio/best" if convert_mp3 else "best",
+        "quiet": True,
+        "no_warnings": True,
+        "noplaylist": False,
+    }
+    ydl_opts["outtmpl"] = os.path.join(tmp_dir, OUTTMPL) if tmp_dir else OUTTMPL
+    if progress_hooks:
+        ydl_opts["progress_hooks"] = list(progress_hooks)
+
+    # ✅ Check for cookies.txt and only include if exists
+    if os.path.exists(COOKIES_PATH):
+        ydl_opts["cookiefile"] = COOKIES_PATH
+    else:
+        logger.info("No cookies.txt found, will only download public videos.")
+    return ydl_opts
+
+
+# Option profiles lent out by ``ydl_pool``; per-call output dirs and
+# progress hooks are applied when an instance is borrowed. Audio is only
+# downloaded here and converted afterwards on the transcode pool.
+YDL_PROFILES = {
+    "metadata": lambda: build_options(),
+    "flat": lambda: dict(build_options(), extract_flat="in_playlist"),
+    "video": lambda: build_options(convert_mp3=False),
+    "audio": lambda: build_options(convert_mp3=True),
+}
+
+ydl_pool = YDLPool(YDL_PROFILES, COOKIES_PATH, ydl_pool_settings()["MAX_IDLE"], "downloader.segmented.SegmentedYoutubeDL")
+
+
+def warm_up():
+    """
+    Load yt-dlp and prime it before the process takes traffic.
+
+    Creates one pooled instance per profile, then matches a placeholder URL
+    against every extractor so all their URL patterns are compiled; without
+    this the first link for a site far down the registry pays for it.
+    Returns the seconds each step took.
+    """
+    timings = {}
+    started = time.perf_counter()
+    import_module("downloader.segmented")  # yt-dlp and its extractor registry
+    import_module("yt_dlp.postprocessor")
+    timings["import"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    ydl_pool.warm()
+    timings["instances"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ydl_pool.lend("metadata") as ydl:
+        for ie in ydl._ies.values():
+            ie.suitable("https://warmup.invalid/")
+    timings["extractors"] = time.perf_counter() - started
+    return timings
+
+
+def download_error_message(error):
+    if "Sign in to confirm" in str(error):
+        return "This video requires login/cookies. Only public videos are downloadable."
+    return "Failed to download the video/audio"
+
+
+def extract_metadata(url):
+    """
+    Return the sanitized info dict for ``url``.
+
+    Served from the metadata cache when possible; concurrent misses for
+    the same canonical URL share a single extraction.
+    """
+    info = metadata_cache.get(url)
+    if info is not None:
+        return info
+
+    def extract():
+        # Another worker may have filled the cache while we waited for the lock
+        info = metadata_cache.backend.get(cache_key(url))
+        if info is None:
+            host = url_host(url)
+            with host_scheduler.slot(host), ydl_pool.lend("metadata") as ydl, stage("extract", host, "metadata"):
+                info = ydl.sanitize_info(ydl.extract_info(normalize_url(url), download=False))
+            metadata_cache.set(url, info)
+        return info
+
+    key = cache_key(url)
+    return metadata_flight.call(key, lambda: shared_call(key, extract))
+
+
+def output_files(info, work_dir):
+    """Yield ``(path, filename)`` for every finished download of ``info`` in ``work_dir``."""
+    entries = info["entries"] if "entries" in info else [info]
+    for entry in entries:
+        if not entry:
+            continue
+        for download in entry.get("requested_downloads") or []:
+            path = download.get("filepath")
+            if path and is_within(path, work_dir) and os.path.exists(path):
+                yield path, os.path.basename(path)
+
+
+def is_within(path, directory):
+    directory = os.path.abspath(directory)
+    return os.path.commonpath([os.path.abspath(path), directory]) == directory
@@ -0,0 +1,119 @@
+import heapq
+import re
+
+# Relative quality per bit; later codecs need less bandwidth for the same result
+VIDEO_CODEC_EFFICIENCY = {"av01": 3, "vp09": 2, "vp9": 2, "hev1": 2, "hvc1": 2, "avc1": 1, "h264": 1}
+AUDIO_CODEC_EFFICIENCY = {"opus": 3, "mp4a": 2, "aac": 2, "vorbis": 1, "mp3": 1}
+
+# Containers most browsers and players open without a remux
+VIDEO_CONTAINERS = {"mp4": 2, "webm": 1}
+AUDIO_CONTAINERS = {"m4a": 2, "mp3": 2, "webm": 1, "ogg": 1}
+
+# Entries kept per category when the client does not ask otherwise
+DEFAULT_LIMITS = {"audio": 2, "video": 5}
+
+HEIGHT_RE = re.compile(r"^(\d+)p?$")
+
+
+def parse_flag(value):
+    """Boolean request option; form and query data send ``"false"``/``"0"`` as strings."""
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def format_preferences(data):
+    """
+    Read ranking preferences from request data.
+
+    ``max_resolution`` accepts ``720`` or ``"720p"``; ``prefer_smaller``
+    favours the lighter of otherwise equivalent formats.
+    """
+    prefs = {"max_height": None, "prefer_smaller": parse_flag(data.get("prefer_smaller", False))}
+    match = HEIGHT_RE.match(str(data.get("max_resolution") or "").strip().lower())
+    if match:
+        prefs["max_height"] = int(match.group(1))
+    return prefs
+
+
+def classify(f):
+    """Return "audio", "video" (muxed) or None for formats that are not offered."""
+    vcodec, acodec = f.get("vcodec"), f.get("acodec")
+    if acodec == "none":
+        return None
+    return "audio" if vcodec == "none" else "video"
+
+
+def codec_family(codec):
+    return (codec or "").split(".")[0].lower()
+
+
+def estimated_size(f):
+    size = f.get("filesize") or f.get("filesize_approx")
+    if size:
+        return size
+    # tbr is in kbit/s
+    if f.get("tbr") and f.get("duration"):
+        return int(f["tbr"] * 125 * f["duration"])
+    return None
+
+
+def score(f, category, prefer_smaller=False):
+    """
+    Sort key for ``f`` within its category; larger is better.
+
+    Resolution (video) or bitrate (audio) dominates, then container
+    compatibility, then codec efficiency. With ``prefer_smaller`` the
+    estimated size decides between formats of the same resolution/bitrate
+    tier; otherwise the higher total bitrate does.
+    """
+    size = estimated_size(f)
+    size_key = -size if size else float("-inf")
+    if category == "video":
+        tier = (f.get("height") or 0, f.get("fps") or 0)
+        compat = VIDEO_CONTAINERS.get(f.get("ext"), 0)
+        efficiency = VIDEO_CODEC_EFFICIENCY.get(codec_family(f.get("vcodec")), 0)
+    else:
+        tier = (round(f.get("abr") or f.get("tbr") or 0, -1),)
+        compat = AUDIO_CONTAINERS.get(f.get("ext"), 0)
+        efficiency = AUDIO_CODEC_EFFICIENCY.get(codec_family(f.get("acodec")), 0)
+    if prefer_smaller:
+        return tier + (compat, size_key, efficiency)
+    return tier + (compat, efficiency, f.get("tbr") or 0)
+
+
+def dedupe_key(f, category):
+    if category == "video":
+        return category, f.get("height"), f.get("ext")
+    return category, f.get("ext"), round(f.get("abr") or f.get("tbr") or 0, -1)
+
+
+def rank_formats(raw_formats, limits=None, max_height=None, prefer_smaller=False):
+    """
+    Return ``{category: [format, ...]}`` with the best formats first.
+
+    One pass classifies, scores and deduplicates (same resolution and
+    container, or same container and bitrate tier, keep only the best);
+    a heap then picks the top ``limits[category]`` of each category.
+    """
+    limits = limits or DEFAULT_LIMITS
+    best = {}
+    for order, f in enumerate(raw_formats or []):
+        category = classify(f)
+        if category not in limits:
+            continue
+        if category == "video" and max_height and (f.get("height") or 0) > max_height:
+            continue
+        # order breaks ties in favour of yt-dlp's own (worst to best) ordering
+        candidate = (score(f, category, prefer_smaller), order, f)
+        key = dedupe_key(f, category)
+        if key not in best or candidate[:2] > best[key][:2]:
+            best[key] = candidate
+
+    ranked = {category: [] for category in limits}
+    for key, candidate in best.items():
+        ranked[key[0]].append(candidate)
+    return {
+        category: [f for _, _, f in heapq.nlargest(limits[category], candidates, key=lambda c: c[:2])]
+        for category, candidates in ranked.items()
+    }
@@ -0,0 +1,227 @@
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .metrics import Counter, host_label
+
+logger = logging.getLogger(__name__)
+
+HOST_REJECTIONS = Counter(
+    "fetchmate_host_rejections_total", "yt-dlp calls refused by the host scheduler.", ("host", "reason"),
+)
+CIRCUIT_OPENED = Counter(
+    "fetchmate_host_circuit_opened_total", "Times a host's circuit was opened, by the error that opened it.",
+    ("host", "error"),
+)
+
+# Error kinds that say something about the host rather than one link;
+# throttling and bot checks open the circuit on the first occurrence.
+IMMEDIATE = ("throttled", "blocked")
+
+
+def host_settings():
+    conf = {
+        "PER_HOST": 4,  # concurrent yt-dlp calls per host, per process
+        "OVERRIDES": {},  # host -> PER_HOST for that host
+        "ACQUIRE_TIMEOUT": 30,
+        "FAILURE_THRESHOLD": 5,  # consecutive "unavailable" errors that open the circuit
+        "BASE_BACKOFF": 30,
+        "MAX_BACKOFF": 15 * 60,
+        "PROBE_TIMEOUT": 120,
+        "CACHE_ALIAS": "default",
+    }
+    conf.update(getattr(settings, "DOWNLOADER_HOSTS", {}))
+    return conf
+
+
+class HostUnavailable(Exception):
+    """A host is cooling off after errors, or has no free slot; try again later."""
+
+    def __init__(self, host, retry_after, reason="open"):
+        message = f"{host or 'The site'} is temporarily unavailable, please try again later."
+        super().__init__(message)
+        self.message = message
+        self.host = host
+        # Rounded up, so a client that waits exactly this long finds the host open
+        self.retry_after = max(int(math.ceil(retry_after)), 1)
+        self.reason = reason
+
+
+def _causes(error):
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        error = (
+            getattr(error, "cause", None)
+            or (getattr(error, "exc_info", None) or (None, None))[1]
+            or error.__cause__
+        )
+
+
+def classify(error):
+    """
+    What a yt-dlp failure says about its host.
+
+    Returns ``"throttled"`` (HTTP 429), ``"blocked"`` (bot check),
+    ``"unavailable"`` (5xx, timeouts, connection errors) or None for
+    errors about the link itself (private, removed, unsupported, ...).
+    """
+    from yt_dlp.networking.exceptions import TransportError  # loaded by the call that failed
+
+    text = str(error)
+    if "not a bot" in text:
+        return "blocked"
+    for cause in _causes(error):
+        status = getattr(cause, "status", None)
+        if status == 429:
+            return "throttled"
+        if isinstance(status, int) and status >= 500:
+            return "unavailable"
+        if isinstance(cause, (TransportError, TimeoutError, ConnectionError)):
+            return "unavailable"
+    if "HTTP Error 429" in text:
+        return "throttled"
+    return None
+
+
+def retry_after_hint(error):
+    for cause in _causes(error):
+        response = getattr(cause, "response", None)
+        value = response.headers.get("Retry-After") if response is not None else None
+        if value and value.isdigit():
+            return int(value)
+    return 0
+
+
+class HostScheduler:
+    """
+    Per-host concurrency limits and circuit breaking for yt-dlp calls.
+
+    Each process caps how many calls run against one host at a time. Host
+    health lives in the Django cache, so every worker sharing it sees the
+    same state: errors that implicate the host open its circuit for a
+    backoff that doubles each time it reopens, and while it is open calls
+    fail at once with ``HostUnavailable`` instead of taking a worker for a
+    full extraction. Once the window passes, a single call probes the host;
+    success closes the circuit, failure reopens it.
+
+    Updates are read-modify-write on the cache, so concurrent failures may
+    be under-counted; health is approximate by design.
+    """
+
+    def __init__(self, per_host, overrides, acquire_timeout, failure_threshold,
+                 base_backoff, max_backoff, probe_timeout, cache_alias):
+        self.per_host = per_host
+        self.overrides = overrides
+        self.acquire_timeout = acquire_timeout
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.probe_timeout = probe_timeout
+        self.cache_alias = cache_alias
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _key(self, host):
+        return f"fetchmate:host:{host}"
+
+    def _semaphore(self, host):
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = self._semaphores[host] = threading.BoundedSemaphore(self.overrides.get(host, self.per_host))
+            return semaphore
+
+    def _reject(self, host, retry_after, reason):
+        HOST_REJECTIONS.inc(host=host_label(host), reason=reason)
+        raise HostUnavailable(host, retry_after, reason)
+
+    def admit(self, host):
+        """Raise ``HostUnavailable`` while ``host`` is cooling off; returns ``(state, probing)``."""
+        state = self.cache.get(self._key(host))
+        if not state or not state.get("open_until"):
+            return state, False
+        remaining = state["open_until"] - time.time()
+        if remaining > 0:
+            self._reject(host, remaining, "open")
+        # Cooling-off is over: one caller across all workers gets to probe
+        if self.cache.add(f"{self._key(host)}:probe", 1, self.probe_timeout):
+            return state, True
+        self._reject(host, min(self.base_backoff, 5), "probing")
+
+    def record_success(self, host, state, probing):
+        if state or probing:
+            self.cache.delete_many([self._key(host), f"{self._key(host)}:probe"])
+
+    def record_failure(self, host, error, state, probing):
+        kind = classify(error)
+        if kind is None:
+            # The host answered; the link itself was the problem
+            self.record_success(host, state, probing)
+            return
+        state = dict(state or {})
+        failures = state.get("failures", 0) + 1
+        if probing or kind in IMMEDIATE or failures >= self.failure_threshold:
+            trips = state.get("trips", 0) + 1
+            backoff = max(min(self.base_backoff * 2 ** (trips - 1), self.max_backoff), retry_after_hint(error))
+            state = {"failures": 0, "trips": trips, "open_until": time.time() + backoff, "error": kind}
+            CIRCUIT_OPENED.inc(host=host_label(host), error=kind)
+            logger.warning("Pausing calls to %s for %ss after %s errors", host, backoff, kind)
+        else:
+            state["failures"] = failures
+        # Kept long enough that a host failing again soon resumes its longer backoff
+        self.cache.set(self._key(host), state, self.max_backoff * 4)
+        if probing:
+            self.cache.delete(f"{self._key(host)}:probe")
+
+    @contextmanager
+    def slot(self, host, limit=True):
+        """
+        Run a yt-dlp call against ``host`` under the scheduler.
+
+        With ``limit`` the call also takes one of the host's slots; long
+        downloads pass ``limit=False`` and only report their outcome.
+        """
+        state, probing = self.admit(host)
+        semaphore = self._semaphore(host) if limit else None
+        if semaphore and not semaphore.acquire(timeout=self.acquire_timeout):
+            if probing:
+                self.cache.delete(f"{self._key(host)}:probe")
+            self._reject(host, 5, "busy")
+        try:
+            yield
+        except Exception as e:
+            self.record_failure(host, e, state, probing)
+            raise
+        else:
+            self.record_success(host, state, probing)
+        finally:
+            if semaphore:
+                semaphore.release()
+
+    def health(self, host):
+        return self.cache.get(self._key(host))
+
+    def reset(self, host):
+        self.cache.delete_many([self._key(host), f"{self._key(host)}:probe"])
+
+
+def build_host_scheduler():
+    conf = host_settings()
+    return HostScheduler(
+        conf["PER_HOST"], conf["OVERRIDES"], conf["ACQUIRE_TIMEOUT"], conf["FAILURE_THRESHOLD"],
+        conf["BASE_BACKOFF"], conf["MAX_BACKOFF"], conf["PROBE_TIMEOUT"], conf["CACHE_ALIAS"],
+    )
+
+
+host_scheduler = build_host_scheduler()
@@ -0,0 +1,354 @@
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .cache import url_host
+from .downloads import PlaylistRun, start_download, write_playlist_zip
+from .extraction import download_error_message, output_files
+from .hosts import HostUnavailable
+from .lazy import download_error
+from .log import request_id_var
+from .metrics import record_error
+from .models import DownloadJob
+from .playlist import looks_like_playlist
+from .transcode import audio_target
+from .workspace import QuotaExceeded, StorageUnavailable, workspaces
+
+logger = logging.getLogger(__name__)
+
+
+def job_settings():
+    conf = {
+        "ROOT": os.path.join(settings.BASE_DIR, "jobs"),
+        "WORKERS": 2,
+        "POLL_INTERVAL": 1.0,
+        "PROGRESS_INTERVAL": 1.0,
+        "HEARTBEAT_INTERVAL": 30,  # must stay well under STALE_AFTER
+        "STALE_AFTER": 300,
+        "RESULT_TTL": 3600,
+    }
+    conf.update(getattr(settings, "DOWNLOADER_JOBS", {}))
+    return conf
+
+
+def job_dir(job):
+    return os.path.join(job_settings()["ROOT"], str(job.pk))
+
+
+class LeaseLost(Exception):
+    """The job was handed to another worker after this one's heartbeat went stale."""
+
+
+def held(job):
+    """The job's row, as long as the worker that claimed ``job`` still holds it."""
+    return DownloadJob.objects.filter(pk=job.pk, worker=job.worker, status=DownloadJob.STATUS_RUNNING)
+
+
+def enqueue(user, url, convert_mp3=True, codec=None, quality=None):
+    codec, quality = audio_target(codec, quality)
+    return DownloadJob.objects.create(
+        user_id=user.pk, url=url, convert_mp3=convert_mp3, audio_codec=codec, audio_quality=quality,
+    )
+
+
+def claim_next(worker):
+    """
+    Atomically move the next queued job to ``running`` for ``worker``.
+
+    Jobs of users with the fewest running jobs go first, oldest first
+    among those, so one user's backlog cannot starve everyone else. The
+    conditional UPDATE acts as compare-and-set, so several worker
+    processes can share the table on SQLite as well as Postgres.
+    """
+    running = (
+        DownloadJob.objects.filter(user=OuterRef("user"), status=DownloadJob.STATUS_RUNNING)
+        .values("user").annotate(n=Count("pk")).values("n")
+    )
+    candidates = (
+        DownloadJob.objects.filter(status=DownloadJob.STATUS_QUEUED)
+        .annotate(user_running=Coalesce(Subquery(running), 0))
+        .order_by("user_running", "created_at")
+        .values_list("pk", flat=True)[:10]
+    )
+    for pk in candidates:
+        now = timezone.now()
+        claimed = DownloadJob.objects.filter(pk=pk, status=DownloadJob.STATUS_QUEUED).update(
+            status=DownloadJob.STATUS_RUNNING, worker=worker, started_at=now, heartbeat_at=now,
+        )
+        if claimed:
+            return DownloadJob.objects.get(pk=pk)
+    return None
+
+
+class JobHeartbeat:
+    """
+    Refreshes a running job's ``heartbeat_at`` on a thread of its own.
+
+    Progress hooks stop firing during long FFmpeg transcodes; without this
+    the job would look stale and be handed to a second worker. ``lost`` is
+    set once the row no longer belongs to this worker.
+    """
+
+    def __init__(self, job, interval):
+        self.job = job
+        self.interval = interval
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"job-{job.pk}-heartbeat")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    if not held(self.job).update(heartbeat_at=timezone.now()):
+                        logger.warning("Job %s is no longer held by %s", self.job.pk, self.job.worker)
+                        self.lost.set()
+                        return
+                except Exception as e:
+                    logger.error("Heartbeat for job %s failed: %s", self.job.pk, e)
+        finally:
+            connection.close()
+
+
+class ProgressReporter:
+    """yt-dlp progress hook that writes throttled progress onto the job row."""
+
+    def __init__(self, job, interval=1.0, lost=None):
+        self.job = job
+        self.interval = interval
+        self.lost = lost or threading.Event()
+        self.items_done = 0
+        self.items_total = None
+        self._last_write = 0.0
+        self._lock = threading.Lock()  # playlist tracks report from several threads
+
+    def __call__(self, d):
+        with self._lock:
+            self._report(d)
+
+    def _report(self, d):
+        if self.lost.is_set():
+            raise LeaseLost()  # aborts the download; another worker runs the job now
+        info = d.get("info_dict") or {}
+        if info.get("n_entries"):
+            self.items_total = info["n_entries"]
+
+        downloaded = d.get("downloaded_bytes") or 0
+        total = d.get("total_bytes") or d.get("total_bytes_estimate")
+        fraction = downloaded / total if total else 0.0
+
+        if d["status"] == "finished":
+            self.items_done += 1
+            fraction = 0.0
+        elif time.monotonic() - self._last_write < self.interval:
+            return
+
+        items_total = self.items_total or 1
+        progress = min(100.0 * (self.items_done + fraction) / items_total, 99.0)
+        self._last_write = time.monotonic()
+        updated = held(self.job).update(
+            progress=round(progress, 1),
+            downloaded_bytes=downloaded,
+            total_bytes=total,
+            items_done=self.items_done,
+            items_total=self.items_total,
+            heartbeat_at=timezone.now(),
+        )
+        if not updated:
+            self.lost.set()
+            raise LeaseLost()
+
+
+def run_job(job):
+    # Correlate the job's log lines the way request ids do for HTTP requests
+    token = request_id_var.set(f"job-{job.pk}")
+    try:
+        _run_job(job)
+    finally:
+        request_id_var.reset(token)
+
+
+def _run_job(job):
+    """
+    Download into a fresh workspace and move only the result into the job dir.
+
+    Raises ``StorageUnavailable`` after putting the job back in the queue
+    when there is no room to start it. Every final update only applies
+    while this worker still holds the job, and each run writes its result
+    to a directory of its own, so a run that lost the job to another
+    worker cannot overwrite that worker's state or files.
+    """
+    conf = job_settings()
+    try:
+        workspace = workspaces.allocate("job", small=job.convert_mp3 and not looks_like_playlist(job.url))
+    except StorageUnavailable:
+        requeue_job(job)
+        raise
+    result_dir = os.path.join(job_dir(job), uuid.uuid4().hex[:12])
+    download = None
+
+    try:
+        with JobHeartbeat(job, conf["HEARTBEAT_INTERVAL"]) as heartbeat:
+            reporter = ProgressReporter(job, conf["PROGRESS_INTERVAL"], heartbeat.lost)
+            download = start_download(
+                job.url, workspace.path, job.convert_mp3, progress_hooks=[reporter, workspace.progress_hook],
+                codec=job.audio_codec, quality=job.audio_quality,
+            )
+            if heartbeat.lost.is_set():
+                raise LeaseLost()
+            os.makedirs(result_dir, exist_ok=True)
+
+            if isinstance(download, PlaylistRun):
+                result_path, result_name = os.path.join(result_dir, "playlist.zip"), "playlist.zip"
+                write_playlist_zip(download, result_path)
+                outputs = [r for r in download.results if r.ok]
+            else:
+                outputs = list(output_files(download, workspace.path))
+                if outputs:
+                    path, result_name = outputs[0]
+                    result_path = os.path.join(result_dir, result_name)
+                    shutil.move(path, result_path)
+
+            if not outputs:
+                raise RuntimeError("yt-dlp finished without producing a file")
+
+        finish_job(
+            job, result_dir,
+            status=DownloadJob.STATUS_FINISHED,
+            progress=100,
+            items_done=len(outputs),
+            result_path=result_path,
+            result_name=result_name,
+        )
+    except LeaseLost:
+        logger.warning("Job %s was taken over by another worker, dropping this run", job.pk)
+        shutil.rmtree(result_dir, ignore_errors=True)
+    except download_error() as e:
+        logger.warning("Job %s failed: %s", job.pk, e)
+        record_error(e, url_host(job.url))
+        fail_job(job, result_dir, download_error_message(e))
+    except QuotaExceeded as e:
+        logger.warning("Job %s failed: %s", job.pk, e)
+        fail_job(job, result_dir, str(e))
+    except HostUnavailable as e:
+        logger.warning("Job %s failed: %s", job.pk, e)
+        fail_job(job, result_dir, e.message)
+    except Exception as e:
+        logger.error("Unexpected error in job %s: %s", job.pk, e)
+        fail_job(job, result_dir, "Failed to process the link")
+    finally:
+        if isinstance(download, PlaylistRun):
+            download.close(then=workspace.release)
+        else:
+            workspace.release()
+
+
+def finish_job(job, result_dir, **fields):
+    """Record the outcome if ``job`` is still held by its worker; otherwise drop this run's result."""
+    if held(job).update(finished_at=timezone.now(), **fields):
+        return True
+    logger.warning("Job %s was taken over by another worker, dropping this run", job.pk)
+    shutil.rmtree(result_dir, ignore_errors=True)
+    return False
+
+
+def fail_job(job, result_dir, message):
+    shutil.rmtree(result_dir, ignore_errors=True)
+    return finish_job(job, result_dir, status=DownloadJob.STATUS_FAILED, error=message)
+
+
+def requeue_job(job):
+    held(job).update(status=DownloadJob.STATUS_QUEUED, worker="", started_at=None, progress=0)
+
+
+def requeue_stale_jobs():
+    """Give jobs whose worker stopped heartbeating back to the queue."""
+    cutoff = timezone.now() - timedelta(seconds=job_settings()["STALE_AFTER"])
+    return DownloadJob.objects.filter(
+        status=DownloadJob.STATUS_RUNNING, heartbeat_at__lt=cutoff,
+    ).update(status=DownloadJob.STATUS_QUEUED, worker="", progress=0)
+
+
+def purge_expired_results():
+    cutoff = timezone.now() - timedelta(seconds=job_settings()["RESULT_TTL"])
+    expired = DownloadJob.objects.filter(finished_at__lt=cutoff)
+    for job in expired:
+        shutil.rmtree(job_dir(job), ignore_errors=True)
+    return expired.delete()[0]
+
+
+class WorkerPool:
+    """
+    Runs queued jobs on a fixed number of threads.
+
+    The pool size bounds how many downloads/transcodes run at once on this
+    host, independently of how many HTTP workers accept jobs.
+    """
+
+    def __init__(self, workers=None):
+        conf = job_settings()
+        self.size = workers or conf["WORKERS"]
+        self.poll_interval = conf["POLL_INTERVAL"]
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        requeue_stale_jobs()
+        workspaces.start()
+        for i in range(self.size):
+            thread = threading.Thread(target=self._work, args=(f"{self.name}:{i}",), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        housekeeping = threading.Thread(target=self._housekeeping, daemon=True)
+        housekeeping.start()
+        self._threads.append(housekeeping)
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self, worker):
+        while not self._stop.is_set():
+            close_old_connections()
+            job = claim_next(worker)
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            logger.info("Worker %s running job %s", worker, job.pk)
+            try:
+                run_job(job)
+            except StorageUnavailable as e:
+                logger.warning("Worker %s backing off for %ss: %s", worker, e.retry_after, e.message)
+                self._stop.wait(e.retry_after)
+
+    def _housekeeping(self):
+        while not self._stop.wait(60):
+            close_old_connections()
+            try:
+                requeue_stale_jobs()
+                purge_expired_results()
+            except Exception as e:
+                logger.error("Job housekeeping failed: %s", e)
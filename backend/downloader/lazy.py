@@ -0,0 +1,18 @@
+import sys
+
+
+class NotLoaded(Exception):
+    """Never raised; stands in for yt-dlp's errors until yt-dlp is imported."""
+
+
+def download_error():
+    """
+    yt-dlp's ``DownloadError``, for ``except`` and ``isinstance``, without importing yt-dlp.
+
+    Until something has imported yt-dlp none of its errors can exist, so
+    a class nothing raises matches the same exceptions. A request turned
+    away early (rate limits, open circuits, bad input) then never pays for
+    loading yt-dlp and its extractor registry just to take an error path.
+    """
+    utils = sys.modules.get("yt_dlp.utils")
+    return utils.DownloadError if utils else NotLoaded
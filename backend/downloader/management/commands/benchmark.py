@@ -0,0 +1,104 @@
+import fnmatch
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from benchmarks.fake_extractor import fake_extractor
+from benchmarks.harness import run_scenario
+from benchmarks.media_stub import MediaStub
+from benchmarks.report import (
+    build_report, compare_reports, format_comparison, format_results, load_report, save_report,
+)
+from benchmarks.scenarios import SCENARIOS, BenchContext, Skip
+from downloader.admission import rate_limiter
+from downloader.artifacts import artifact_store
+from downloader.proxy import connection_pool
+from downloader.thumbnails import thumbnail_cache
+from downloader.workspace import workspaces
+
+
+class Command(BaseCommand):
+    help = "Benchmark the fetch and auth endpoints offline against a throwaway test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scenario", action="append", help=f"Glob of scenarios to run (default: all). Known: {', '.join(SCENARIOS)}")
+        parser.add_argument("--requests", type=int, default=50, help="Requests per scenario")
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--latency", type=float, default=0.02, help="Simulated extraction latency in seconds")
+        parser.add_argument("--media-bytes", type=int, default=256 * 1024, help="Size of each synthetic media file")
+        parser.add_argument("--playlist-size", type=int, default=10)
+        parser.add_argument("--batch-size", type=int, default=5)
+        parser.add_argument("--admission", action="store_true", help="Keep per-user rate limits (off by default)")
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+        parser.add_argument("--compare", metavar="BASELINE", help="Compare against a previous --output file")
+        parser.add_argument("--diff", nargs=2, metavar=("BASELINE", "CURRENT"), help="Only compare two result files")
+        parser.add_argument("--threshold", type=float, default=0.1, help="Relative change counted as a regression")
+
+    def handle(self, *args, **options):
+        if options["diff"]:
+            baseline, current = (load_report(path) for path in options["diff"])
+            return self.compare(baseline, current, options["threshold"])
+
+        patterns = options["scenario"] or ["*"]
+        names = [name for name in SCENARIOS if any(fnmatch.fnmatch(name, p) for p in patterns)]
+        if not names:
+            raise CommandError(f"No scenario matches {patterns}")
+        bench_options = {
+            key: options[key]
+            for key in ("requests", "concurrency", "latency", "media_bytes", "playlist_size", "batch_size", "admission")
+        }
+
+        results = self.run(names, bench_options)
+        self.stdout.write(format_results(results))
+        report = build_report(results, bench_options)
+        if options["output"]:
+            save_report(report, options["output"])
+            self.stdout.write(f"Saved results to {options['output']}")
+        if options["compare"]:
+            self.compare(load_report(options["compare"]), report, options["threshold"])
+
+    def run(self, names, options):
+        results = {}
+        # Thumbnail prefetches may still be writing when the run ends
+        with tempfile.TemporaryDirectory(prefix="bench-", ignore_cleanup_errors=True) as scratch:
+            if connection.vendor == "sqlite":
+                # A file lets every request thread see the same test database
+                connection.settings_dict["TEST"]["NAME"] = f"{scratch}/bench.sqlite3"
+            if artifact_store:
+                artifact_store.root = f"{scratch}/artifacts"
+            workspaces.root = f"{scratch}/work"
+            if thumbnail_cache:
+                thumbnail_cache.root = f"{scratch}/thumbnails"
+            # The media stub listens on loopback
+            connection_pool.allow_private = True
+            if rate_limiter and not options["admission"]:
+                # One bench user would hit its own limits long before the server does
+                rate_limiter.user_rates = rate_limiter.role_rates = {}
+
+            setup_test_environment(debug=False)
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                with MediaStub() as stub, fake_extractor():
+                    ctx = BenchContext(stub, options)
+                    for name in names:
+                        self.stdout.write(f"Running {name}...")
+                        try:
+                            call = SCENARIOS[name](ctx)
+                        except Skip as e:
+                            results[name] = {"skipped": str(e)}
+                            continue
+                        results[name] = run_scenario(call, options["requests"], options["concurrency"], ctx.temp_dirs)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+        return results
+
+    def compare(self, baseline, current, threshold):
+        rows, regressions = compare_reports(baseline, current, threshold)
+        self.stdout.write(format_comparison(rows))
+        if regressions:
+            names = ", ".join(f"{name} {metric}" for name, metric, *_ in regressions)
+            raise CommandError(f"{len(regressions)} regression(s) over {threshold:.0%}: {names}")
+        self.stdout.write(self.style.SUCCESS("No regressions"))
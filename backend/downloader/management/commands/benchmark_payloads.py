@@ -0,0 +1,35 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from benchmarks.payloads import measure
+from benchmarks.report import git_revision
+
+COLUMNS = {
+    "drf_ms": "DRF ms",
+    "orjson_ms": "orjson ms",
+    "identity_kb": "KiB",
+    "gzip_kb": "gzip KiB",
+    "br_kb": "br KiB",
+}
+
+
+class Command(BaseCommand):
+    help = "Measure the size and serialization time of playlist metadata responses in each shape."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tracks", type=int, default=200, help="Tracks in the synthetic playlist")
+        parser.add_argument("--repeat", type=int, default=5, help="Timed renders per shape (the best is kept)")
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        results = measure(options["tracks"], options["repeat"])
+        columns = [c for c in COLUMNS if any(c in r for r in results.values())]
+        self.stdout.write(f"{'shape':<18}" + "".join(f"{COLUMNS[c]:>12}" for c in columns))
+        for shape, result in results.items():
+            self.stdout.write(f"{shape:<18}" + "".join(f"{result[c]:>12.1f}" for c in columns))
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump({"git_revision": git_revision(), "options": options, "results": results}, f, indent=2)
+            self.stdout.write(f"Saved results to {options['output']}")
@@ -0,0 +1,63 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmarks.report import git_revision
+
+PHASES = {
+    "setup_ms": "setup",
+    "urlconf_ms": "urlconf",
+    "warmup_ms": "warmup",
+    "boot_ms": "boot",
+    "first_response_ms": "1st req",
+    "time_to_first_response_ms": "to 1st resp",
+}
+
+
+class Command(BaseCommand):
+    help = "Time cold starts (imports, optional yt-dlp warmup, first fetch) in fresh interpreters."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=5, help="Cold starts per mode")
+        parser.add_argument("--mode", choices=("lazy", "warm", "both"), default="both",
+                            help="Load yt-dlp on the first request, at startup (YDL_WARMUP), or compare both")
+        parser.add_argument("--output", help="Write the samples and medians as JSON to this file")
+
+    def handle(self, *args, **options):
+        modes = ("lazy", "warm") if options["mode"] == "both" else (options["mode"],)
+        results = {mode: self.sample(mode == "warm", options["runs"]) for mode in modes}
+
+        self.stdout.write(f"{'mode (ms)':<10}" + "".join(f"{label:>12}" for label in PHASES.values()))
+        for mode, result in results.items():
+            medians = result["median"]
+            self.stdout.write(f"{mode:<10}" + "".join(f"{medians[phase]:>12.1f}" for phase in PHASES))
+        if any(sample["yt_dlp_loaded"] for result in results.values() for sample in result["samples"]):
+            self.stdout.write(self.style.WARNING("yt-dlp was imported before the first request"))
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump({"git_revision": git_revision(), "results": results}, f, indent=2, sort_keys=True)
+            self.stdout.write(f"Saved results to {options['output']}")
+
+    def sample(self, warm, runs):
+        samples = []
+        for _ in range(runs):
+            self.stdout.write(f"Cold start {len(samples) + 1}/{runs} ({'warm' if warm else 'lazy'})...")
+            args = [sys.executable, "-W", "ignore", "-m", "benchmarks.startup"] + (["--warm"] if warm else [])
+            proc = subprocess.run(args, cwd=settings.BASE_DIR, env=os.environ.copy(), capture_output=True, text=True)
+            lines = proc.stdout.strip().splitlines()
+            if proc.returncode or not lines:
+                raise CommandError(f"Startup run failed:\n{proc.stderr[-2000:]}")
+            sample = json.loads(lines[-1])
+            if sample["status"] != 200:
+                raise CommandError(f"First request returned HTTP {sample['status']}")
+            samples.append(sample)
+        return {
+            "samples": samples,
+            "median": {phase: statistics.median(s[phase] for s in samples) for phase in PHASES},
+        }
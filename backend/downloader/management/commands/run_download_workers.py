@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from downloader.extraction import warm_up
+from downloader.jobs import WorkerPool
+from downloader.workspace import workspace_settings, workspaces
+from downloader.ydl_pool import ydl_pool_settings
+
+
+class Command(BaseCommand):
+    help = "Run the local worker pool that processes queued download jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, help="Number of concurrent jobs (default: DOWNLOADER_JOBS['WORKERS'])")
+        parser.add_argument(
+            "--warmup", action="store_true",
+            help="Load and prime yt-dlp before taking jobs (already done at startup when YDL_WARMUP is set)",
+        )
+
+    def handle(self, *args, **options):
+        if options["warmup"] and not ydl_pool_settings()["WARMUP"]:
+            timings = warm_up()
+            self.stdout.write("yt-dlp warmed up: " + ", ".join(f"{step} {seconds:.2f}s" for step, seconds in timings.items()))
+        if workspace_settings()["SWEEP_ON_START"]:
+            # Management commands skip it in ready(), but this one runs until stopped
+            workspaces.start()
+        pool = WorkerPool(options["workers"])
+        pool.start()
+        self.stdout.write(f"Started {pool.size} download workers ({pool.name})")
+        try:
+            pool.join()
+        except KeyboardInterrupt:
+            pool.stop()
+            self.stdout.write("Stopping; running jobs will be requeued if they do not finish.")
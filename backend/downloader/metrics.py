@@ -0,0 +1,328 @@
+import contextvars
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+# Per-stage timing lines; settings only let them through in JSON log mode
+stage_logger = logging.getLogger("downloader.stages")
+
+# Labels a view attaches to the request it is handling (see tag_request)
+request_tags_var = contextvars.ContextVar("request_tags", default=None)
+
+# Sites that get their own ``host`` label; every other host is counted as "other"
+METRIC_HOSTS = (
+    "youtube.com", "youtu.be", "soundcloud.com", "vimeo.com", "tiktok.com", "instagram.com",
+    "facebook.com", "twitter.com", "x.com", "twitch.tv", "dailymotion.com", "bandcamp.com",
+    "mixcloud.com", "reddit.com",
+)
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def metrics_settings():
+    conf = {
+        "ENABLED": True,
+        "TOKEN": "",  # if set, /metrics requires "Authorization: Bearer <TOKEN>"
+        "HOSTS": METRIC_HOSTS,
+        "DISK_TTL": 30,  # seconds the temp disk totals are reused between scrapes
+    }
+    conf.update(getattr(settings, "DOWNLOADER_METRICS", {}))
+    return conf
+
+
+def _escape(value):
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    A labelled metric in the Prometheus text format.
+
+    Values are either recorded in-process or, with ``collect``, computed at
+    scrape time by a callable returning ``{label_values_tuple: value}``.
+    Each process keeps its own values.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), collect=None, registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._collect = collect
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self):
+        """Yield ``(suffix, label_values, extra_labels, value)``."""
+        if self._collect:
+            values = self._collect()
+        else:
+            with self._lock:
+                values = dict(self._values)
+        for key, value in values.items():
+            yield "", key, (), value
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            pairs = list(zip(self.labelnames, key)) + list(extra)
+            labels = "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}" if pairs else ""
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=STAGE_BUCKETS, registry=None):
+        super().__init__(name, documentation, labelnames, registry=registry)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in values.items():
+            for bound, count in zip(self.buckets, counts):
+                yield "_bucket", key, (("le", _format_value(bound)),), count
+            yield "_sum", key, (), total
+            yield "_count", key, (), counts[-1]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def expose(self):
+        blocks = []
+        for metric in self._metrics:
+            try:
+                blocks.append(metric.expose())
+            except Exception as e:
+                # A failing collector (e.g. database down) must not hide the rest
+                logger.warning("Could not collect metric %s: %s", metric.name, e)
+        return "\n".join(blocks) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _metadata_cache_events():
+    from .cache import metadata_cache
+    return {(event,): count for event, count in metadata_cache.stats.as_dict().items()}
+
+
+def _flights():
+    from .downloads import download_flight
+    from .extraction import metadata_flight
+    return {("metadata",): metadata_flight.in_flight(), ("mp3",): download_flight.in_flight()}
+
+
+def _jobs():
+    from django.db.models import Count
+    from .models import DownloadJob
+    counts = {(DownloadJob.STATUS_QUEUED,): 0, (DownloadJob.STATUS_RUNNING,): 0}
+    rows = DownloadJob.objects.filter(
+        status__in=[DownloadJob.STATUS_QUEUED, DownloadJob.STATUS_RUNNING],
+    ).values("status").annotate(n=Count("pk"))
+    for row in rows:
+        counts[(row["status"],)] = row["n"]
+    return counts
+
+
+_disk_totals = {"at": None, "value": None}
+_disk_lock = threading.Lock()
+
+
+def _temp_disk():
+    # Walking the trees is slow on a busy host; scrapes within DISK_TTL share one walk
+    with _disk_lock:
+        now = time.monotonic()
+        at = _disk_totals["at"]
+        if at is None or now - at >= metrics_settings()["DISK_TTL"]:
+            _disk_totals["value"] = _measure_temp_disk()
+            _disk_totals["at"] = now
+        return _disk_totals["value"]
+
+
+def _measure_temp_disk():
+    from django.db.models import Sum
+    from .jobs import job_settings
+    from .models import Artifact
+    from .thumbnails import thumbnail_cache
+    from .workspace import workspaces
+    work = sum(dir_size(root) for root in workspaces.roots)
+    return {
+        ("work",): work,
+        ("jobs",): dir_size(job_settings()["ROOT"]),
+        ("artifacts",): Artifact.objects.aggregate(total=Sum("size"))["total"] or 0,
+        ("thumbnails",): dir_size(thumbnail_cache.root) if thumbnail_cache else 0,
+    }
+
+
+STAGE_SECONDS = Histogram(
+    "fetchmate_stage_seconds", "Time spent per stage of serving a link.", ("stage", "host", "mode"),
+)
+HTTP_REQUESTS = Counter(
+    "fetchmate_http_requests_total", "Requests handled, by view and status.", ("view", "status"),
+)
+BYTES_SERVED = Counter(
+    "fetchmate_bytes_served_total", "Response bytes sent for successful downloads and metadata.", ("mode",),
+)
+YTDLP_ERRORS = Counter(
+    "fetchmate_ytdlp_errors_total", "yt-dlp failures by error class.", ("error_class", "host"),
+)
+ARTIFACT_CACHE = Counter(
+    "fetchmate_artifact_cache_total", "Converted-file cache lookups, by URL or by video key.", ("result", "by"),
+)
+ADMISSION_REJECTIONS = Counter(
+    "fetchmate_admission_rejections_total", "Requests refused with 429 by admission control.", ("reason",),
+)
+INFLIGHT_REQUESTS = Gauge(
+    "fetchmate_inflight_requests", "Requests being handled by this process.",
+)
+Counter(
+    "fetchmate_metadata_cache_events_total", "Metadata cache hits, misses and evictions.", ("event",),
+    collect=_metadata_cache_events,
+)
+Gauge(
+    "fetchmate_coalesced_inflight", "Distinct extractions/conversions currently running.", ("flight",),
+    collect=_flights,
+)
+Gauge("fetchmate_jobs", "Download jobs waiting or running.", ("status",), collect=_jobs)
+Gauge("fetchmate_temp_disk_bytes", "Disk used by work dirs, job results and the artifact cache.", ("area",), collect=_temp_disk)
+
+
+def host_label(host):
+    """
+    ``host`` as a metric label.
+
+    Hosts come from user-supplied URLs, so only known sites (and their
+    subdomains) keep their name; the rest share "other" and cannot grow
+    the number of series without bound.
+    """
+    if not host:
+        return ""
+    for known in metrics_settings()["HOSTS"]:
+        if host == known or host.endswith("." + known):
+            return known
+    return "other"
+
+
+def record_stage(name, seconds, host="", mode=""):
+    STAGE_SECONDS.observe(seconds, stage=name, host=host_label(host), mode=mode)
+    stage_logger.info(
+        "stage %s took %.3fs", name, seconds,
+        extra={"stage": name, "seconds": round(seconds, 4), "host": host, "mode": mode},
+    )
+
+
+@contextmanager
+def stage(name, host="", mode=""):
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        record_stage(name, time.monotonic() - start, host, mode)
+
+
+class Stopwatch:
+    """Accumulates the time spent producing items of the iterables it wraps."""
+
+    def __init__(self):
+        self.elapsed = 0.0
+
+    def timed(self, iterable):
+        iterator = iter(iterable)
+        while True:
+            start = time.monotonic()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.elapsed += time.monotonic() - start
+                return
+            self.elapsed += time.monotonic() - start
+            yield item
+
+
+def error_class(error):
+    """Short class for a yt-dlp DownloadError, based on the exception that caused it."""
+    if "Sign in to confirm" in str(error):
+        return "LoginRequired"
+    cause = (getattr(error, "exc_info", None) or (None, None))[1]
+    return type(cause or error).__name__
+
+
+def record_error(error, host=""):
+    YTDLP_ERRORS.inc(error_class=error_class(error), host=host_label(host))
+
+
+def tag_request(**tags):
+    """Attach labels (``host``, ``mode``) to the current request's stage metrics."""
+    current = request_tags_var.get()
+    if current is not None:
+        current.update(tags)
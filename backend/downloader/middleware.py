@@ -0,0 +1,298 @@
+import time
+import uuid
+import zlib
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+from .log import request_id_var
+from .metrics import BYTES_SERVED, HTTP_REQUESTS, INFLIGHT_REQUESTS, record_stage, request_tags_var
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+
+def compression_settings():
+    conf = {
+        "ENABLED": True,
+        # Only these paths: auth responses carry tokens next to user input (BREACH)
+        "PATHS": ("/api/downloader/",),
+        "CONTENT_TYPES": ("application/json", "application/x-ndjson"),
+        "MIN_SIZE": 1024,
+        "GZIP_LEVEL": 6,
+        "BROTLI_QUALITY": 5,  # higher levels cost more CPU than they save on dynamic JSON
+    }
+    conf.update(getattr(settings, "DOWNLOADER_COMPRESSION", {}))
+    return conf
+
+
+def accepted_encodings(header):
+    """``{coding: q}`` from an Accept-Encoding header."""
+    accepted = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def choose_encoding(header):
+    accepted = accepted_encodings(header)
+    wildcard = accepted.get("*", 0.0)
+    for coding in (("br", "gzip") if brotli else ("gzip",)):
+        if accepted.get(coding, wildcard) > 0:
+            return coding
+    return None
+
+
+class Compressor:
+    """Incremental brotli or gzip encoder; ``flush`` emits everything fed so far."""
+
+    def __init__(self, coding, conf):
+        self.coding = coding
+        if coding == "br":
+            self._brotli = brotli.Compressor(mode=brotli.MODE_TEXT, quality=conf["BROTLI_QUALITY"])
+        else:
+            self._zlib = zlib.compressobj(conf["GZIP_LEVEL"], zlib.DEFLATED, 31)  # 31: gzip container
+
+    def compress(self, data, flush=False):
+        if self.coding == "br":
+            out = self._brotli.process(data)
+            return out + self._brotli.flush() if flush else out
+        out = self._zlib.compress(data)
+        return out + self._zlib.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self):
+        return self._brotli.finish() if self.coding == "br" else self._zlib.flush()
+
+
+class RequestMetricsMiddleware:
+    """
+    Gives every request an id and records request-level metrics.
+
+    The id comes from ``X-Request-ID`` or is generated, is echoed in the
+    response and is attached to every log record. Views that call
+    ``tag_request`` also get ``respond`` (until the response object exists)
+    and ``stream`` (until the response has been sent) stage timings.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = self.begin(request)
+        try:
+            return self.finish(request, self.get_response(request), state)
+        finally:
+            self.end(state)
+
+    async def __acall__(self, request):
+        state = self.begin(request)
+        try:
+            return self.finish(request, await self.get_response(request), state)
+        finally:
+            self.end(state)
+
+    def begin(self, request):
+        request_id = request.headers.get("X-Request-ID", "")[:64] or uuid.uuid4().hex
+        request.request_id = request_id
+        INFLIGHT_REQUESTS.inc()
+        tags = {}
+        return {
+            "request_id": request_id,
+            "tags": tags,
+            "started": time.monotonic(),
+            "tokens": (request_id_var.set(request_id), request_tags_var.set(tags)),
+        }
+
+    def end(self, state):
+        INFLIGHT_REQUESTS.dec()
+        id_token, tags_token = state["tokens"]
+        request_id_var.reset(id_token)
+        request_tags_var.reset(tags_token)
+
+    def finish(self, request, response, state):
+        responded = time.monotonic()
+        response["X-Request-ID"] = state["request_id"]
+        match = request.resolver_match
+        HTTP_REQUESTS.inc(view=match.view_name if match else "", status=response.status_code)
+
+        tags = state["tags"]
+        if not tags:
+            return response
+        host, mode = tags.get("host", ""), tags.get("mode", "")
+        record_stage("respond", responded - state["started"], host, mode)
+
+        sent = {"bytes": 0}
+        length = response.get("Content-Length")
+        if response.streaming and length is None:
+            # Count chunks; responses with a length (e.g. FileResponse) keep
+            # their file object so servers can still use sendfile.
+            response.streaming_content = self.counted(response, state, sent)
+
+        close = response.close
+
+        def close_and_record():
+            try:
+                close()
+            finally:
+                # Servers may call close() more than once
+                if not sent.get("closed"):
+                    sent["closed"] = True
+                    self.record_sent(response, state, responded, length, sent["bytes"])
+
+        response.close = close_and_record
+        return response
+
+    def record_sent(self, response, state, responded, length, streamed):
+        host, mode = state["tags"].get("host", ""), state["tags"].get("mode", "")
+        token = request_id_var.set(state["request_id"])
+        try:
+            record_stage("stream", time.monotonic() - responded, host, mode)
+        finally:
+            request_id_var.reset(token)
+        if response.status_code < 400:
+            if length is not None:
+                size = int(length)
+            elif response.streaming:
+                size = streamed
+            else:
+                size = len(response.content)
+            BYTES_SERVED.inc(size, mode=mode)
+
+    def counted(self, response, state, sent):
+        # Streaming bodies are produced after the request context is gone;
+        # restore the request id while each chunk is generated.
+        request_id = state["request_id"]
+        if response.is_async:
+            async def count_async(content):
+                iterator = aiter(content)
+                while True:
+                    token = request_id_var.set(request_id)
+                    try:
+                        chunk = await anext(iterator)
+                    except StopAsyncIteration:
+                        return
+                    finally:
+                        request_id_var.reset(token)
+                    sent["bytes"] += len(chunk)
+                    yield chunk
+            return count_async(response.streaming_content)
+
+        def count(content):
+            iterator = iter(content)
+            while True:
+                token = request_id_var.set(request_id)
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    request_id_var.reset(token)
+                sent["bytes"] += len(chunk)
+                yield chunk
+        return count(response.streaming_content)
+
+
+class CompressionMiddleware:
+    """
+    Compresses JSON and NDJSON responses with brotli or gzip, whichever the
+    client's ``Accept-Encoding`` allows (brotli preferred).
+
+    Streaming responses are compressed chunk by chunk and flushed after
+    each one, so NDJSON items still reach the client as they are produced.
+    Files, media and anything already encoded pass through untouched.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.conf = compression_settings()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process(request, await self.get_response(request))
+
+    def eligible(self, request, response):
+        conf = self.conf
+        content_type = response.get("Content-Type", "").split(";")[0].strip()
+        return (
+            conf["ENABLED"]
+            and request.path.startswith(tuple(conf["PATHS"]))
+            and content_type in conf["CONTENT_TYPES"]
+            and response.status_code != 206
+            and not response.has_header("Content-Encoding")
+            and "no-transform" not in response.get("Cache-Control", "")
+        )
+
+    def process(self, request, response):
+        if not self.eligible(request, response):
+            return response
+        patch_vary_headers(response, ("Accept-Encoding",))
+        coding = choose_encoding(request.headers.get("Accept-Encoding", ""))
+        if coding is None:
+            return response
+
+        if response.streaming:
+            compressor = Compressor(coding, self.conf)
+            if response.is_async:
+                response.streaming_content = self.compress_async(response.streaming_content, compressor)
+            else:
+                response.streaming_content = self.compress_stream(response.streaming_content, compressor)
+            del response["Content-Length"]
+        else:
+            if len(response.content) < self.conf["MIN_SIZE"]:
+                return response
+            compressor = Compressor(coding, self.conf)
+            compressed = compressor.compress(response.content) + compressor.finish()
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response["Content-Length"] = str(len(compressed))
+
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            # The bytes differ from the identity encoding's
+            response["ETag"] = "W/" + etag
+        response["Content-Encoding"] = coding
+        return response
+
+    @staticmethod
+    def compress_stream(content, compressor):
+        for chunk in content:
+            out = compressor.compress(chunk, flush=True)
+            if out:
+                yield out
+        yield compressor.finish()
+
+    @staticmethod
+    async def compress_async(content, compressor):
+        async for chunk in content:
+            out = compressor.compress(chunk, flush=True)
+            if out:
+                yield out
+        yield compressor.finish()
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Artifact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('source_url', models.CharField(blank=True, db_index=True, max_length=2048)),
+                ('extractor', models.CharField(max_length=64)),
+                ('video_id', models.CharField(max_length=128)),
+                ('codec', models.CharField(max_length=16)),
+                ('quality', models.CharField(max_length=16)),
+                ('path', models.CharField(max_length=1024)),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField(default=0)),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_accessed_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
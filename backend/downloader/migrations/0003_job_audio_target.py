@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0002_artifact'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadjob',
+            name='audio_codec',
+            field=models.CharField(default='mp3', max_length=8),
+        ),
+        migrations.AddField(
+            model_name='downloadjob',
+            name='audio_quality',
+            field=models.CharField(default='192', max_length=8),
+        ),
+    ]
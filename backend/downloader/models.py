@@ -1,3 +1,76 @@
+import uuid
+
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
+
+class DownloadJob(models.Model):
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_FINISHED = "finished"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = (
+        (STATUS_QUEUED, "Queued"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_FINISHED, "Finished"),
+        (STATUS_FAILED, "Failed"),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="download_jobs")
+    url = models.CharField(max_length=2048)
+    convert_mp3 = models.BooleanField(default=True)
+    audio_codec = models.CharField(max_length=8, default="mp3")
+    audio_quality = models.CharField(max_length=8, default="192")
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    progress = models.FloatField(default=0)
+    downloaded_bytes = models.BigIntegerField(default=0)
+    total_bytes = models.BigIntegerField(null=True, blank=True)
+    items_done = models.PositiveIntegerField(default=0)
+    items_total = models.PositiveIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    result_path = models.CharField(max_length=1024, blank=True)
+    result_name = models.CharField(max_length=255, blank=True)
+
+    worker = models.CharField(max_length=64, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["created_at"]
+        indexes = [
+            models.Index(fields=["status", "created_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.id} ({self.status})"
+
+    @property
+    def is_done(self):
+        return self.status in (self.STATUS_FINISHED, self.STATUS_FAILED)
+
+
+class Artifact(models.Model):
+    """A converted output kept on disk, indexed by (extractor, video id, codec, quality)."""
+
+    key = models.CharField(max_length=255, unique=True)
+    source_url = models.CharField(max_length=2048, db_index=True, blank=True)
+    extractor = models.CharField(max_length=64)
+    video_id = models.CharField(max_length=128)
+    codec = models.CharField(max_length=16)
+    quality = models.CharField(max_length=16)
+
+    path = models.CharField(max_length=1024)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField(default=0)
+
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_accessed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return self.key
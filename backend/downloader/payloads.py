@@ -0,0 +1,101 @@
+from .formats import format_preferences, parse_flag, rank_formats
+from .thumbnails import thumbnail_path
+
+
+def is_youtube_music_url(url):
+    return "music.youtube.com" in url.lower()
+
+
+def audio_format(f, ext=None):
+    return {
+        "format_id": f.get("format_id"),
+        "url": f.get("url"),
+        "ext": ext or f.get("ext"),
+        "type": "audio",
+        "bitrate": f.get("abr"),
+        "size": f.get("filesize") or f.get("filesize_approx"),
+        "resolution": None,
+    }
+
+
+def video_format(f):
+    return {
+        "format_id": f.get("format_id"),
+        "url": f.get("url"),
+        "ext": f.get("ext"),
+        "type": "video",
+        "resolution": f"{f.get('height')}p" if f.get("height") else None,
+        "size": f.get("filesize") or f.get("filesize_approx"),
+        "bitrate": f.get("abr"),
+    }
+
+
+def format_list(raw_formats, is_youtube_music=False, max_height=None, prefer_smaller=False):
+    """Best audio formats first, then the best muxed video formats."""
+    if is_youtube_music:
+        ranked = rank_formats(raw_formats, {"audio": 3}, prefer_smaller=prefer_smaller)
+        return [audio_format(f, "m4a") for f in ranked["audio"]]
+
+    ranked = rank_formats(raw_formats, max_height=max_height, prefer_smaller=prefer_smaller)
+    return [audio_format(f) for f in ranked["audio"]] + [video_format(f) for f in ranked["video"]]
+
+
+def payload_options(data):
+    """
+    Read format preferences plus response shaping options from request data.
+
+    ``fields`` (a list or comma-separated string) keeps only those keys of
+    each video or track; ``formats.<key>`` entries do the same inside
+    formats. ``compact`` drops keys whose value is null.
+    """
+    options = format_preferences(data)
+    fields = data.get("fields") or ()
+    if isinstance(fields, str):
+        fields = fields.split(",")
+    options["fields"] = [f.strip() for f in fields if isinstance(f, str) and f.strip()] or None
+    options["compact"] = parse_flag(data.get("compact", False))
+    return options
+
+
+def shape(item, fields=None, compact=False):
+    """Apply ``fields`` and ``compact`` (see ``payload_options``) to one video or track dict."""
+    if fields:
+        format_fields = {f.split(".", 1)[1] for f in fields if f.startswith("formats.")}
+        keep = {f for f in fields if "." not in f} | ({"formats"} if format_fields else set())
+        item = {k: v for k, v in item.items() if k in keep}
+        if format_fields and "formats" in item:
+            item["formats"] = [{k: v for k, v in f.items() if k in format_fields} for f in item["formats"]]
+    if compact:
+        item = {k: v for k, v in item.items() if v is not None}
+        if "formats" in item:
+            item["formats"] = [{k: v for k, v in f.items() if v is not None} for f in item["formats"]]
+    return item
+
+
+def metadata_payload(info, is_youtube_music=False, max_height=None, prefer_smaller=False, fields=None, compact=False):
+    """Shape a yt-dlp info dict into the metadata returned by the fetch endpoints."""
+    # Playlist handling
+    if "entries" in info:
+        tracks = [shape({
+            "title": e.get("title"),
+            "uploader": e.get("uploader"),
+            "thumbnail": e.get("thumbnail"),
+            "thumbnail_proxy": thumbnail_path(e.get("thumbnail")),
+            "formats": format_list(e.get("formats"), is_youtube_music, max_height, prefer_smaller),
+        }, fields, compact) for e in info["entries"]]
+        return {
+            "playlist_title": info.get("title"),
+            "uploader": info.get("uploader"),
+            "tracks": tracks
+        }
+
+    payload = {
+        "title": info.get("title"),
+        "thumbnail": info.get("thumbnail"),
+        "thumbnail_proxy": thumbnail_path(info.get("thumbnail")),
+        "uploader": info.get("uploader"),
+    }
+    if is_youtube_music:
+        payload["format_label"] = "AUTO"
+    payload["formats"] = format_list(info.get("formats"), is_youtube_music, max_height, prefer_smaller)
+    return shape(payload, fields, compact)
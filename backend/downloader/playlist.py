@@ -0,0 +1,270 @@
+import contextvars
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlparse
+
+from django.conf import settings
+from django.db import connections
+
+from .artifacts import artifact_key, artifact_store
+from .cache import url_host
+from .extraction import normalize_url, ydl_pool
+from .hosts import host_scheduler
+from .lazy import download_error
+from .metrics import record_error, stage
+from .transcode import PRIORITY_PLAYLIST, audio_target, download_format, transcode, transcode_pool
+
+logger = logging.getLogger(__name__)
+
+PLAYLIST_TYPES = ("playlist", "multi_video")
+
+
+def playlist_settings():
+    conf = {
+        "DOWNLOAD_WORKERS": 4,
+        # Tracks downloaded but not yet converted, per playlist
+        "MAX_PENDING_TRANSCODES": 2 * (os.cpu_count() or 2),
+        "PAGE_SIZE": 50,
+        "MAX_PAGE_SIZE": 200,
+    }
+    conf.update(getattr(settings, "DOWNLOADER_PLAYLIST", {}))
+    return conf
+
+
+def is_playlist(ie_result):
+    return ie_result.get("_type") in PLAYLIST_TYPES
+
+
+def looks_like_playlist(url):
+    """Guess from the URL alone, before extracting, whether it names a playlist."""
+    parsed = urlparse(url)
+    path = parsed.path.lower()
+    return "list" in parse_qs(parsed.query) or "/playlist" in path or "/sets/" in path or "/album/" in path
+
+
+def flatten_entries(ie_result):
+    """Resolve an unprocessed playlist result into lightweight (flat) entries."""
+    host = url_host(ie_result.get("webpage_url") or ie_result.get("url") or "")
+    with host_scheduler.slot(host), ydl_pool.lend("flat") as ydl, stage("extract", host, "playlist"):
+        info = ydl.process_ie_result(ie_result, download=False)
+    info["entries"] = [e for e in info.get("entries") or [] if e]
+    return info
+
+
+def enumerate_playlist(url, start=1, end=None):
+    """
+    Flat-extract ``url``, limited to playlist items ``start``..``end`` (1-based).
+
+    Entries are lightweight url results, so only the requested window of
+    a huge playlist is listed. A single video comes back fully extracted.
+    """
+    params = {"lazy_playlist": True}
+    if start > 1 or end:
+        params["playlist_items"] = f"{start}:{end or ''}"
+    host = url_host(url)
+    with host_scheduler.slot(host), ydl_pool.lend("flat", **params) as ydl, stage("extract", host, "stream"):
+        info = ydl.extract_info(normalize_url(url), download=False)
+    if "entries" in info:
+        info["entries"] = [e for e in info["entries"] or [] if e]
+    return info
+
+
+class TrackResult:
+    def __init__(self, index, entry, path=None, error=None):
+        self.index = index
+        self.entry = entry
+        self.path = path
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def title(self):
+        return self.entry.get("title") or self.entry.get("id") or f"Track {self.index}"
+
+    @property
+    def filename(self):
+        return os.path.basename(self.path) if self.path else None
+
+
+class PlaylistPipeline:
+    """
+    Downloads (and optionally transcodes) playlist entries in parallel.
+
+    Downloads are network bound and run on the pipeline's own threads;
+    transcodes are CPU bound and go to the shared transcode pool in the
+    playlist lane, behind single tracks. At most ``max_pending`` tracks sit
+    downloaded but unconverted at any time, which keeps disk usage bounded.
+    Results are yielded in completion order; a failed track yields a
+    ``TrackResult`` with ``error`` set instead of aborting the playlist.
+
+    A reader that stops early cancels queued work, but tracks already
+    downloading or converting run to the end; ``when_idle`` tells when
+    nothing writes into ``work_dir`` any more.
+    """
+
+    def __init__(self, entries, work_dir, convert_mp3=True, progress_hooks=None,
+                 download_workers=None, max_pending=None, codec=None, quality=None):
+        conf = playlist_settings()
+        self.entries = list(entries)
+        self.work_dir = work_dir
+        self.convert_mp3 = convert_mp3
+        self.progress_hooks = progress_hooks
+        self.download_workers = download_workers or conf["DOWNLOAD_WORKERS"]
+        self.max_pending = max_pending or conf["MAX_PENDING_TRANSCODES"]
+        self.codec, self.quality = audio_target(codec, quality) if convert_mp3 else (None, None)
+        self._active = 0
+        self._on_idle = []
+        self._lock = threading.Lock()
+
+    def _track_started(self, count=1):
+        with self._lock:
+            self._active += count
+
+    def _track_done(self):
+        with self._lock:
+            self._active -= 1
+            if self._active:
+                return
+            on_idle, self._on_idle = self._on_idle, []
+        for callback in on_idle:
+            try:
+                callback()
+            except Exception as e:
+                logger.error("Playlist cleanup failed: %s", e)
+
+    def when_idle(self, callback):
+        """Call ``callback`` once no track is downloading or converting, right away if none is."""
+        with self._lock:
+            if self._active:
+                self._on_idle.append(callback)
+                return
+        callback()
+
+    def __iter__(self):
+        results = queue.Queue()
+        backlog = threading.BoundedSemaphore(self.max_pending)
+        downloads = ThreadPoolExecutor(self.download_workers, thread_name_prefix="playlist-dl")
+        transcodes = []
+        fetches = []
+        closed = threading.Event()
+
+        def download_then_queue(index, entry):
+            converting = False
+            try:
+                converting = fetch(index, entry)
+            finally:
+                if not converting:
+                    self._track_done()
+
+        def fetch(index, entry):
+            """Download one track; returns True once its transcode is queued."""
+            backlog.acquire()
+            if closed.is_set():
+                # The reader went away while this track waited for a slot
+                backlog.release()
+                return
+            try:
+                cached = self.cached(index, entry)
+                if cached:
+                    backlog.release()
+                    results.put(TrackResult(index, entry, path=cached))
+                    return
+                download = self.download(index, entry)
+            except Exception as e:
+                backlog.release()
+                results.put(self.failed(index, entry, e))
+                return
+            finally:
+                # Progress hooks and artifact lookups use the DB from this thread
+                connections.close_all()
+            if closed.is_set():
+                backlog.release()
+                return
+            if not self.convert_mp3:
+                backlog.release()
+                results.put(TrackResult(index, entry, path=download["filepath"]))
+                return
+            transcodes.append(transcode_pool.submit(
+                transcode_then_queue, index, entry, download, priority=PRIORITY_PLAYLIST,
+            ))
+            return True
+
+        def transcode_then_queue(index, entry, download):
+            try:
+                path = self.transcode(download)
+                self.publish(entry, path)
+                results.put(TrackResult(index, entry, path=path))
+            except Exception as e:
+                results.put(self.failed(index, entry, e))
+            finally:
+                backlog.release()
+                self._track_done()
+
+        self._track_started(len(self.entries))
+        try:
+            for index, entry in enumerate(self.entries, start=1):
+                fetches.append(downloads.submit(contextvars.copy_context().run, download_then_queue, index, entry))
+            for _ in self.entries:
+                yield results.get()
+        finally:
+            closed.set()
+            downloads.shutdown(wait=False, cancel_futures=True)
+            for future in fetches:
+                if future.cancelled():
+                    self._track_done()
+            for future in list(transcodes):
+                # A cancelled transcode never runs, so its backlog slot is handed back here;
+                # otherwise downloads blocked on the backlog would wait forever.
+                if future.cancel():
+                    backlog.release()
+                    self._track_done()
+
+    def track_dir(self, index):
+        return os.path.join(self.work_dir, f"{index:04d}")
+
+    def cached(self, index, entry):
+        if not (self.convert_mp3 and artifact_store):
+            return None
+        return artifact_store.fetch(
+            entry.get("ie_key"), entry.get("id"), self.codec, self.quality, self.track_dir(index),
+        )
+
+    def publish(self, entry, path):
+        extractor, video_id = entry.get("ie_key"), entry.get("id")
+        if artifact_store and extractor and video_id:
+            artifact_store.publish(
+                path, artifact_key(extractor, video_id, self.codec, self.quality),
+                extractor, video_id, self.codec, self.quality, source_url=entry_url(entry),
+            )
+
+    def download(self, index, entry):
+        track_dir = self.track_dir(index)
+        os.makedirs(track_dir, exist_ok=True)
+        profile = "audio" if self.convert_mp3 else "video"
+        params = {"format": download_format(self.codec)} if self.convert_mp3 else {}
+        extra = {"playlist_index": index, "n_entries": len(self.entries)}
+        host = url_host(entry_url(entry))
+        lend = ydl_pool.lend(profile, tmp_dir=track_dir, progress_hooks=self.progress_hooks, **params)
+        with host_scheduler.slot(host, limit=False), lend as ydl, stage("download", host, "playlist"):
+            info = ydl.extract_info(entry_url(entry), download=True, ie_key=entry.get("ie_key"), extra_info=extra)
+        return info["requested_downloads"][0]
+
+    def transcode(self, download):
+        host = url_host(download.get("webpage_url") or "")
+        return transcode(download, self.codec, self.quality, host, "playlist")
+
+    def failed(self, index, entry, error):
+        logger.warning("Playlist track %s (%s) failed: %s", index, entry_url(entry), error)
+        if isinstance(error, download_error()):
+            record_error(error, url_host(entry_url(entry)))
+        return TrackResult(index, entry, error=str(error))
+
+
+def entry_url(entry):
+    return entry.get("webpage_url") or entry.get("url")
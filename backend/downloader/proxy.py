@@ -0,0 +1,309 @@
+import http.client
+import ipaddress
+import mimetypes
+import socket
+import ssl
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urljoin, urlsplit
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.http import content_disposition_header
+
+from .cache import metadata_cache, url_host
+from .extraction import extract_metadata, ydl_pool
+from .formats import rank_formats
+from .metrics import stage
+
+REDIRECTS = (301, 302, 303, 307, 308)
+# Client headers forwarded to the source, and source headers sent back
+REQUEST_HEADERS = ("Range", "If-Range")
+RESPONSE_HEADERS = ("Content-Type", "Content-Length", "Content-Range", "Accept-Ranges", "ETag", "Last-Modified")
+PROXIED_PROTOCOLS = ("http", "https")
+
+
+def proxy_settings():
+    conf = {
+        "CHUNK_SIZE": 64 * 1024,  # upper bound on bytes held per stream
+        "MAX_IDLE_PER_HOST": 4,
+        "IDLE_TIMEOUT": 30,
+        "TIMEOUT": 15,
+        "MAX_REDIRECTS": 5,
+        # Connect to loopback, private and link-local addresses (tests and local stubs only)
+        "ALLOW_PRIVATE_HOSTS": False,
+    }
+    conf.update(getattr(settings, "DOWNLOADER_PROXY", {}))
+    return conf
+
+
+class UpstreamError(Exception):
+    def __init__(self, message, status=502):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def public_addresses(host, port):
+    """
+    Resolve ``host`` and return its addresses, refusing non-public ones.
+
+    Media URLs come from whatever page the extractor was pointed at, so a
+    source resolving to loopback, a private network or link-local (cloud
+    metadata) addresses is refused rather than relayed.
+    """
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise UpstreamError(f"Could not resolve the source: {e}")
+    addresses = []
+    for *_, sockaddr in infos:
+        ip = ipaddress.ip_address(sockaddr[0].split("%")[0])
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        if not ip.is_global:
+            raise UpstreamError("The source address is not allowed", status=403)
+        addresses.append(sockaddr[0])
+    return addresses
+
+
+def connect_public(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+    """``socket.create_connection`` to the address checked by ``public_addresses``, so DNS cannot change it."""
+    host, port = address
+    error = None
+    for ip in public_addresses(host, port):
+        try:
+            return socket.create_connection((ip, port), timeout, source_address)
+        except OSError as e:
+            error = e
+    raise error
+
+
+class ConnectionPool:
+    """
+    Idle keep-alive connections to source hosts, reused across streams.
+
+    A connection goes back to the pool only after its response body was
+    read to the end; idle ones older than ``idle_timeout`` are dropped.
+    New connections only go to public addresses unless ``allow_private``.
+    """
+
+    def __init__(self, max_idle_per_host=4, idle_timeout=30, timeout=15, allow_private=False):
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.allow_private = allow_private
+        self._idle = defaultdict(list)  # (scheme, host, port) -> [(conn, released_at)]
+        self._lock = threading.Lock()
+        self._ssl = ssl.create_default_context()
+
+    def _connect(self, key):
+        scheme, host, port = key
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self._ssl)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        if not self.allow_private:
+            # TLS still verifies the certificate against ``host``
+            conn._create_connection = connect_public
+        return conn
+
+    def acquire(self, key):
+        """Return ``(connection, reused)``."""
+        now = time.monotonic()
+        stale = []
+        with self._lock:
+            idle = self._idle[key]
+            while idle:
+                conn, released_at = idle.pop()
+                if now - released_at < self.idle_timeout:
+                    break
+                stale.append(conn)
+            else:
+                conn = None
+        for old in stale:
+            old.close()
+        return (conn, True) if conn else (self._connect(key), False)
+
+    def release(self, key, conn):
+        with self._lock:
+            idle = self._idle[key]
+            if len(idle) < self.max_idle_per_host:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def request(self, key, path, headers):
+        """Send a GET and return ``(response, connection)``, retrying once if a reused connection went stale."""
+        conn, reused = self.acquire(key)
+        try:
+            conn.request("GET", path, headers=headers)
+            return conn.getresponse(), conn
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            conn.close()
+            if not reused:
+                raise
+        conn = self._connect(key)
+        try:
+            conn.request("GET", path, headers=headers)
+            return conn.getresponse(), conn
+        except BaseException:
+            conn.close()
+            raise
+
+    def clear(self):
+        with self._lock:
+            idle = [conn for conns in self._idle.values() for conn, _ in conns]
+            self._idle.clear()
+        for conn in idle:
+            conn.close()
+
+
+class Upstream:
+    """
+    An open source response; iterating yields its body in bounded chunks.
+
+    Chunks are read only as the client consumes them, so a slow client
+    slows the source read instead of growing a buffer.
+    """
+
+    def __init__(self, pool, key, conn, response, chunk_size):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.chunk_size = chunk_size
+        self.finished = False
+
+    @property
+    def status(self):
+        return self.response.status
+
+    def header(self, name):
+        return self.response.getheader(name)
+
+    def __iter__(self):
+        try:
+            while True:
+                chunk = self.response.read1(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+            self.finished = True
+        finally:
+            self.close()
+
+    def close(self):
+        conn, self.conn = self.conn, None
+        if conn is None:
+            return
+        # Closing a fully read response leaves the socket open for the next request
+        self.response.close()
+        if self.finished and not self.response.will_close:
+            self.pool.release(self.key, conn)
+        else:
+            conn.close()
+
+
+def open_upstream(url, headers, pool=None, cookies=False):
+    """
+    GET ``url`` following redirects; returns an ``Upstream`` with the headers read.
+
+    With ``cookies``, each hop sends the shared jar's cookies for its own
+    URL, and none once a redirect leaves the original host.
+    """
+    conf = proxy_settings()
+    pool = pool or connection_pool
+    origin = urlsplit(url).hostname
+    for _ in range(conf["MAX_REDIRECTS"] + 1):
+        parts = urlsplit(url)
+        if parts.scheme not in PROXIED_PROTOCOLS or not parts.hostname:
+            raise UpstreamError("The source URL cannot be streamed", status=400)
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        cookies = cookies and parts.hostname == origin
+        hop_headers = {k: v for k, v in headers.items() if k.lower() != "cookie"}
+        cookie = ydl_pool.cookie_header(url) if cookies else None
+        if cookie:
+            hop_headers["Cookie"] = cookie
+        try:
+            response, conn = pool.request(key, path, hop_headers)
+        except (OSError, http.client.HTTPException) as e:
+            raise UpstreamError(f"Could not reach the source: {e}")
+        upstream = Upstream(pool, key, conn, response, conf["CHUNK_SIZE"])
+        location = response.getheader("Location")
+        if response.status not in REDIRECTS or not location:
+            return upstream
+        # Drain the (small) redirect body so the connection can be reused
+        for _ in upstream:
+            pass
+        url = urljoin(url, location)
+    raise UpstreamError("The source redirected too many times")
+
+
+def select_format(info, format_id=None):
+    """The format to stream: ``format_id`` if given, else the best muxed one (or best audio)."""
+    formats = [f for f in info.get("formats") or [] if f.get("protocol", "https") in PROXIED_PROTOCOLS]
+    if format_id:
+        return next((f for f in formats if str(f.get("format_id")) == str(format_id)), None)
+    ranked = rank_formats(formats, {"audio": 1, "video": 1})
+    return (ranked["video"] or ranked["audio"] or [None])[0]
+
+
+def source_headers(f, client_headers):
+    # Cookies are added per hop by ``open_upstream``
+    headers = {k: v for k, v in (f.get("http_headers") or {}).items() if k.lower() != "cookie"}
+    for name in REQUEST_HEADERS:
+        if client_headers.get(name):
+            headers[name] = client_headers[name]
+    return headers
+
+
+def open_format(url, format_id, client_headers):
+    """
+    Resolve ``url`` and open the chosen format at the source.
+
+    Signed media URLs can expire before the cached metadata does; on a 403
+    or 410 the metadata is extracted again once and the request retried.
+    Returns ``(info, format, upstream)``.
+    """
+    host = url_host(url)
+    for attempt in range(2):
+        info = extract_metadata(url)
+        if "entries" in info:
+            raise UpstreamError("Streaming is only available for single videos", status=400)
+        f = select_format(info, format_id)
+        if f is None:
+            raise UpstreamError("That format is not available for streaming", status=400)
+        with stage("upstream", host, "proxy"):
+            upstream = open_upstream(f["url"], source_headers(f, client_headers), cookies=True)
+        if upstream.status in (403, 410) and attempt == 0:
+            upstream.close()
+            metadata_cache.delete(url)
+            continue
+        if upstream.status >= 400 and upstream.status != 416:
+            upstream.close()
+            raise UpstreamError(f"The source refused the download ({upstream.status})")
+        return info, f, upstream
+
+
+def stream_response(info, f, upstream):
+    """Relay ``upstream`` to the client without touching disk."""
+    filename = f"{info.get('title') or info.get('id') or 'download'}.{f.get('ext') or 'bin'}"
+    content_type = upstream.header("Content-Type") or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    response = StreamingHttpResponse(upstream, status=upstream.status, content_type=content_type)
+    for name in RESPONSE_HEADERS[1:]:
+        value = upstream.header(name)
+        if value:
+            response[name] = value
+    response["Content-Disposition"] = content_disposition_header(True, filename)
+    return response
+
+
+def build_connection_pool():
+    conf = proxy_settings()
+    return ConnectionPool(conf["MAX_IDLE_PER_HOST"], conf["IDLE_TIMEOUT"], conf["TIMEOUT"], conf["ALLOW_PRIVATE_HOSTS"])
+
+
+connection_pool = build_connection_pool()
@@ -0,0 +1,35 @@
+import json
+
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:  # falls back to the standard library encoder
+    orjson = None
+
+_encoder = encoders.JSONEncoder()
+
+
+def dumps(data):
+    """Compact UTF-8 JSON bytes, encoding what DRF's encoder does (lazy strings, Decimals, ...)."""
+    if orjson is None:
+        return json.dumps(data, cls=encoders.JSONEncoder, ensure_ascii=False, separators=(",", ":")).encode()
+    # Datetimes go through DRF's encoder so both paths format them the same way
+    return orjson.dumps(data, default=_encoder.default, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+
+
+def json_response(data, status=200):
+    return HttpResponse(dumps(data), status=status, content_type="application/json")
+
+
+class ORJSONRenderer(JSONRenderer):
+    """``JSONRenderer`` that serializes with orjson when it is installed."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b""
+        return dumps(data)
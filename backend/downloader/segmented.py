@@ -0,0 +1,296 @@
+import os
+import re
+import threading
+import time
+from collections import deque
+
+import yt_dlp
+from django.conf import settings
+from yt_dlp.downloader import get_suitable_downloader
+from yt_dlp.downloader.fragment import FragmentFD
+from yt_dlp.downloader.http import HttpFD
+from yt_dlp.networking import Request
+from yt_dlp.networking.exceptions import HTTPError, TransportError
+from yt_dlp.utils.networking import HTTPHeaderDict
+
+from .metrics import Counter, Gauge
+
+CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+)")
+SEGMENTED_PROTOCOLS = ("http", "https")
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+SEGMENT_RETRIES = Counter(
+    "fetchmate_segment_retries_total", "Range segments re-requested after a failed or cut-off read.",
+)
+
+
+def segmented_settings():
+    conf = {
+        "ENABLED": True,
+        "CONNECTIONS_PER_FILE": 4,
+        # Extra connections shared by every download in the process; a
+        # download that gets none falls back to a single connection.
+        "MAX_CONNECTIONS": 32,
+        "SEGMENT_SIZE": 8 * 1024 ** 2,
+        "MIN_SIZE": 16 * 1024 ** 2,  # smaller files are not worth splitting
+        "SEGMENT_RETRIES": 5,
+        "BLOCK_SIZE": 64 * 1024,
+    }
+    conf.update(getattr(settings, "DOWNLOADER_SEGMENTED", {}))
+    return conf
+
+
+class ConnectionBudget:
+    """Process-wide count of connections held by parallel downloads."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, wanted):
+        """Take up to ``wanted`` connections without waiting; returns how many were granted."""
+        with self._lock:
+            granted = max(0, min(wanted, self.limit - self._used))
+            self._used += granted
+            return granted
+
+    def release(self, count):
+        with self._lock:
+            self._used -= count
+
+    @property
+    def in_use(self):
+        return self._used
+
+
+class RangesUnsupported(Exception):
+    pass
+
+
+def preallocate(fd, size):
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        # No fallocate here (or not on this filesystem); a sparse file still lets segments land in place
+        os.ftruncate(fd, size)
+
+
+class SegmentedHttpFD(HttpFD):
+    """
+    HTTP downloader that fetches large files as parallel Range segments.
+
+    The ``.part`` file is preallocated to the final size and every segment
+    is written at its own offset, so nothing is reassembled afterwards. A
+    segment that fails or is cut off is re-requested from where it stopped,
+    up to ``SEGMENT_RETRIES`` times. Files of unknown size, servers that
+    ignore ``Range`` and downloads that get no extra connections from the
+    budget use the regular single-connection ``HttpFD``.
+    """
+
+    FD_NAME = "segmented"
+
+    def real_download(self, filename, info_dict):
+        conf = segmented_settings()
+        plan = self._plan(filename, info_dict, conf)
+        if plan is None:
+            return super().real_download(filename, info_dict)
+        size, segment_size = plan
+        granted = connection_budget.acquire(min(conf["CONNECTIONS_PER_FILE"], -(-size // segment_size)))
+        try:
+            if granted < 2:
+                return super().real_download(filename, info_dict)
+            try:
+                return self._download_segments(filename, info_dict, size, segment_size, granted, conf)
+            except RangesUnsupported:
+                return super().real_download(filename, info_dict)
+        finally:
+            connection_budget.release(granted)
+
+    def _plan(self, filename, info_dict, conf):
+        """``(size, segment_size)`` when ``info_dict`` can be split, else None."""
+        headers = info_dict.get("http_headers") or {}
+        if (
+            self.params.get("test")
+            or info_dict.get("protocol") not in SEGMENTED_PROTOCOLS
+            or info_dict.get("request_data")
+            or any(k.lower() == "range" for k in headers)
+            or os.path.isfile(self.temp_name(filename))  # let HttpFD resume it
+        ):
+            return None
+        size = info_dict.get("filesize")
+        if not size or size < conf["MIN_SIZE"]:
+            return None
+        segment_size = conf["SEGMENT_SIZE"]
+        # Some sites (YouTube) throttle or refuse ranges above their chunk size
+        chunk_size = (info_dict.get("downloader_options") or {}).get("http_chunk_size")
+        if chunk_size:
+            segment_size = min(segment_size, chunk_size)
+        return size, segment_size
+
+    def _download_segments(self, filename, info_dict, size, segment_size, connections, conf):
+        tmpfilename = self.temp_name(filename)
+        headers = HTTPHeaderDict({"Accept-Encoding": "identity"}, info_dict.get("http_headers"))
+        segments = deque((start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size))
+        lock = threading.Lock()
+        stop = threading.Event()
+        errors = []
+        progress = {"downloaded": 0}
+
+        def on_bytes(count):
+            with lock:
+                progress["downloaded"] += count
+
+        def work():
+            try:
+                with open(tmpfilename, "r+b") as out:
+                    while not stop.is_set():
+                        with lock:
+                            if not segments:
+                                return
+                            start, end = segments.popleft()
+                        self._fetch_segment(info_dict["url"], headers, start, end, size, out, on_bytes, stop, conf)
+            except BaseException as e:
+                with lock:
+                    errors.append(e)
+                stop.set()
+
+        self.report_destination(filename)
+        with open(tmpfilename, "wb") as f:
+            preallocate(f.fileno(), size)
+
+        start_time = time.time()
+        threads = [
+            threading.Thread(target=work, daemon=True, name=f"segment-{i}") for i in range(min(connections, len(segments)))
+        ]
+        try:
+            for thread in threads:
+                thread.start()
+            while True:
+                alive = [thread for thread in threads if thread.is_alive()]
+                if not alive:
+                    break
+                alive[0].join(0.5)
+                downloaded = progress["downloaded"]
+                elapsed = time.time() - start_time
+                speed = self.calc_speed(start_time, time.time(), downloaded)
+                self._hook_progress({
+                    "status": "downloading",
+                    "downloaded_bytes": downloaded,
+                    "total_bytes": size,
+                    "tmpfilename": tmpfilename,
+                    "filename": filename,
+                    "eta": self.calc_eta(speed, size - downloaded),
+                    "speed": speed,
+                    "elapsed": elapsed,
+                }, info_dict)
+        except BaseException:
+            # A progress hook (e.g. the workspace quota) or an interrupt aborts every segment
+            stop.set()
+            for thread in threads:
+                thread.join()
+            self._remove(tmpfilename)
+            raise
+
+        if errors:
+            self._remove(tmpfilename)
+            if any(isinstance(e, RangesUnsupported) for e in errors):
+                raise RangesUnsupported()
+            self.report_error(f"Segmented download failed: {errors[0]}")
+            return False
+
+        self.try_rename(tmpfilename, filename)
+        self._hook_progress({
+            "downloaded_bytes": size,
+            "total_bytes": size,
+            "filename": filename,
+            "status": "finished",
+            "elapsed": time.time() - start_time,
+        }, info_dict)
+        return True
+
+    def _fetch_segment(self, url, headers, start, end, size, out, on_bytes, stop, conf):
+        """Write bytes ``start..end`` of ``url`` into ``out``, resuming the segment on failure."""
+        offset = start
+        attempt = 0
+        while True:
+            try:
+                response = self.ydl.urlopen(Request(url, headers={**headers, "Range": f"bytes={offset}-{end}"}))
+                try:
+                    match = CONTENT_RANGE_RE.match(response.headers.get("Content-Range") or "")
+                    if response.status != 206 or not match or int(match.group(1)) != offset or int(match.group(3)) != size:
+                        raise RangesUnsupported()
+                    while offset <= end:
+                        if stop.is_set():
+                            return
+                        block = response.read(min(conf["BLOCK_SIZE"], end - offset + 1))
+                        if not block:
+                            raise TransportError(f"connection closed {end - offset + 1} bytes short of the segment end")
+                        out.seek(offset)
+                        out.write(block)
+                        offset += len(block)
+                        on_bytes(len(block))
+                    return
+                finally:
+                    response.close()
+            except (TransportError, HTTPError) as e:
+                if isinstance(e, HTTPError) and e.status not in RETRY_STATUSES:
+                    raise
+                attempt += 1
+                if attempt > conf["SEGMENT_RETRIES"] or stop.is_set():
+                    raise
+                SEGMENT_RETRIES.inc()
+                time.sleep(min(0.5 * 2 ** (attempt - 1), 8))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class SegmentedYoutubeDL(yt_dlp.YoutubeDL):
+    """
+    ``YoutubeDL`` that downloads plain HTTP formats with ``SegmentedHttpFD``
+    and runs DASH/HLS fragment downloads on several connections, both
+    within the process-wide connection budget.
+    """
+
+    def dl(self, name, info, subtitle=False, test=False):
+        conf = segmented_settings()
+        if test or subtitle or name == "-" or not info.get("url") or not conf["ENABLED"]:
+            return super().dl(name, info, subtitle, test)
+        fd_class = get_suitable_downloader(info, self.params)
+        if fd_class is not HttpFD and not issubclass(fd_class, FragmentFD):
+            return super().dl(name, info, subtitle, test)
+
+        params, granted = self.params, 0
+        if fd_class is HttpFD:
+            fd_class = SegmentedHttpFD
+        else:
+            granted = connection_budget.acquire(conf["CONNECTIONS_PER_FILE"])
+            params = dict(self.params, concurrent_fragment_downloads=max(granted, 1))
+        # Mirrors YoutubeDL.dl, which has no hook for choosing the downloader
+        try:
+            fd = fd_class(self, params)
+            for hook in self._progress_hooks:
+                fd.add_progress_hook(hook)
+            new_info = self._copy_infodict(info)
+            if new_info.get("http_headers") is None:
+                new_info["http_headers"] = self._calc_headers(new_info)
+            return fd.download(name, new_info, subtitle)
+        finally:
+            connection_budget.release(granted)
+
+
+def build_connection_budget():
+    return ConnectionBudget(segmented_settings()["MAX_CONNECTIONS"])
+
+
+connection_budget = build_connection_budget()
+
+Gauge(
+    "fetchmate_download_connections", "Connections held by segmented and fragment downloads.",
+    collect=lambda: {(): connection_budget.in_use},
+)
@@ -0,0 +1,13 @@
+from rest_framework import serializers
+from .models import DownloadJob
+
+
+class DownloadJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DownloadJob
+        fields = [
+            "id", "url", "convert_mp3", "audio_codec", "audio_quality", "status", "progress",
+            "downloaded_bytes", "total_bytes", "items_done", "items_total",
+            "error", "result_name", "created_at", "started_at", "finished_at",
+        ]
+        read_only_fields = fields
@@ -0,0 +1,115 @@
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.refs = 0
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one execution.
+
+    The first caller for a key runs ``fn``; callers arriving while it is
+    in flight block and receive the same result (or exception).
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def call(self, key, fn):
+        with self.do(key, fn) as result:
+            return result
+
+    @contextmanager
+    def do(self, key, fn, cleanup=None):
+        """
+        Context-manager form for results that own resources (e.g. a work dir).
+
+        ``cleanup(result)`` runs once, when the last caller sharing the
+        result leaves the ``with`` block.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            call.refs += 1
+
+        try:
+            if leader:
+                try:
+                    call.result = fn()
+                except BaseException as e:
+                    call.error = e
+                finally:
+                    with self._lock:
+                        self._calls.pop(key, None)
+                    call.done.set()
+            else:
+                call.done.wait()
+
+            if call.error is not None:
+                raise call.error
+            yield call.result
+        finally:
+            with self._lock:
+                call.refs -= 1
+                last = call.refs == 0
+            if last and cleanup and call.error is None:
+                cleanup(call.result)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+def shared_call(key, fn):
+    """
+    Cross-worker single flight through the Django cache.
+
+    The worker that wins ``cache.add`` on the lock key runs ``fn`` and
+    publishes the result for a short handoff window; the others poll for
+    it. If the leader dies the lock expires and a waiter takes over.
+    Only effective when DOWNLOADER_SINGLEFLIGHT points at a cache shared
+    by all workers; results must be picklable.
+    """
+    conf = getattr(settings, "DOWNLOADER_SINGLEFLIGHT", {})
+    alias = conf.get("CACHE_ALIAS")
+    if not alias:
+        return fn()
+
+    cache = caches[alias]
+    lock_key, result_key = f"{key}:lock", f"{key}:result"
+    lock_timeout = conf.get("LOCK_TIMEOUT", 120)
+    poll = conf.get("POLL_INTERVAL", 0.2)
+    deadline = time.monotonic() + lock_timeout
+
+    while True:
+        result = cache.get(result_key)
+        if result is not None:
+            return result
+
+        token = uuid.uuid4().hex
+        if cache.add(lock_key, token, timeout=lock_timeout):
+            try:
+                result = fn()
+                cache.set(result_key, result, timeout=conf.get("RESULT_TTL", 30))
+                return result
+            finally:
+                if cache.get(lock_key) == token:
+                    cache.delete(lock_key)
+
+        if time.monotonic() >= deadline:
+            return fn()
+        time.sleep(poll)
@@ -1,3 +1,1880 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import date, datetime, time as dt_time, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock, skipUnless
+from urllib.parse import urlsplit
+from uuid import UUID
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils.translation import gettext_lazy
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from yt_dlp.downloader.http import HttpFD
+
+from . import apps, async_views, jobs, metrics
+from .artifacts import ArtifactStore, artifact_key
+from .admission import FairScheduler, RateLimited, RateLimiter, TokenBucket
+from .cache import LRUBackend, MetadataCache, canonicalize_url, earliest_url_expiry
+from .delivery import parse_range, serve_file
+from .formats import format_preferences, rank_formats, score
+from .hosts import HostScheduler, HostUnavailable, classify
+from .lazy import NotLoaded, download_error
+from .metrics import host_label
+from .middleware import CompressionMiddleware, brotli
+from .models import Artifact, DownloadJob
+from .payloads import metadata_payload, payload_options
+from .playlist import PlaylistPipeline
+from .proxy import ConnectionPool, UpstreamError, open_upstream, public_addresses
+from .renderers import ORJSONRenderer, dumps
+from .segmented import ConnectionBudget, SegmentedHttpFD, segmented_settings
+from .singleflight import SingleFlight, shared_call
+from .thumbnails import Image, ThumbnailCache, ThumbnailError
+from .transcode import PRIORITY_PLAYLIST, PRIORITY_SINGLE, TranscodePool, audio_target, transcode
+from .workspace import LEASE_FILE, QuotaExceeded, StorageUnavailable, WorkspaceManager
+from .ydl_pool import YDLPool
+
+
+class CanonicalizeUrlTests(SimpleTestCase):
+    def test_sorts_params_and_drops_tracking(self):
+        self.assertEqual(
+            canonicalize_url("https://www.example.com/a/?b=2&utm_source=x&a=1&fbclid=y"),
+            "https://example.com/a?a=1&b=2",
+        )
+
+    def test_youtu_be_becomes_watch_url(self):
+        self.assertEqual(
+            canonicalize_url("https://youtu.be/dQw4w9WgXcQ?si=abc&t=42"),
+            "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+        )
+
+    def test_music_and_mobile_hosts_share_the_watch_url(self):
+        expected = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+        for url in (
+            "https://music.youtube.com/watch?v=dQw4w9WgXcQ&feature=share",
+            "m.youtube.com/watch?v=dQw4w9WgXcQ",
+            "https://www.youtube.com/shorts/dQw4w9WgXcQ",
+        ):
+            self.assertEqual(canonicalize_url(url), expected, url)
+
+    def test_keeps_non_default_port(self):
+        self.assertEqual(canonicalize_url("http://127.0.0.1:8000/watch/x"), "https://127.0.0.1:8000/watch/x")
+
+
+class MetadataCacheTtlTests(SimpleTestCase):
+    def info(self, *expires):
+        return {
+            "extractor_key": "Youtube",
+            "formats": [{"url": f"https://cdn.example/v?expire={ts}&sig=x"} for ts in expires],
+        }
+
+    def test_earliest_expire_wins(self):
+        self.assertEqual(earliest_url_expiry(self.info(2000000000, 1900000000)), 1900000000)
+
+    def test_ttl_capped_by_expire_minus_margin(self):
+        cache = MetadataCache(LRUBackend(), ttls={"youtube": 3600}, expiry_margin=300)
+        with mock.patch("downloader.cache.time.time", return_value=1900000000 - 1000):
+            self.assertEqual(cache.ttl_for(self.info(1900000000)), 700)
+
+    def test_already_expiring_urls_are_not_cached(self):
+        cache = MetadataCache(LRUBackend(), ttls={"default": 600}, expiry_margin=300)
+        info = self.info(int(time.time()) + 60)
+        self.assertEqual(cache.ttl_for(info), 0)
+        cache.set("https://example.com/v", info)
+        self.assertIsNone(cache.get("https://example.com/v"))
+
+    def test_extractor_ttl_without_expire(self):
+        cache = MetadataCache(LRUBackend(), ttls={"default": 600, "soundcloud": 60})
+        self.assertEqual(cache.ttl_for({"extractor_key": "Soundcloud"}), 60)
+        self.assertEqual(cache.ttl_for({"extractor": "vimeo"}), 600)
+
+
+class LRUBackendTests(SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        evicted = []
+        lru = LRUBackend(max_entries=2, on_evict=evicted.append)
+        lru.set("a", 1, 60)
+        lru.set("b", 2, 60)
+        lru.get("a")
+        lru.set("c", 3, 60)
+        self.assertEqual((lru.get("a"), lru.get("b"), lru.get("c")), (1, None, 3))
+        self.assertEqual(evicted, [1])
+
+    def test_expired_entries_are_dropped(self):
+        lru = LRUBackend()
+        with mock.patch("downloader.cache.time.monotonic", return_value=100.0):
+            lru.set("a", 1, 10)
+        with mock.patch("downloader.cache.time.monotonic", return_value=111.0):
+            self.assertIsNone(lru.get("a"))
+
+    def test_get_returns_a_copy(self):
+        lru = LRUBackend()
+        lru.set("a", {"formats": [{"id": 1}]}, 60)
+        lru.get("a")["formats"].append({"id": 2})
+        self.assertEqual(lru.get("a"), {"formats": [{"id": 1}]})
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        self.release = threading.Event()
+
+    def run_concurrently(self, flight, fn, callers=4, cleanup=None):
+        """Start ``callers`` threads on one key and release ``fn`` once all of them wait on it."""
+        outcomes = []
+
+        def caller():
+            try:
+                with flight.do("key", fn, cleanup) as result:
+                    outcomes.append(result)
+            except Exception as e:
+                outcomes.append(e)
+
+        threads = [threading.Thread(target=caller) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            with flight._lock:
+                call = flight._calls.get("key")
+                if call and call.refs == callers:
+                    break
+            time.sleep(0.005)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        return outcomes
+
+    def test_concurrent_callers_share_one_call(self):
+        flight, calls, cleaned = SingleFlight(), [], []
+
+        def fn():
+            calls.append(1)
+            self.release.wait(5)
+            return "result"
+
+        outcomes = self.run_concurrently(flight, fn, cleanup=cleaned.append)
+        self.assertEqual(outcomes, ["result"] * 4)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cleaned, ["result"])
+        self.assertEqual(flight.in_flight(), 0)
+
+    def test_error_reaches_every_waiter(self):
+        flight, cleaned = SingleFlight(), []
+
+        def fn():
+            self.release.wait(5)
+            raise ValueError("boom")
+
+        outcomes = self.run_concurrently(flight, fn, cleanup=cleaned.append)
+        self.assertEqual(len(outcomes), 4)
+        self.assertTrue(all(isinstance(e, ValueError) for e in outcomes))
+        self.assertEqual(cleaned, [])
+        self.assertEqual(flight.in_flight(), 0)
+
+    def test_next_call_runs_again(self):
+        flight = SingleFlight()
+        self.assertEqual(flight.call("key", lambda: 1), 1)
+        self.assertEqual(flight.call("key", lambda: 2), 2)
+
+
+@override_settings(DOWNLOADER_SINGLEFLIGHT={
+    "CACHE_ALIAS": "default", "LOCK_TIMEOUT": 0.3, "RESULT_TTL": 30, "POLL_INTERVAL": 0.02,
+})
+class SharedCallTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_leader_publishes_result(self):
+        self.assertEqual(shared_call("k", lambda: {"title": "a"}), {"title": "a"})
+        self.assertEqual(shared_call("k", lambda: self.fail("should reuse the result")), {"title": "a"})
+        self.assertIsNone(cache.get("k:lock"))
+
+    def test_waiter_picks_up_leaders_result(self):
+        cache.add("k:lock", "other-worker", 5)
+        threading.Timer(0.05, lambda: cache.set("k:result", "shared", 30)).start()
+        self.assertEqual(shared_call("k", lambda: "own"), "shared")
+
+    def test_waiter_falls_back_after_lock_timeout(self):
+        cache.add("k:lock", "stuck-worker", 60)  # leader never finishes nor releases
+        started = time.monotonic()
+        self.assertEqual(shared_call("k", lambda: "own"), "own")
+        self.assertGreaterEqual(time.monotonic() - started, 0.3)
+
+    @override_settings(DOWNLOADER_SINGLEFLIGHT={})
+    def test_disabled_without_cache_alias(self):
+        calls = []
+        shared_call("k", lambda: calls.append(1))
+        shared_call("k", lambda: calls.append(1))
+        self.assertEqual(len(calls), 2)
+
+
+class JobLeaseTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(username="jobs", email="jobs@example.com", password="x")
+        self.job = jobs.enqueue(user, "https://example.com/v")
+        self.job = jobs.claim_next("worker-a")
+
+    def take_over(self):
+        """What requeue_stale_jobs and a second worker's claim_next do to a silent job."""
+        DownloadJob.objects.filter(pk=self.job.pk).update(status=DownloadJob.STATUS_QUEUED, worker="")
+        return jobs.claim_next("worker-b")
+
+    def test_final_update_applies_while_held(self):
+        with tempfile.TemporaryDirectory() as result_dir:
+            self.assertTrue(jobs.finish_job(self.job, result_dir, status=DownloadJob.STATUS_FINISHED, progress=100))
+            self.assertTrue(os.path.isdir(result_dir))
+        self.assertEqual(DownloadJob.objects.get(pk=self.job.pk).status, DownloadJob.STATUS_FINISHED)
+
+    def test_final_update_after_takeover_is_dropped(self):
+        self.take_over()
+        with tempfile.TemporaryDirectory() as root:
+            result_dir = os.path.join(root, "run")
+            os.makedirs(result_dir)
+            self.assertFalse(jobs.fail_job(self.job, result_dir, "boom"))
+            self.assertFalse(os.path.exists(result_dir))
+        row = DownloadJob.objects.get(pk=self.job.pk)
+        self.assertEqual((row.status, row.worker, row.error), (DownloadJob.STATUS_RUNNING, "worker-b", ""))
+
+    def test_progress_after_takeover_aborts_the_download(self):
+        reporter = jobs.ProgressReporter(self.job, interval=0)
+        reporter({"status": "downloading", "downloaded_bytes": 1, "total_bytes": 10})
+        self.take_over()
+        with self.assertRaises(jobs.LeaseLost):
+            reporter({"status": "downloading", "downloaded_bytes": 2, "total_bytes": 10})
+        self.assertEqual(DownloadJob.objects.get(pk=self.job.pk).downloaded_bytes, 1)
+
+
+class CreateJobTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="flags", email="flags@example.com", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        patcher = mock.patch("downloader.views.admit")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def convert_mp3_for(self, data, format="multipart"):
+        response = self.client.post("/api/downloader/jobs/", {"url": "https://example.com/v", **data}, format=format)
+        self.assertEqual(response.status_code, 202)
+        return DownloadJob.objects.get(pk=response.data["job_id"]).convert_mp3
+
+    def test_string_flags_from_form_data(self):
+        self.assertFalse(self.convert_mp3_for({"convert_mp3": "false"}))
+        self.assertFalse(self.convert_mp3_for({"convert_mp3": "0"}))
+        self.assertTrue(self.convert_mp3_for({"convert_mp3": "true"}))
+        self.assertTrue(self.convert_mp3_for({}))
+
+    def test_json_booleans(self):
+        self.assertFalse(self.convert_mp3_for({"convert_mp3": False}, format="json"))
+
+
+class FakePipeline(PlaylistPipeline):
+    """Pipeline whose downloads are instant and whose transcodes wait for ``gate`` after the first."""
+
+    def __init__(self, entries, **kwargs):
+        super().__init__(entries, "/nonexistent", convert_mp3=True, **kwargs)
+        self.gate = threading.Event()
+        self.downloaded = []
+
+    def cached(self, index, entry):
+        return None
+
+    def download(self, index, entry):
+        self.downloaded.append(index)
+        return {"filepath": f"/tmp/{index}"}
+
+    def transcode(self, download):
+        if download["filepath"] != "/tmp/1":
+            self.gate.wait(5)
+        return download["filepath"]
+
+    def publish(self, entry, path):
+        pass
+
+
+class PlaylistPipelineCloseTests(SimpleTestCase):
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_closing_releases_slots_of_cancelled_transcodes(self):
+        pool = TranscodePool(1)
+        pipeline = FakePipeline([{"id": str(i)} for i in range(1, 7)], download_workers=3, max_pending=2)
+        with mock.patch("downloader.playlist.transcode_pool", pool):
+            results = iter(pipeline)
+            self.assertEqual(next(results).path, "/tmp/1")
+            # One track is converting, one waits for the pool, the rest for a backlog slot
+            self.wait_for(lambda: pool.queued() == 1)
+            results.close()
+            pipeline.gate.set()
+            self.wait_for(lambda: not any(t.name.startswith("playlist-dl") for t in threading.enumerate()))
+        # Only the tracks that got a backlog slot before the close were downloaded
+        self.assertEqual(len(pipeline.downloaded), 3)
+
+    def test_idle_only_after_running_tracks_drain(self):
+        pool = TranscodePool(1)
+        pipeline = FakePipeline([{"id": str(i)} for i in range(1, 7)], download_workers=3, max_pending=2)
+        idle = threading.Event()
+        with mock.patch("downloader.playlist.transcode_pool", pool):
+            results = iter(pipeline)
+            next(results)
+            self.wait_for(lambda: pool.queued() == 1)
+            results.close()
+            pipeline.when_idle(idle.set)
+            self.assertFalse(idle.wait(0.1), "a transcode is still writing into the work dir")
+            pipeline.gate.set()
+            self.assertTrue(idle.wait(5))
+
+    def test_idle_right_away_when_everything_finished(self):
+        pipeline = FakePipeline([{"id": "1"}], download_workers=1, max_pending=1)
+        with mock.patch("downloader.playlist.transcode_pool", TranscodePool(1)):
+            self.assertEqual([r.path for r in pipeline], ["/tmp/1"])
+        called = []
+        pipeline.when_idle(lambda: called.append(1))
+        self.assertEqual(called, [1])
+
+
+class ParseRangeTests(SimpleTestCase):
+    def test_ranges(self):
+        cases = {
+            "bytes=0-99": (0, 99),
+            "bytes=100-": (100, 999),
+            "bytes=-100": (900, 999),
+            "bytes=-5000": (0, 999),
+            "bytes=900-5000": (900, 999),
+        }
+        for header, expected in cases.items():
+            self.assertEqual(parse_range(header, 1000), expected, header)
+
+    def test_ignored(self):
+        for header in ("bytes=0-1,5-9", "items=0-1", "bytes=-", "bytes=a-b"):
+            self.assertIsNone(parse_range(header, 1000), header)
+
+    def test_unsatisfiable(self):
+        for header in ("bytes=1000-", "bytes=5-4", "bytes=-0"):
+            self.assertIs(parse_range(header, 1000), False, header)
+
+
+class ServeFileTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "track.mp3")
+        with open(self.path, "wb") as f:
+            f.write(bytes(range(256)) * 4)
+        self.closed = []
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def serve(self, persistent=False, **headers):
+        request = self.factory.get("/file", headers=headers)
+        response = serve_file(request, self.path, "track.mp3", lambda: self.closed.append(1), persistent)
+        body = b"".join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, body
+
+    def test_accel_locations_follow_configured_roots(self):
+        self.assertEqual(
+            set(settings.DOWNLOADER_DELIVERY["ACCEL_LOCATIONS"]),
+            {settings.DOWNLOADER_ARTIFACTS["ROOT"], settings.DOWNLOADER_JOBS["ROOT"]},
+        )
+
+    def test_full_file(self):
+        response, body = self.serve()
+        self.assertEqual((response.status_code, len(body), response["Accept-Ranges"]), (200, 1024, "bytes"))
+        self.assertEqual(self.closed, [1])
+
+    def test_suffix_range(self):
+        response, body = self.serve(Range="bytes=-24")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 1000-1023/1024")
+        self.assertEqual(response["Content-Length"], "24")
+        self.assertEqual(body, (bytes(range(256)) * 4)[1000:])
+
+    def test_open_ended_range(self):
+        response, body = self.serve(Range="bytes=1020-")
+        self.assertEqual((response.status_code, response["Content-Range"]), (206, "bytes 1020-1023/1024"))
+        self.assertEqual(body, bytes(range(252, 256)))
+
+    def test_multi_range_sends_whole_file(self):
+        response, body = self.serve(Range="bytes=0-1,4-5")
+        self.assertEqual((response.status_code, len(body)), (200, 1024))
+
+    def test_unsatisfiable_range(self):
+        response, _ = self.serve(Range="bytes=2048-")
+        self.assertEqual((response.status_code, response["Content-Range"]), (416, "bytes */1024"))
+        self.assertEqual(self.closed, [1])
+
+    def test_if_range(self):
+        etag = self.serve()[0]["ETag"]
+        response, _ = self.serve(Range="bytes=0-9", **{"If-Range": etag})
+        self.assertEqual(response.status_code, 206)
+        response, body = self.serve(Range="bytes=0-9", **{"If-Range": '"stale"'})
+        self.assertEqual((response.status_code, len(body)), (200, 1024))
+
+    def test_x_sendfile(self):
+        with self.settings(DOWNLOADER_DELIVERY={"OFFLOAD": "x-sendfile"}):
+            response, body = self.serve(persistent=True)
+        self.assertEqual((response["X-Sendfile"], body), (self.path, b""))
+        self.assertIn("track.mp3", response["Content-Disposition"])
+        self.assertEqual(self.closed, [1])
+
+    def test_x_accel_redirect(self):
+        conf = {"OFFLOAD": "x-accel", "ACCEL_LOCATIONS": {self.dir.name: "/_protected/files/"}}
+        with self.settings(DOWNLOADER_DELIVERY=conf):
+            response, _ = self.serve(persistent=True)
+            self.assertEqual(response["X-Accel-Redirect"], "/_protected/files/track.mp3")
+            # Only persistent files are offloaded
+            response, body = self.serve()
+            self.assertFalse(response.has_header("X-Accel-Redirect"))
+            self.assertEqual(len(body), 1024)
+
+    def test_x_accel_outside_locations_is_served_directly(self):
+        with self.settings(DOWNLOADER_DELIVERY={"OFFLOAD": "x-accel", "ACCEL_LOCATIONS": {"/elsewhere": "/x/"}}):
+            response, body = self.serve(persistent=True)
+        self.assertFalse(response.has_header("X-Accel-Redirect"))
+        self.assertEqual(len(body), 1024)
+
+
+def fmt(format_id, ext, vcodec="none", acodec="mp4a.40.2", height=None, tbr=128, abr=None, filesize=None):
+    return {
+        "format_id": format_id, "ext": ext, "vcodec": vcodec, "acodec": acodec,
+        "height": height, "tbr": tbr, "abr": abr, "filesize": filesize,
+    }
+
+
+class FormatPreferencesTests(SimpleTestCase):
+    def test_max_resolution(self):
+        for value, expected in ((720, 720), ("720", 720), ("720p", 720), (" 1080P ", 1080), ("hd", None), (None, None)):
+            self.assertEqual(format_preferences({"max_resolution": value})["max_height"], expected, value)
+
+    def test_prefer_smaller_strings(self):
+        for value, expected in (("false", False), ("0", False), ("", False), ("true", True), ("1", True), (True, True)):
+            self.assertIs(format_preferences({"prefer_smaller": value})["prefer_smaller"], expected, value)
+
+
+class RankFormatsTests(SimpleTestCase):
+    formats = [
+        fmt("worst", "mp4", vcodec="avc1", height=360, tbr=500, filesize=5000),
+        fmt("webm720", "webm", vcodec="vp9", acodec="opus", height=720, tbr=1200, filesize=9000),
+        fmt("mp4720", "mp4", vcodec="avc1", height=720, tbr=1500, filesize=12000),
+        fmt("mp4720small", "mp4", vcodec="avc1", height=720, tbr=900, filesize=7000),
+        fmt("1080", "mp4", vcodec="avc1", height=1080, tbr=4000, filesize=30000),
+        fmt("videoonly", "mp4", vcodec="avc1", acodec="none", height=2160, tbr=9000),
+        fmt("m4a", "m4a", abr=128),
+        fmt("opus", "webm", acodec="opus", abr=130),
+        fmt("m4a-low", "m4a", abr=48),
+    ]
+
+    def ids(self, ranked, category):
+        return [f["format_id"] for f in ranked[category]]
+
+    def test_higher_resolution_then_container_first(self):
+        ranked = rank_formats(self.formats)
+        # Video-only formats are not offered; one mp4 per resolution survives dedupe
+        self.assertEqual(self.ids(ranked, "video"), ["1080", "mp4720", "webm720", "worst"])
+        self.assertEqual(self.ids(ranked, "audio"), ["m4a", "opus"])
+
+    def test_max_height_and_prefer_smaller(self):
+        ranked = rank_formats(self.formats, max_height=720, prefer_smaller=True)
+        self.assertEqual(self.ids(ranked, "video"), ["mp4720small", "webm720", "worst"])
+
+    def test_limits(self):
+        self.assertEqual(self.ids(rank_formats(self.formats, limits={"video": 1}), "video"), ["1080"])
+
+    def test_score_prefers_efficient_codec_within_tier(self):
+        av1 = fmt("av1", "mp4", vcodec="av01.0.08M.08", height=720, tbr=1000)
+        avc = fmt("avc", "mp4", vcodec="avc1.64001F", height=720, tbr=1000)
+        self.assertGreater(score(av1, "video"), score(avc, "video"))
+
+
+class HostLabelTests(SimpleTestCase):
+    def test_known_hosts_and_subdomains(self):
+        self.assertEqual(host_label("www.youtube.com"), "youtube.com")
+        self.assertEqual(host_label("artist.bandcamp.com"), "bandcamp.com")
+        self.assertEqual(host_label("soundcloud.com"), "soundcloud.com")
+
+    def test_everything_else_is_other(self):
+        for host in ("127.0.0.1", "evil-youtube.com", "youtube.com.example.net", "a1b2c3.example"):
+            self.assertEqual(host_label(host), "other", host)
+        self.assertEqual(host_label(""), "")
+
+    @override_settings(DOWNLOADER_METRICS={"HOSTS": ("example.com",)})
+    def test_configurable(self):
+        self.assertEqual((host_label("cdn.example.com"), host_label("www.youtube.com")), ("example.com", "other"))
+
+
+class TempDiskMetricTests(TestCase):
+    def setUp(self):
+        metrics._disk_totals.update(at=None, value=None)
+        self.addCleanup(metrics._disk_totals.update, at=None, value=None)
+
+    def test_scrapes_within_ttl_share_one_walk(self):
+        with mock.patch("downloader.metrics.time.monotonic", return_value=100.0) as now, \
+                mock.patch("downloader.metrics.dir_size", return_value=7) as dir_size:
+            first = metrics._temp_disk()
+            walks = dir_size.call_count
+            now.return_value = 129.0
+            self.assertEqual(metrics._temp_disk(), first)
+            self.assertEqual(dir_size.call_count, walks)
+            now.return_value = 130.0
+            metrics._temp_disk()
+            self.assertEqual(dir_size.call_count, 2 * walks)
+        self.assertEqual((first[("jobs",)], first[("artifacts",)]), (7, 0))
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_refills_at_rate_up_to_capacity(self):
+        with mock.patch("downloader.admission.time.monotonic", return_value=100.0):
+            bucket = TokenBucket(per_minute=60, burst=2)
+        for _ in range(2):
+            self.assertEqual(bucket.wait_time(1, 100.0), 0)
+            bucket.take(1)
+        self.assertEqual(bucket.wait_time(1, 100.0), 1.0)
+        self.assertEqual(bucket.wait_time(1, 100.5), 0.5)
+        self.assertEqual(bucket.wait_time(1, 101.0), 0)
+        self.assertEqual(bucket.wait_time(2, 200.0), 0)
+        self.assertEqual(bucket.tokens, 2)
+
+    def test_cost_above_burst_waits_for_a_full_bucket(self):
+        bucket = TokenBucket(per_minute=60, burst=2)
+        now = bucket.updated
+        self.assertEqual(bucket.wait_time(5, now), 0)
+        bucket.take(5)
+        self.assertEqual(bucket.wait_time(5, now), 2.0)
+
+
+class RateLimiterTests(SimpleTestCase):
+    def user(self, pk):
+        return mock.Mock(pk=pk, role="user")
+
+    def test_rejects_with_retry_after(self):
+        limiter = RateLimiter({"user": {"download": (6, 1)}}, {})
+        limiter.check(self.user(1), "download")
+        with self.assertRaises(RateLimited) as raised:
+            limiter.check(self.user(1), "download")
+        self.assertEqual((raised.exception.reason, raised.exception.retry_after), ("user_rate", 10))
+        limiter.check(self.user(2), "download")
+
+    def test_refilled_buckets_are_evicted(self):
+        clock = mock.patch("downloader.admission.time.monotonic", return_value=100.0)
+        with clock as now:
+            limiter = RateLimiter({"user": {"metadata": (60, 5)}}, {}, sweep_interval=60)
+            for pk in range(50):
+                limiter.check(self.user(pk), "metadata")
+            self.assertEqual(len(limiter._buckets), 50)
+            now.return_value = 161.0
+            limiter.check(self.user(0), "metadata")
+        self.assertEqual(list(limiter._buckets), [("user", 0, "metadata")])
+
+
+class FairSchedulerTests(SimpleTestCase):
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.005)
+        self.assertTrue(condition())
+
+    def test_waiting_users_are_served_round_robin(self):
+        scheduler = FairScheduler(slots=1, max_waiting=4, max_waiting_per_user=2, timeout=5)
+        release = scheduler.acquire("holder")
+        served = []
+
+        def caller(user):
+            done = scheduler.acquire(user)
+            served.append(user)
+            done()
+
+        threads = []
+        for user in ("a", "a", "b"):
+            threads.append(threading.Thread(target=caller, args=(user,)))
+            threads[-1].start()
+            self.wait_for(lambda: scheduler.waiting == len(threads))
+        release()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(served, ["a", "b", "a"])
+        self.assertEqual((scheduler.in_use, scheduler.waiting), (0, 0))
+
+    def test_per_user_queue_limit(self):
+        scheduler = FairScheduler(slots=1, max_waiting=4, max_waiting_per_user=1, timeout=5)
+        release = scheduler.acquire("holder")
+        waiter = threading.Thread(target=lambda: scheduler.acquire("a")())
+        waiter.start()
+        self.wait_for(lambda: scheduler.waiting == 1)
+        with self.assertRaises(RateLimited) as raised:
+            scheduler.acquire("a")
+        self.assertEqual(raised.exception.reason, "queue_full")
+        release()
+        waiter.join(5)
+
+    def test_zero_timeout_rejects_without_waiting(self):
+        scheduler = FairScheduler(slots=1, max_waiting=4, max_waiting_per_user=2, timeout=0)
+        release = scheduler.acquire("a")
+        with self.assertRaises(RateLimited):
+            scheduler.acquire("b")
+        self.assertEqual(scheduler.waiting, 0)
+        release()
+        release()
+        scheduler.acquire("b")()
+
+    def test_queue_timeout(self):
+        scheduler = FairScheduler(slots=1, max_waiting=4, max_waiting_per_user=2, timeout=0.05)
+        release = scheduler.acquire("a")
+        with self.assertRaises(RateLimited) as raised:
+            scheduler.acquire("b")
+        self.assertEqual((raised.exception.reason, scheduler.waiting), ("queue_timeout", 0))
+        release()
+
+
+def addrinfo(*ips):
+    return [(0, 0, 0, "", (ip, 443)) for ip in ips]
+
+
+class PublicAddressTests(SimpleTestCase):
+    def test_non_public_addresses_are_refused(self):
+        for ip in ("127.0.0.1", "10.1.2.3", "192.168.0.10", "169.254.169.254", "100.64.0.1", "::1",
+                   "fe80::1", "::ffff:127.0.0.1", "0.0.0.0"):
+            with mock.patch("downloader.proxy.socket.getaddrinfo", return_value=addrinfo(ip)):
+                with self.assertRaises(UpstreamError, msg=ip) as raised:
+                    public_addresses("cdn.example", 443)
+            self.assertEqual(raised.exception.status, 403)
+
+    def test_any_private_answer_refuses_the_host(self):
+        with mock.patch("downloader.proxy.socket.getaddrinfo", return_value=addrinfo("93.184.216.34", "10.0.0.1")):
+            with self.assertRaises(UpstreamError):
+                public_addresses("cdn.example", 443)
+
+    def test_public_addresses_pass(self):
+        with mock.patch("downloader.proxy.socket.getaddrinfo", return_value=addrinfo("93.184.216.34", "2606:2800::1")):
+            self.assertEqual(public_addresses("cdn.example", 443), ["93.184.216.34", "2606:2800::1"])
+
+    def test_pool_refuses_loopback_before_connecting(self):
+        with mock.patch("downloader.proxy.socket.create_connection") as connect:
+            with self.assertRaises(UpstreamError) as raised:
+                open_upstream("http://127.0.0.1:9/media", {}, pool=ConnectionPool())
+        self.assertEqual(raised.exception.status, 403)
+        connect.assert_not_called()
+
+
+class FakeResponse:
+    will_close = True
+
+    def __init__(self, status, location=None):
+        self.status = status
+        self.location = location
+
+    def getheader(self, name):
+        return self.location if name == "Location" else None
+
+    def read1(self, size):
+        return b""
+
+    def close(self):
+        pass
+
+
+class RecordingPool:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.sent = []
+
+    def request(self, key, path, headers):
+        self.sent.append((key[1], headers))
+        return self.responses.pop(0), mock.Mock()
+
+
+class RedirectCookieTests(SimpleTestCase):
+    def cookie_for(self, url):
+        return f"session={urlsplit(url).hostname}"
+
+    def follow(self, *responses):
+        pool = RecordingPool(*responses, FakeResponse(200))
+        headers = {"User-Agent": "ua", "Cookie": "stale=1"}
+        with mock.patch("downloader.proxy.ydl_pool.cookie_header", side_effect=self.cookie_for):
+            open_upstream("https://media.example/v", headers, pool=pool, cookies=True)
+        return [(host, headers.get("Cookie"), headers["User-Agent"]) for host, headers in pool.sent]
+
+    def test_same_host_redirect_recomputes_cookie(self):
+        self.assertEqual(self.follow(FakeResponse(302, "/v2")), [
+            ("media.example", "session=media.example", "ua"), ("media.example", "session=media.example", "ua"),
+        ])
+
+    def test_cross_host_redirect_drops_cookie_for_good(self):
+        sent = self.follow(FakeResponse(302, "https://cdn.other/v"), FakeResponse(302, "https://media.example/v"))
+        self.assertEqual([cookie for _, cookie, _ in sent], ["session=media.example", None, None])
+
+    def test_without_cookies_none_are_sent(self):
+        pool = RecordingPool(FakeResponse(200))
+        open_upstream("https://media.example/v", {"Cookie": "stale=1"}, pool=pool)
+        self.assertEqual(pool.sent, [("media.example", {})])
+
+
+@skipUnless(Image, "Pillow is not installed")
+class ThumbnailResizeTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+    def cache_for(self, width, height, **kwargs):
+        # A flat colour compresses to a few KiB however many pixels it has
+        out = io.BytesIO()
+        Image.new("RGB", (width, height)).save(out, "PNG")
+        cache = ThumbnailCache(self.root, 1024 ** 2, (160,), 1024 ** 2, **kwargs)
+        cache._fetch = lambda url: out.getvalue()
+        return cache
+
+    def test_resizes(self):
+        data, content_type, hit = self.cache_for(640, 360).get("https://i.example/a.png", 160)
+        self.assertTrue(content_type.startswith("image/"))
+        self.assertFalse(hit)
+        with Image.open(io.BytesIO(data)) as image:
+            self.assertEqual(image.size, (160, 90))
+
+    def test_too_many_pixels_is_refused_before_decoding(self):
+        cache = self.cache_for(4000, 3000, max_pixels=1000 ** 2)
+        with mock.patch("downloader.thumbnails.Image.Image.load") as load:
+            with self.assertRaises(ThumbnailError):
+                cache.get("https://i.example/bomb.png", 160)
+        load.assert_not_called()
+
+    def test_pillow_decompression_bomb_becomes_thumbnail_error(self):
+        cache = self.cache_for(400, 400, max_pixels=10 ** 9)
+        with mock.patch.object(Image, "MAX_IMAGE_PIXELS", 1000):
+            with self.assertRaises(ThumbnailError):
+                cache.get("https://i.example/bomb.png", 160)
+
+
+class ThumbnailPrefetchTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.gate = threading.Event()
+        self.addCleanup(self.gate.set)
+        self.fetched = []
+        self.cache = ThumbnailCache(self.root, 1024 ** 2, (160,), 1024 ** 2, prefetch_workers=1, prefetch_queue=2)
+        self.cache._fetch = self.fetch
+
+    def fetch(self, url):
+        self.fetched.append(url)
+        self.gate.wait(5)
+        return b"GIF89a"
+
+    def settle(self):
+        self.gate.set()
+        deadline = time.monotonic() + 5
+        while self.cache._prefetching and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_queue_is_bounded_and_skips_cached_images(self):
+        urls = [f"https://i.example/{n}.jpg" for n in range(5)]
+        with mock.patch("downloader.thumbnails.PREFETCH_DROPPED") as dropped:
+            self.cache.prefetch(urls + [None, urls[0]])
+            # Already pending: not queued twice, and not counted as dropped
+            self.cache.prefetch(urls[:2])
+        self.assertEqual(dropped.inc.call_args_list, [mock.call(3)])
+        self.settle()
+        self.assertEqual(self.fetched, urls[:2])
+
+        self.cache.prefetch(urls)
+        self.settle()
+        self.assertEqual(self.fetched, urls[:4])
+        self.assertEqual(self.cache.get(urls[3])[2], True)
+
+
+class FakeClock:
+    def __init__(self, now=1000000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class HTTPFailure(Exception):
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"HTTP Error {status}")
+        self.status = status
+        self.response = mock.Mock(headers={"Retry-After": retry_after} if retry_after else {})
+
+
+def ydl_error(cause):
+    from yt_dlp.utils import DownloadError
+
+    return DownloadError(f"ERROR: {cause}", exc_info=(type(cause), cause, None))
+
+
+class ClassifyTests(SimpleTestCase):
+    def test_host_errors(self):
+        from yt_dlp.networking.exceptions import TransportError
+
+        self.assertEqual(classify(ydl_error(HTTPFailure(429))), "throttled")
+        self.assertEqual(classify(ydl_error(HTTPFailure(503))), "unavailable")
+        self.assertEqual(classify(ydl_error(TransportError("connection reset"))), "unavailable")
+        self.assertEqual(classify(Exception("Sign in to confirm you're not a bot")), "blocked")
+
+    def test_link_errors(self):
+        self.assertIsNone(classify(ydl_error(HTTPFailure(404))))
+        self.assertIsNone(classify(Exception("ERROR: Private video")))
+
+
+class HostSchedulerTests(SimpleTestCase):
+    host = "media.example"
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.clock = FakeClock()
+        patcher = mock.patch("downloader.hosts.time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.hosts = HostScheduler(
+            per_host=2, overrides={}, acquire_timeout=0.05, failure_threshold=3,
+            base_backoff=30, max_backoff=100, probe_timeout=120, cache_alias="default",
+        )
+
+    def call(self, error=None):
+        with self.hosts.slot(self.host):
+            if error:
+                raise error
+
+    def fail(self, error):
+        with self.assertRaises(type(error)):
+            self.call(error)
+
+    def rejected(self):
+        with self.assertRaises(HostUnavailable) as raised:
+            self.call()
+        return raised.exception
+
+    def test_opens_after_threshold_of_unavailable_errors(self):
+        for _ in range(2):
+            self.fail(ydl_error(HTTPFailure(503)))
+        self.assertEqual(self.hosts.health(self.host), {"failures": 2})
+        self.fail(ydl_error(HTTPFailure(503)))
+        error = self.rejected()
+        self.assertEqual((error.reason, error.retry_after, error.host), ("open", 30, self.host))
+        self.assertEqual(self.hosts.health(self.host)["error"], "unavailable")
+
+    def test_link_errors_do_not_count(self):
+        for _ in range(2):
+            self.fail(ydl_error(HTTPFailure(503)))
+        self.fail(ydl_error(HTTPFailure(404)))
+        self.assertIsNone(self.hosts.health(self.host))
+
+    def test_backoff_doubles_up_to_max(self):
+        self.fail(ydl_error(HTTPFailure(429)))
+        for backoff in (30, 60, 100, 100):
+            self.assertEqual(self.rejected().retry_after, backoff)
+            self.clock.advance(backoff)
+            # The probe after the window fails and reopens the circuit for longer
+            self.fail(ydl_error(HTTPFailure(429)))
+
+    def test_retry_after_header_extends_backoff(self):
+        self.fail(ydl_error(HTTPFailure(429, retry_after="600")))
+        self.assertEqual(self.rejected().retry_after, 600)
+
+    def test_half_open_lets_one_probe_through_and_success_closes(self):
+        self.fail(Exception("Sign in to confirm you're not a bot"))
+        self.clock.advance(31)
+        with self.hosts.slot(self.host):
+            # Other callers wait while the probe runs
+            error = self.rejected()
+            self.assertEqual((error.reason, error.retry_after), ("probing", 5))
+        self.assertIsNone(self.hosts.health(self.host))
+        self.call()
+
+    def test_busy_host_is_rejected(self):
+        with self.hosts.slot(self.host), self.hosts.slot(self.host):
+            error = self.rejected()
+        self.assertEqual(error.reason, "busy")
+        self.call()
+
+    def test_retry_after_is_whole_seconds(self):
+        self.assertEqual(HostUnavailable("h", 0.2).retry_after, 1)
+        self.assertEqual(HostUnavailable("h", 29.1).retry_after, 30)
+
+
+class DownloadErrorTests(SimpleTestCase):
+    def test_stand_in_until_yt_dlp_is_loaded(self):
+        with mock.patch.dict(sys.modules, {"yt_dlp.utils": None}):
+            self.assertIs(download_error(), NotLoaded)
+            self.assertFalse(isinstance(ValueError(), download_error()))
+
+    def test_real_class_once_loaded(self):
+        from yt_dlp.utils import DownloadError
+
+        self.assertIs(download_error(), DownloadError)
+
+
+class ArtifactStoreTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        self.store = ArtifactStore(os.path.join(self.tmp, "store"), max_bytes=25)
+
+    def publish(self, video_id, size=10, url="", store=None):
+        src = os.path.join(self.tmp, f"{video_id}.mp3")
+        with open(src, "wb") as f:
+            f.write(b"x" * size)
+        key = artifact_key("Youtube", video_id, "mp3", "192")
+        (store or self.store).publish(src, key, "Youtube", video_id, "mp3", "192", source_url=url)
+        return key
+
+    def stored(self):
+        return sorted(Artifact.objects.values_list("video_id", flat=True))
+
+    def test_publish_and_lookup_by_key_and_url(self):
+        key = self.publish("aaaaaaaaaaa", url="https://youtu.be/aaaaaaaaaaa?si=x")
+        self.assertTrue(os.path.exists(os.path.join(self.tmp, "aaaaaaaaaaa.mp3")))
+        by_key = self.store.lookup(key=key)
+        by_url = self.store.lookup(url="https://www.youtube.com/watch?v=aaaaaaaaaaa", codec="mp3", quality="192")
+        self.assertEqual((by_key.pk, by_key.filename, by_key.size), (by_url.pk, "aaaaaaaaaaa.mp3", 10))
+        self.assertIsNone(self.store.lookup(url="https://www.youtube.com/watch?v=aaaaaaaaaaa", codec="opus", quality="128"))
+        self.assertEqual(Artifact.objects.get(pk=by_key.pk).hits, 2)
+
+    def test_checkout_hard_links_into_the_work_dir(self):
+        self.publish("aaaaaaaaaaa")
+        dest_dir = os.path.join(self.tmp, "work")
+        path = self.store.fetch("Youtube", "aaaaaaaaaaa", "mp3", "192", dest_dir)
+        artifact = Artifact.objects.get()
+        self.assertEqual(path, os.path.join(dest_dir, "aaaaaaaaaaa.mp3"))
+        self.assertEqual(os.stat(path).st_ino, os.stat(artifact.path).st_ino)
+        # Evicting the stored file leaves the checked-out copy readable
+        os.unlink(artifact.path)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"x" * 10)
+
+    def test_rows_whose_file_is_gone_are_dropped(self):
+        key = self.publish("aaaaaaaaaaa")
+        os.unlink(Artifact.objects.get().path)
+        self.assertIsNone(self.store.lookup(key=key))
+        self.assertFalse(Artifact.objects.exists())
+        self.assertIsNone(self.store.fetch("Youtube", "aaaaaaaaaaa", "mp3", "192", self.tmp))
+
+    def test_lru_evicts_least_recently_used(self):
+        first = self.publish("aaaaaaaaaaa")
+        self.publish("bbbbbbbbbbb")
+        self.store.lookup(key=first)
+        self.publish("ccccccccccc")
+        self.assertEqual(self.stored(), ["aaaaaaaaaaa", "ccccccccccc"])
+
+    def test_lfu_evicts_least_used(self):
+        store = ArtifactStore(self.store.root, max_bytes=100, policy="lfu")
+        keys = [self.publish(video_id, store=store) for video_id in ("aaaaaaaaaaa", "bbbbbbbbbbb", "ccccccccccc")]
+        for key, hits in zip(keys, (3, 1, 2)):
+            for _ in range(hits):
+                store.lookup(key=key)
+        store.max_bytes = 15
+        self.assertEqual(store.evict(), 2)
+        self.assertEqual(self.stored(), ["aaaaaaaaaaa"])
+        self.assertEqual(sum(len(files) for _, _, files in os.walk(store.root)), 1)
+
+    def test_store_size_is_not_summed_on_every_publish(self):
+        store = ArtifactStore(self.store.root, max_bytes=10 ** 6)
+        with mock.patch.object(ArtifactStore, "evict", autospec=True, side_effect=ArtifactStore.evict) as evict:
+            for n in range(store.RESYNC_EVERY):
+                self.publish(f"{n:011d}", store=store)
+        # Once to learn the size, once for the periodic re-sync
+        self.assertEqual(evict.call_count, 2)
+
+
+class BoundedExecutorTests(SimpleTestCase):
+    def test_slots_are_reserved_atomically(self):
+        executor = async_views.BoundedExecutor(workers=4, max_pending=2)
+        release = threading.Event()
+
+        async def burst():
+            return await asyncio.gather(
+                *(executor.run(release.wait, 5) for _ in range(5)), asyncio.sleep(0.05, result="tick"),
+                return_exceptions=True,
+            )
+
+        def run():
+            self.outcomes = asyncio.run(burst())
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        time.sleep(0.02)
+        release.set()
+        thread.join(5)
+        busy = [o for o in self.outcomes if isinstance(o, async_views.ExecutorBusy)]
+        self.assertEqual((len(busy), self.outcomes.count(True)), (3, 2))
+        self.assertEqual(executor._pending, 0)
+
+
+def info_for(title):
+    return {"title": title, "formats": [{"format_id": "140", "ext": "m4a", "acodec": "mp4a.40.2", "vcodec": "none", "abr": 128}]}
+
+
+class FetchLinkAsyncTests(TestCase):
+    url = "/api/downloader/fetch/async/"
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(username="async", email="async@example.com", password="x")
+        self.auth = {"Authorization": f"Bearer {RefreshToken.for_user(user).access_token}"}
+        self.client = AsyncClient()
+        self.addCleanup(lambda: setattr(async_views, "_executor", None))
+
+    async def post(self, **data):
+        return await self.client.post(
+            self.url, {"url": "https://example.com/v", **data}, content_type="application/json", headers=self.auth,
+        )
+
+    async def test_metadata(self):
+        with mock.patch("downloader.async_views.extract_metadata", return_value=info_for("Song")):
+            response = await self.post(fields="title")
+        self.assertEqual((response.status_code, json.loads(response.content)), (200, {"title": "Song"}))
+
+    async def test_unauthenticated(self):
+        response = await self.client.post(self.url, {"url": "https://example.com/v"}, content_type="application/json")
+        self.assertEqual(response.status_code, 401)
+
+    async def test_rate_limited_is_429(self):
+        limiter = mock.Mock(**{"check.side_effect": RateLimited("slow down", 7, "user_rate")})
+        with mock.patch("downloader.async_views.rate_limiter", limiter):
+            response = await self.post()
+        self.assertEqual((response.status_code, response["Retry-After"]), (429, "7"))
+
+    async def test_unavailable_host_and_full_executor_are_503(self):
+        with mock.patch("downloader.async_views.extract_metadata", side_effect=HostUnavailable("example.com", 40)):
+            response = await self.post()
+        self.assertEqual((response.status_code, response["Retry-After"]), (503, "40"))
+
+        async_views._executor = async_views.BoundedExecutor(workers=1, max_pending=0)
+        with mock.patch("downloader.async_views.extract_metadata") as extract:
+            response = await self.post()
+        self.assertEqual((response.status_code, response["Retry-After"]), (503, "5"))
+        extract.assert_not_called()
+
+    async def test_file_body_is_streamed_from_a_worker_thread(self):
+        threads, released = set(), []
+
+        def body():
+            for chunk in (b"ab", b"cd", b"ef"):
+                threads.add(threading.get_ident())
+                yield chunk
+
+        @contextmanager
+        def download_mp3(*args):
+            yield {"requested_downloads": []}, "/tmp/none"
+
+        def mp3_response(request, download, work_dir, release):
+            released.append(release)
+            return StreamingHttpResponse(body(), content_type="audio/mpeg")
+
+        with mock.patch("downloader.async_views.download_mp3", download_mp3), \
+                mock.patch("downloader.async_views.mp3_response", mp3_response):
+            response = await self.post(convert_mp3="true")
+            chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual((response.status_code, chunks), (200, [b"ab", b"cd", b"ef"]))
+        self.assertNotIn(threading.get_ident(), threads)
+        self.assertEqual(len(released), 1)
+
+
+def read_ndjson(response):
+    return [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+
+
+class FetchBatchTests(TestCase):
+    url = "/api/downloader/fetch/batch/"
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(username="batch", password="x"))
+        patcher = mock.patch("downloader.views.admit")
+        self.admit = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, urls, **data):
+        return self.client.post(self.url, {"urls": urls, **data}, format="json")
+
+    @override_settings(DOWNLOADER_BATCH={"MAX_URLS": 2})
+    def test_size_limit(self):
+        response = self.post(["https://a.example/1", "https://a.example/2", "https://a.example/3"])
+        self.assertEqual((response.status_code, response.data["error"]), (400, "At most 2 links per batch"))
+        self.assertEqual(self.post([]).status_code, 400)
+        self.assertEqual(self.post(["https://a.example/1", ""]).status_code, 400)
+        self.admit.assert_not_called()
+
+        with mock.patch("downloader.batch.extract_metadata", return_value=info_for("T")):
+            self.assertEqual(self.post(["https://a.example/1", "https://a.example/2"]).status_code, 200)
+        self.assertEqual(self.admit.call_args.kwargs["cost"], 2)
+
+    def test_errors_are_per_item(self):
+        urls = ["https://a.example/ok", "https://a.example/gone", "https://b.example/down", "https://a.example/bug"]
+        errors = {
+            urls[1]: ydl_error(HTTPFailure(404)),
+            urls[2]: HostUnavailable("b.example", 30),
+            urls[3]: KeyError("formats"),
+        }
+
+        def extract(url):
+            if url in errors:
+                raise errors[url]
+            return info_for("Fine")
+
+        with mock.patch("downloader.batch.extract_metadata", side_effect=extract), self.assertLogs("downloader.batch"):
+            items = sorted(read_ndjson(self.post(urls, fields="title")), key=lambda item: item["index"])
+        self.assertEqual(items, [
+            {"index": 0, "url": urls[0], "data": {"title": "Fine"}},
+            {"index": 1, "url": urls[1], "error": "Failed to download the video/audio"},
+            {"index": 2, "url": urls[2], "error": "b.example is temporarily unavailable, please try again later."},
+            {"index": 3, "url": urls[3], "error": "Failed to process the link"},
+        ])
+
+    def test_lines_arrive_in_completion_order(self):
+        urls = [f"https://a.example/{n}" for n in range(3)]
+
+        def extract(url):
+            # The first link finishes last
+            time.sleep((2 - urls.index(url)) * 0.05)
+            return info_for(url)
+
+        with mock.patch("downloader.batch.extract_metadata", side_effect=extract):
+            items = read_ndjson(self.post(urls, fields="title"))
+        self.assertEqual([item["index"] for item in items], [2, 1, 0])
+        self.assertEqual([item["data"]["title"] for item in items], urls[::-1])
+
+    def test_per_host_cap_applies_across_the_batch(self):
+        hosts = HostScheduler(
+            per_host=2, overrides={"b.example": 1}, acquire_timeout=5, failure_threshold=3,
+            base_backoff=30, max_backoff=100, probe_timeout=120, cache_alias="default",
+        )
+        running, peak, lock = {}, {}, threading.Lock()
+
+        class FakeYDL:
+            def extract_info(self, url, download=False):
+                host = urlsplit(url).hostname
+                with lock:
+                    running[host] = running.get(host, 0) + 1
+                    peak[host] = max(peak.get(host, 0), running[host])
+                time.sleep(0.03)
+                with lock:
+                    running[host] -= 1
+                return info_for(url)
+
+            def sanitize_info(self, info):
+                return info
+
+        @contextmanager
+        def lend(purpose):
+            yield FakeYDL()
+
+        urls = [f"https://{host}/{n}" for host in ("a.example", "b.example") for n in range(4)]
+        with mock.patch("downloader.extraction.host_scheduler", hosts), \
+                mock.patch("downloader.extraction.ydl_pool", mock.Mock(lend=lend)):
+            items = read_ndjson(self.post(urls))
+        self.assertEqual(sorted(item["index"] for item in items if "data" in item), list(range(8)))
+        self.assertEqual(peak, {"a.example": 2, "b.example": 1})
+
+
+@override_settings(DOWNLOADER_PLAYLIST={"PAGE_SIZE": 3, "MAX_PAGE_SIZE": 5})
+class PlaylistWindowTests(TestCase):
+    url = "https://example.com/playlist?list=PL1"
+    total = 10
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(username="lists", password="x"))
+        for target, kwargs in (
+            ("downloader.views.admit", {}),
+            ("downloader.views.enumerate_playlist", {"side_effect": self.enumerate}),
+            ("downloader.batch.extract_metadata", {"side_effect": lambda url: info_for(url)}),
+            ("downloader.batch.prefetch_thumbnails", {}),
+        ):
+            patcher = mock.patch(target, **kwargs)
+            self.addCleanup(patcher.stop)
+            setattr(self, target.rsplit(".", 1)[1], patcher.start())
+
+    def enumerate(self, url, start=1, end=None):
+        # Like yt-dlp's playlist_items, a window past the end is simply empty
+        entries = [{"url": f"https://example.com/v{n}"} for n in range(1, self.total + 1)]
+        return {"title": "List", "playlist_count": self.total, "entries": entries[start - 1:end]}
+
+    def post(self, **data):
+        return self.client.post("/api/downloader/fetch/", {"url": self.url, "stream": True, **data}, format="json")
+
+    def window(self, **data):
+        response = self.post(fields="title", **data)
+        self.assertEqual(response.status_code, 200)
+        header, *tracks = read_ndjson(response)
+        return header, sorted(tracks, key=lambda t: t["index"])
+
+    def test_window(self):
+        header, tracks = self.window(offset=4, limit=2)
+        self.enumerate_playlist.assert_called_once_with(self.url, 5, 6)
+        self.assertEqual(
+            (header["total"], header["offset"], header["limit"], header["count"]), (self.total, 4, 2, 2),
+        )
+        # ``index`` is the position in the whole playlist, not in the window
+        self.assertEqual(
+            [(t["type"], t["index"], t["data"]["title"]) for t in tracks],
+            [("track", 4, "https://example.com/v5"), ("track", 5, "https://example.com/v6")],
+        )
+
+    def test_defaults_and_clamping(self):
+        header, tracks = self.window()
+        self.assertEqual((header["offset"], header["limit"], [t["index"] for t in tracks]), (0, 3, [0, 1, 2]))
+
+        header, _ = self.window(offset=-5, limit=0)
+        self.assertEqual((header["offset"], header["limit"]), (0, 1))
+
+        header, _ = self.window(offset="2", limit=1000)
+        self.assertEqual((header["offset"], header["limit"], header["count"]), (2, 5, 5))
+        self.enumerate_playlist.assert_called_with(self.url, 3, 7)
+
+    def test_window_past_the_end(self):
+        header, tracks = self.window(offset=8, limit=5)
+        self.assertEqual((header["count"], [t["index"] for t in tracks]), (2, [8, 9]))
+
+        header, tracks = self.window(offset=50)
+        self.assertEqual((header["count"], tracks), (0, []))
+
+    def test_invalid_values(self):
+        for data in ({"offset": "abc"}, {"limit": "1.5"}, {"offset": None}):
+            response = self.post(**data)
+            self.assertEqual(
+                (response.status_code, response.data["error"]), (400, "offset and limit must be integers"), data,
+            )
+        self.enumerate_playlist.assert_not_called()
+
+
+COOKIE_LINE = ".example.com\tTRUE\t/\tFALSE\t2000000000\t{name}\t{value}\n"
+
+
+class YDLPoolTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, True)
+        self.cookies = os.path.join(tmp, "cookies.txt")
+        self.write_cookie("session", "one")
+        profile = {
+            "quiet": True,
+            "outtmpl": "%(title)s.%(ext)s",
+            "cookiefile": self.cookies,
+            "postprocessors": [{"key": "FFmpegExtractAudio", "preferredcodec": "mp3"}],
+        }
+        self.pool = YDLPool({"audio": lambda: dict(profile)}, self.cookies, max_idle=2)
+        self.addCleanup(self.pool.clear)
+
+    def write_cookie(self, name, value, mtime_ns=None):
+        with open(self.cookies, "w") as f:
+            f.write("# Netscape HTTP Cookie File\n" + COOKIE_LINE.format(name=name, value=value))
+        if mtime_ns:
+            os.utime(self.cookies, ns=(mtime_ns, mtime_ns))
+
+    def state(self, ydl):
+        # The private yt-dlp attributes ``lend`` saves and restores
+        return {
+            "params": dict(ydl.params),
+            "outtmpl": dict(ydl.params["outtmpl"]),
+            "progress_hooks": list(ydl._progress_hooks),
+            "postprocessor_hooks": list(ydl._postprocessor_hooks),
+            "pp_hooks": [list(pp._progress_hooks) for pps in ydl._pps.values() for pp in pps],
+        }
+
+    @contextmanager
+    def borrow_and_mutate(self, tmp_dir):
+        with self.pool.lend(
+            "audio", tmp_dir=tmp_dir, progress_hooks=[print], postprocessor_hooks=[repr],
+            format="worst", noplaylist=True,
+        ) as ydl:
+            self.assertEqual(ydl.params["outtmpl"]["default"], os.path.join(tmp_dir, "%(title)s.%(ext)s"))
+            self.assertEqual((ydl.params["format"], ydl.params["noplaylist"]), ("worst", True))
+            self.assertIn(print, ydl._progress_hooks)
+            self.assertTrue(all(repr in pp._progress_hooks for pps in ydl._pps.values() for pp in pps))
+            ydl._num_downloads = 3
+            yield ydl
+
+    def test_lend_restores_instance(self):
+        with self.pool.lend("audio") as ydl:
+            original = self.state(ydl)
+        self.assertTrue(original["pp_hooks"])
+
+        for raises in (False, True):
+            with self.subTest(raises=raises):
+                try:
+                    with self.borrow_and_mutate("/tmp/job") as lent:
+                        self.assertIs(lent, ydl)
+                        if raises:
+                            raise RuntimeError("download failed")
+                except RuntimeError:
+                    pass
+                self.assertEqual(self.state(ydl), original)
+                self.assertEqual(ydl._num_downloads, 0)
+                self.assertNotIn("noplaylist", ydl.params)
+                with self.pool.lend("audio") as again:
+                    self.assertIs(again, ydl)
+
+    def test_cookie_change_reloads_instances(self):
+        with self.pool.lend("audio") as ydl:
+            self.assertEqual(ydl.cookiejar.get_cookie_header("https://example.com/"), "session=one")
+            mtime = os.stat(self.cookies).st_mtime_ns
+        with self.pool.lend("audio") as other:
+            self.assertIs(other.cookiejar, ydl.cookiejar)
+
+        self.write_cookie("session", "two", mtime + 10 ** 9)
+        with mock.patch.object(ydl, "close", wraps=ydl.close) as close, self.pool.lend("audio") as fresh:
+            self.assertIsNot(fresh, ydl)
+            self.assertEqual(fresh.cookiejar.get_cookie_header("https://example.com/"), "session=two")
+        close.assert_called_once_with()
+
+    def test_closing_does_not_save_the_shared_jar(self):
+        with self.pool.lend("audio") as ydl:
+            # yt-dlp would rewrite the file with its own header if it saved the jar
+            self.assertEqual(len(ydl.cookiejar), 1)
+        with open(self.cookies) as f:
+            before = f.read()
+        stat = os.stat(self.cookies)
+
+        self.pool.clear()
+        with open(self.cookies) as f:
+            self.assertEqual(f.read(), before)
+        self.assertEqual(os.stat(self.cookies).st_mtime_ns, stat.st_mtime_ns)
+
+
+MiB = 1024 ** 2
+
+
+class WorkspaceManagerTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.manager = WorkspaceManager(
+            os.path.join(self.root, "work"), max_bytes=4 * MiB, job_max_bytes=3 * MiB, reserve_bytes=MiB,
+            min_free_bytes=0, stale_after=60,
+        )
+        patcher = mock.patch.object(self.manager, "start")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, workspace, size, name="media.part"):
+        with open(os.path.join(workspace.path, name), "wb") as f:
+            f.write(b"x" * size)
+
+    def test_reservations_limit_allocation(self):
+        live = [self.manager.allocate() for _ in range(4)]
+        with self.assertRaises(StorageUnavailable):
+            self.manager.allocate()
+        live[0].release()
+        self.assertFalse(os.path.exists(live[0].path))
+        self.manager.allocate()
+
+    def test_written_bytes_count_against_the_budget(self):
+        first = self.manager.allocate()
+        self.write(first, 2 * MiB + 1)
+        first.check()
+        self.assertEqual(first.charge, first.used)
+        second = self.manager.allocate()
+        # Over 2 MiB written plus the new 1 MiB reservation leave no room for a third
+        with self.assertRaises(StorageUnavailable):
+            self.manager.allocate()
+
+        # Growing past the budget aborts the download that does it, not only new ones
+        self.write(second, 2 * MiB)
+        with self.assertRaises(QuotaExceeded) as raised:
+            second.progress_hook({"status": "finished"})
+        self.assertIn("out of space", str(raised.exception))
+
+    def test_job_quota(self):
+        workspace = self.manager.allocate()
+        self.write(workspace, 3 * MiB + 1)
+        with self.assertRaises(QuotaExceeded) as raised:
+            workspace.check()
+        self.assertEqual(str(raised.exception), "Download exceeds the 3 MiB limit")
+
+    def test_progress_hook_checks_at_most_once_per_interval(self):
+        workspace = self.manager.allocate()
+        with mock.patch.object(workspace, "usage", return_value=0) as usage:
+            for _ in range(5):
+                workspace.progress_hook({"status": "downloading"})
+            workspace.progress_hook({"status": "finished"})
+        self.assertEqual(usage.call_count, 2)
+
+    def lease(self, path, host=None, pid=None, age=0):
+        os.makedirs(path, exist_ok=True)
+        lease = os.path.join(path, LEASE_FILE)
+        with open(lease, "w") as f:
+            f.write(f"{host or self.manager.host} {pid or os.getpid()}\n")
+        mtime = time.time() - age
+        os.utime(lease, (mtime, mtime))
+        return path
+
+    def test_is_stale(self):
+        root = self.manager.root
+        dead = subprocess_pid()
+        self.assertFalse(self.manager.is_stale(self.lease(os.path.join(root, "fresh"))))
+        self.assertTrue(self.manager.is_stale(self.lease(os.path.join(root, "old"), age=61)))
+        self.assertTrue(self.manager.is_stale(self.lease(os.path.join(root, "dead"), pid=dead)))
+        # Another host's pid says nothing here; only the lease age counts
+        self.assertFalse(self.manager.is_stale(self.lease(os.path.join(root, "remote"), host="other", pid=dead)))
+
+        bare = os.path.join(root, "bare")
+        os.makedirs(bare)
+        self.assertFalse(self.manager.is_stale(bare))
+        os.utime(bare, (time.time() - 61, time.time() - 61))
+        self.assertTrue(self.manager.is_stale(bare))
+
+    def test_sweep_keeps_live_and_fresh_workspaces(self):
+        live = self.manager.allocate()
+        old = time.time() - 600
+        os.utime(os.path.join(live.path, LEASE_FILE), (old, old))
+        fresh = self.lease(os.path.join(self.manager.root, "fresh"))
+        stale = self.lease(os.path.join(self.manager.root, "stale"), pid=subprocess_pid())
+
+        self.assertEqual(self.manager.sweep(), 1)
+        self.assertEqual((os.path.exists(live.path), os.path.exists(fresh), os.path.exists(stale)), (True, True, False))
+
+        # The heartbeat keeps live leases fresh for sweepers in other processes
+        self.manager.heartbeat()
+        self.assertFalse(self.manager.is_stale(live.path))
+
+    def test_sweeper_restarts_in_forked_process(self):
+        manager = WorkspaceManager(self.root, 0, 0, 0, 0, sweep_interval=3600)
+        with mock.patch("downloader.workspace.threading.Thread") as thread, \
+                mock.patch("downloader.workspace.os.getpid", return_value=100) as getpid:
+            manager.start()
+            manager.start()
+            self.assertEqual(thread.return_value.start.call_count, 1)
+            getpid.return_value = 101
+            manager.start()
+            self.assertEqual(thread.return_value.start.call_count, 2)
+
+    def test_management_commands_do_not_start_the_sweeper(self):
+        for argv, expected in (
+            (["manage.py", "migrate"], True), (["manage.py", "test"], True), (["manage.py", "runserver"], False),
+            (["/venv/bin/gunicorn", "backend.wsgi"], False),
+        ):
+            with mock.patch.object(sys, "argv", argv):
+                self.assertEqual(apps.is_management_command(), expected, argv)
+
+
+def subprocess_pid():
+    """A pid that is no longer running."""
+    import subprocess
+
+    process = subprocess.Popen([sys.executable, "-c", ""])
+    process.wait()
+    return process.pid
+
+
+class AudioTargetTests(TestCase):
+    def test_defaults_and_normalization(self):
+        self.assertEqual(audio_target(), ("mp3", "192"))
+        self.assertEqual(audio_target("OPUS"), ("opus", "128"))
+        self.assertEqual(audio_target("aac", "160k"), ("m4a", "160"))
+
+    def test_invalid_values(self):
+        for codec, quality, message in (
+            ("wav", None, "audio_codec must be one of: mp3, m4a, opus"),
+            ("mp3", "high", "audio_quality must be a bitrate in kbit/s, e.g. 192"),
+            ("mp3", "32", "audio_quality must be between 64 and 320"),
+            ("mp3", 512, "audio_quality must be between 64 and 320"),
+        ):
+            with self.assertRaisesMessage(ValueError, message):
+                audio_target(codec, quality)
+
+    def test_invalid_target_is_400_before_downloading(self):
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_user(username="codec", password="x"))
+        with mock.patch("downloader.views.download_mp3") as download_mp3:
+            response = client.post("/api/downloader/fetch/", {
+                "url": "https://example.com/v", "convert_mp3": True, "audio_codec": "wav",
+            }, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["error"], "audio_codec must be one of: mp3, m4a, opus")
+        download_mp3.assert_not_called()
+
+
+class TranscodePoolTests(SimpleTestCase):
+    def test_single_tracks_run_before_playlist_tracks(self):
+        pool, started, order = TranscodePool(1), threading.Event(), []
+        gate = threading.Event()
+
+        def block():
+            started.set()
+            gate.wait(5)
+
+        pool.submit(block)
+        started.wait(5)
+        futures = [
+            pool.submit(order.append, name, priority=priority)
+            for name, priority in (("p1", PRIORITY_PLAYLIST), ("s1", PRIORITY_SINGLE), ("p2", PRIORITY_PLAYLIST),
+                                   ("s2", PRIORITY_SINGLE))
+        ]
+        self.assertEqual((pool.queued(PRIORITY_SINGLE), pool.queued(PRIORITY_PLAYLIST), pool.busy), (2, 2, 1))
+        gate.set()
+        for future in futures:
+            future.result(5)
+        self.assertEqual(order, ["s1", "s2", "p1", "p2"])
+
+    def test_cancelled_jobs_do_not_run(self):
+        pool, gate, ran = TranscodePool(1), threading.Event(), []
+        pool.submit(gate.wait, 5)
+        cancelled = pool.submit(ran.append, "cancelled")
+        kept = pool.submit(ran.append, "kept")
+        self.assertTrue(cancelled.cancel())
+        gate.set()
+        kept.result(5)
+        self.assertEqual(ran, ["kept"])
+        self.assertEqual(pool.queued(), 0)
+
+    def test_errors_reach_the_future(self):
+        future = TranscodePool(1).submit(int, "x")
+        with self.assertRaises(ValueError):
+            future.result(5)
+
+
+class TranscodeMethodTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, True)
+
+    def transcode(self, ext, source_codec, codec):
+        from yt_dlp.postprocessor.ffmpeg import FFmpegExtractAudioPP, FFmpegPostProcessor
+
+        path = os.path.join(self.dir, f"track.{ext}")
+        with open(path, "wb") as f:
+            f.write(b"audio")
+        calls = []
+
+        def run_ffmpeg(pp, src, dst, opts):
+            calls.append(opts)
+            shutil.copy(src, dst)
+
+        with mock.patch.object(FFmpegExtractAudioPP, "get_audio_codec", return_value=source_codec), \
+                mock.patch.object(FFmpegPostProcessor, "run_ffmpeg", run_ffmpeg), \
+                mock.patch("downloader.transcode.TRANSCODES") as counter:
+            result = transcode({"filepath": path, "ext": ext}, codec, "192")
+        self.assertTrue(os.path.exists(result))
+        self.assertFalse(os.path.exists(path) and path != result)
+        return calls, counter.inc.call_args.kwargs
+
+    def test_matching_source_is_stream_copied(self):
+        calls, labels = self.transcode("webm", "opus", "opus")
+        self.assertEqual(calls[0][:3], ["-vn", "-acodec", "copy"])
+        self.assertEqual(labels, {"codec": "opus", "method": "copy"})
+
+        calls, labels = self.transcode("mp4", "aac", "m4a")
+        self.assertEqual((calls[0][2], labels["method"]), ("copy", "copy"))
+
+    def test_other_sources_are_reencoded(self):
+        calls, labels = self.transcode("webm", "opus", "mp3")
+        self.assertEqual(calls[0][:3], ["-vn", "-acodec", "libmp3lame"])
+        self.assertEqual(labels, {"codec": "mp3", "method": "encode"})
+
+
+KiB = 1024
+
+
+@override_settings(DOWNLOADER_SEGMENTED={
+    "CONNECTIONS_PER_FILE": 3, "SEGMENT_SIZE": 32 * KiB, "MIN_SIZE": 64 * KiB, "SEGMENT_RETRIES": 2,
+    "BLOCK_SIZE": 4 * KiB,
+})
+class SegmentedDownloadTests(SimpleTestCase):
+    size = 200 * KiB
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from benchmarks.media_stub import MediaStub
+
+        cls.stub = MediaStub().__enter__()
+        cls.addClassCleanup(cls.stub.__exit__, None, None, None)
+
+    def setUp(self):
+        import yt_dlp
+
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, True)
+        self.ydl = yt_dlp.YoutubeDL({"quiet": True, "noprogress": True})
+        self.addCleanup(self.ydl.close)
+        self.budget = ConnectionBudget(8)
+        patcher = mock.patch("downloader.segmented.connection_budget", self.budget)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.ranges = []
+        urlopen = self.ydl.urlopen
+
+        def record(request):
+            self.ranges.append(request.headers.get("Range"))
+            return urlopen(request)
+
+        self.ydl.urlopen = record
+
+    def info(self, **params):
+        return {
+            "url": self.stub.media_url("clip", kind="bytes", bytes=self.size, **params),
+            "protocol": "http", "filesize": self.size, "ext": "bin", "http_headers": {},
+        }
+
+    def download(self, info, hooks=()):
+        from benchmarks.media_stub import synthetic_bytes
+
+        fd = SegmentedHttpFD(self.ydl, self.ydl.params)
+        for hook in hooks:
+            fd.add_progress_hook(hook)
+        filename = os.path.join(self.dir, "clip.bin")
+        held = self.budget.in_use
+        with mock.patch.object(HttpFD, "real_download", autospec=True, side_effect=HttpFD.real_download) as single:
+            ok, _ = fd.download(filename, info)
+        # Connections granted for the download are returned whatever happened
+        self.assertEqual(self.budget.in_use, held)
+        if ok and os.path.exists(filename):
+            with open(filename, "rb") as f:
+                self.assertEqual(f.read(), synthetic_bytes(self.size))
+        return ok, single.called
+
+    def test_plan(self):
+        fd = SegmentedHttpFD(self.ydl, self.ydl.params)
+        conf = segmented_settings()
+        filename = os.path.join(self.dir, "clip.bin")
+        self.assertEqual(fd._plan(filename, self.info(), conf), (self.size, 32 * KiB))
+        chunked = dict(self.info(), downloader_options={"http_chunk_size": 10 * KiB})
+        self.assertEqual(fd._plan(filename, chunked, conf), (self.size, 10 * KiB))
+        for info in (
+            dict(self.info(), filesize=None),
+            dict(self.info(), filesize=63 * KiB),
+            dict(self.info(), protocol="m3u8_native"),
+            dict(self.info(), http_headers={"Range": "bytes=0-"}),
+        ):
+            self.assertIsNone(fd._plan(filename, info, conf), info)
+        # A .part left by an interrupted run is resumed by HttpFD instead
+        open(fd.temp_name(filename), "wb").close()
+        self.assertIsNone(fd._plan(filename, self.info(), conf))
+
+    def test_segments_cover_the_file(self):
+        self.assertEqual(self.download(self.info()), (True, False))
+        starts = sorted(int(r[6:].split("-")[0]) for r in self.ranges)
+        self.assertEqual(starts, list(range(0, self.size, 32 * KiB)))
+        self.assertIn(f"bytes={6 * 32 * KiB}-{self.size - 1}", self.ranges)
+
+    def test_cut_off_segment_resumes_where_it_stopped(self):
+        with mock.patch("downloader.segmented.SEGMENT_RETRIES") as retries:
+            self.assertEqual(self.download(self.info(cut=10000)), (True, False))
+        retries.inc.assert_called_once_with()
+        self.assertIn(f"bytes=10000-{32 * KiB - 1}", self.ranges)
+
+    def test_falls_back_when_ranges_are_ignored_or_wrong(self):
+        for params in ({"ranges": "ignore"}, {"total": self.size + 1}):
+            with self.subTest(**params):
+                self.assertEqual(self.download(self.info(**params)), (True, True))
+                self.assertFalse(os.path.exists(os.path.join(self.dir, "clip.bin.part")))
+                os.remove(os.path.join(self.dir, "clip.bin"))
+
+    def test_exhausted_budget_uses_one_connection(self):
+        self.budget.acquire(7)
+        self.assertEqual(self.download(self.info()), (True, True))
+        self.assertEqual(self.ranges, [None])
+        self.budget.release(7)
+
+    def test_quota_hook_aborts_every_segment(self):
+        def quota(d):
+            if d["status"] == "downloading":
+                raise QuotaExceeded("Download exceeds the 1 MiB limit")
+
+        with self.assertRaises(QuotaExceeded):
+            self.download(self.info(delay=0.6), hooks=[quota])
+        self.assertEqual(len(self.ranges), 3)
+        self.assertEqual((os.listdir(self.dir), self.budget.in_use), ([], 0))
+
+
+@skipUnless(brotli, "brotli is not installed")
+class CompressionMiddlewareTests(SimpleTestCase):
+    path = "/api/downloader/fetch/"
+    body = json.dumps({"tracks": [{"title": f"Track {n}", "url": f"https://example.com/{n}"} for n in range(100)]})
+    body = body.encode()
+
+    def compress(self, response, accept="gzip, deflate, br", path=None):
+        request = RequestFactory().get(path or self.path, HTTP_ACCEPT_ENCODING=accept)
+        return CompressionMiddleware(lambda r: response)(request)
+
+    def json_response(self, body=None, **headers):
+        response = HttpResponse(self.body if body is None else body, content_type="application/json")
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    def test_negotiation(self):
+        cases = [
+            ("gzip, deflate, br", "br"),
+            ("gzip", "gzip"),
+            ("br;q=0, gzip;q=0.5", "gzip"),
+            ("*", "br"),
+            ("*, br;q=0", "gzip"),
+            ("identity", None),
+            ("gzip;q=0, identity", None),
+            ("", None),
+        ]
+        for accept, coding in cases:
+            with self.subTest(accept=accept):
+                response = self.compress(self.json_response(), accept)
+                self.assertEqual(response.get("Content-Encoding"), coding)
+                self.assertIn("Accept-Encoding", response["Vary"])
+
+    def test_round_trip(self):
+        response = self.compress(self.json_response(), "gzip")
+        self.assertEqual(zlib.decompress(response.content, 31), self.body)
+        self.assertEqual(response["Content-Length"], str(len(response.content)))
+        response = self.compress(self.json_response(), "br")
+        self.assertEqual(brotli.decompress(response.content), self.body)
+
+    def test_without_brotli_gzip_is_used(self):
+        with mock.patch("downloader.middleware.brotli", None):
+            self.assertEqual(self.compress(self.json_response(), "br, gzip")["Content-Encoding"], "gzip")
+            self.assertNotIn("Content-Encoding", self.compress(self.json_response(), "br"))
+
+    def test_skipped_responses(self):
+        small = self.compress(self.json_response(b'{"ok":true}'))
+        self.assertEqual((small.content, small.has_header("Content-Encoding")), (b'{"ok":true}', False))
+        # Still varies: a larger body for the same URL would be compressed
+        self.assertIn("Accept-Encoding", small["Vary"])
+
+        for response, path in (
+            (self.json_response(), "/api/users/login/"),
+            (HttpResponse(self.body, content_type="audio/mpeg"), None),
+            (self.json_response(**{"Cache-Control": "no-transform"}), None),
+            (self.json_response(**{"Content-Encoding": "gzip"}), None),
+        ):
+            with self.subTest(path=path, content_type=response["Content-Type"]):
+                result = self.compress(response, path=path)
+                self.assertEqual(result.content, self.body)
+                self.assertNotEqual(result.get("Content-Encoding"), "br")
+        self.assertFalse(self.compress(self.json_response(), path="/api/users/login/").has_header("Vary"))
+
+    @override_settings(DOWNLOADER_COMPRESSION={"ENABLED": False})
+    def test_disabled(self):
+        self.assertFalse(self.compress(self.json_response()).has_header("Content-Encoding"))
+
+    def test_etag_is_weakened(self):
+        response = self.compress(self.json_response(ETag='"abc"'))
+        self.assertEqual(response["ETag"], 'W/"abc"')
+        response = self.compress(self.json_response(ETag='W/"abc"'))
+        self.assertEqual(response["ETag"], 'W/"abc"')
+        # Identity responses keep the strong validator
+        self.assertEqual(self.compress(self.json_response(ETag='"abc"'), "identity")["ETag"], '"abc"')
+
+    def test_stream_is_flushed_per_chunk(self):
+        lines = [json.dumps({"index": n, "title": "x" * 200}).encode() + b"\n" for n in range(5)]
+        for coding, decompressor in (("gzip", zlib.decompressobj(31)), ("br", brotli.Decompressor())):
+            with self.subTest(coding=coding):
+                response = StreamingHttpResponse(iter(lines), content_type="application/x-ndjson")
+                response["Content-Length"] = "9999"
+                response = self.compress(response, coding)
+                self.assertEqual(response["Content-Encoding"], coding)
+                self.assertFalse(response.has_header("Content-Length"))
+                decompress = decompressor.decompress if coding == "gzip" else decompressor.process
+                chunks = list(response.streaming_content)
+                # Each line can be decoded as soon as its chunk arrives
+                self.assertEqual([decompress(chunk) for chunk in chunks[:5]], lines)
+                self.assertEqual(decompress(b"".join(chunks[5:])), b"")
+
+    async def test_async_stream(self):
+        async def lines():
+            for n in range(3):
+                yield f'{{"index":{n}}}\n'.encode()
+
+        response = self.compress(StreamingHttpResponse(lines(), content_type="application/x-ndjson"), "gzip")
+        body = b"".join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(zlib.decompress(body, 31), b'{"index":0}\n{"index":1}\n{"index":2}\n')
+
+
+class ORJSONRendererTests(SimpleTestCase):
+    def test_matches_drf_renderer(self):
+        from rest_framework.renderers import JSONRenderer
+
+        data = {
+            "price": Decimal("1.10"),
+            "at": datetime(2026, 10, 18, 12, 30, 15, 123456, tzinfo=dt_timezone.utc),
+            "local": datetime(2026, 10, 18, 12, 30),
+            "day": date(2026, 10, 18),
+            "clock": dt_time(7, 5, 3, 250000),
+            "id": UUID("12345678-1234-5678-1234-567812345678"),
+            "label": gettext_lazy("Username already taken."),
+            "text": "café — \U0001f3b5",
+            "nested": [{"n": 1, "f": 0.5, "none": None, "flag": True}],
+            "ints": {1: "one"},
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(ORJSONRenderer().render(None), b"")
+
+    def test_indent_uses_drf_renderer(self):
+        rendered = ORJSONRenderer().render({"a": 1}, "application/json; indent=2")
+        self.assertEqual(rendered, b'{\n  "a": 1\n}')
+
+    def test_standard_library_fallback(self):
+        data = {"price": Decimal("2.5"), "id": UUID(int=1), "text": "café"}
+        with mock.patch("downloader.renderers.orjson", None):
+            self.assertEqual(dumps(data), ORJSONRenderer().render(data))
+        self.assertEqual(dumps(data), ORJSONRenderer().render(data))
+
+
+class PayloadShapeTests(SimpleTestCase):
+    info = {
+        "title": "Song",
+        "uploader": None,
+        "thumbnail": None,
+        "formats": [
+            {"format_id": "251", "url": "https://m.example/251", "ext": "webm", "acodec": "opus", "vcodec": "none",
+             "abr": 130},
+            {"format_id": "18", "url": "https://m.example/18", "ext": "mp4", "acodec": "mp4a.40.2",
+             "vcodec": "avc1", "height": 360, "tbr": 500},
+        ],
+    }
+
+    def payload(self, **data):
+        return metadata_payload(self.info, **payload_options(data))
+
+    def test_default_keeps_every_key(self):
+        payload = self.payload()
+        self.assertEqual(
+            list(payload), ["title", "thumbnail", "thumbnail_proxy", "uploader", "formats"],
+        )
+        self.assertEqual(
+            [(f["format_id"], f["type"], f["resolution"]) for f in payload["formats"]],
+            [("251", "audio", None), ("18", "video", "360p")],
+        )
+
+    def test_fields(self):
+        self.assertEqual(self.payload(fields="title, uploader"), {"title": "Song", "uploader": None})
+        self.assertEqual(self.payload(fields=["title", "formats.url"]), {
+            "title": "Song", "formats": [{"url": "https://m.example/251"}, {"url": "https://m.example/18"}],
+        })
+        self.assertEqual(self.payload(fields=["nope", 3, ""]), {})
+        # Blank or non-string values mean "all fields"
+        self.assertEqual(self.payload(fields=""), self.payload())
+
+    def test_compact(self):
+        payload = self.payload(compact="true", fields="title,uploader,formats.format_id,formats.resolution")
+        self.assertEqual(payload, {
+            "title": "Song", "formats": [{"format_id": "251"}, {"format_id": "18", "resolution": "360p"}],
+        })
+        self.assertEqual(self.payload(compact="0"), self.payload())
+
+    def test_playlist_tracks_are_shaped(self):
+        playlist = {"title": "List", "uploader": "U", "entries": [self.info, dict(self.info, title="Other")]}
+        payload = metadata_payload(playlist, **payload_options({"fields": "title", "compact": True}))
+        self.assertEqual(payload, {
+            "playlist_title": "List", "uploader": "U", "tracks": [{"title": "Song"}, {"title": "Other"}],
+        })
@@ -0,0 +1,318 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+
+from .metrics import Counter
+from .proxy import UpstreamError, open_upstream
+from .singleflight import SingleFlight
+
+try:
+    from PIL import Image, features
+except ImportError:  # resizing is optional; originals are served as-is without Pillow
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+SIGNING_SALT = "downloader.thumbnail"
+
+THUMBNAIL_CACHE = Counter(
+    "fetchmate_thumbnail_cache_total", "Thumbnail proxy lookups by result.", ("result",),
+)
+PREFETCH_DROPPED = Counter(
+    "fetchmate_thumbnail_prefetch_dropped_total", "Thumbnail prefetches skipped because the queue was full.",
+)
+
+
+def thumbnail_settings():
+    conf = {
+        "ENABLED": True,
+        "ROOT": os.path.join(settings.BASE_DIR, "thumbnails"),
+        "MAX_BYTES": 256 * 1024 ** 2,
+        "WIDTHS": (160, 320, 640),
+        "DEFAULT_WIDTH": 320,
+        "MAX_SOURCE_BYTES": 5 * 1024 ** 2,
+        # Decoded size limit; a small file can still expand to a huge bitmap
+        "MAX_PIXELS": 25 * 1000 ** 2,
+        "QUALITY": 80,
+        "MAX_AGE": 7 * 24 * 3600,
+        "PREFETCH_WORKERS": 4,
+        "PREFETCH_QUEUE": 256,  # images waiting or being fetched; further prefetches are dropped
+    }
+    conf.update(getattr(settings, "DOWNLOADER_THUMBNAILS", {}))
+    return conf
+
+
+class ThumbnailError(Exception):
+    pass
+
+
+def can_resize():
+    return Image is not None
+
+
+def thumbnail_path(source_url):
+    """Signed proxy path for ``source_url``; the signature keeps the endpoint from fetching arbitrary URLs."""
+    if not source_url or thumbnail_cache is None:
+        return None
+    # No timestamp, so the same image always gets the same (browser-cacheable) URL
+    token = signing.Signer(salt=SIGNING_SALT).sign_object(source_url, compress=True)
+    return reverse("thumbnail", args=[token])
+
+
+def source_for(token):
+    try:
+        return signing.Signer(salt=SIGNING_SALT).unsign_object(token)
+    except signing.BadSignature:
+        return None
+
+
+def sniff_type(data):
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:4] == b"GIF8":
+        return "image/gif"
+    return "application/octet-stream"
+
+
+def resize(data, width, quality, max_pixels=25 * 1000 ** 2):
+    """Downscale image bytes to ``width`` and encode as WebP (JPEG if Pillow lacks WebP)."""
+    with Image.open(io.BytesIO(data)) as image:
+        # Only the header is read so far; refuse before decoding a bitmap this large
+        if image.width * image.height > max_pixels:
+            raise ValueError(f"image is {image.width}x{image.height} pixels, over the {max_pixels} limit")
+        image.draft("RGB", (width, width))  # lets JPEG decode at a reduced scale
+        if image.width > width:
+            image.thumbnail((width, image.height * width // image.width))
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        out = io.BytesIO()
+        if features.check("webp"):
+            image.save(out, "WEBP", quality=quality, method=4)
+        else:
+            image.convert("RGB").save(out, "JPEG", quality=quality, optimize=True)
+        return out.getvalue()
+
+
+class ThumbnailCache:
+    """
+    Fetch-once disk cache of thumbnails and their resized variants.
+
+    Originals and variants live under ``root`` keyed by a hash of the
+    source URL; the least recently used files are removed once the total
+    passes ``max_bytes``. Concurrent misses for one image share a fetch.
+    """
+
+    def __init__(self, root, max_bytes, widths, max_source_bytes, quality=80, prefetch_workers=4,
+                 max_pixels=25 * 1000 ** 2, prefetch_queue=256):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.widths = tuple(sorted(widths))
+        self.max_source_bytes = max_source_bytes
+        self.max_pixels = max_pixels
+        self.quality = quality
+        self.prefetch_workers = prefetch_workers
+        self.prefetch_queue = prefetch_queue
+        self._index = None  # path -> size, least recently used first
+        self._total = 0
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self._prefetcher = None
+        self._prefetching = set()
+
+    def key(self, source_url):
+        return hashlib.sha256(source_url.encode()).hexdigest()[:32]
+
+    def path_for(self, key, variant):
+        return os.path.join(self.root, key[:2], f"{key}.{variant}")
+
+    def _load_index(self):
+        entries = []
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+        entries.sort()
+        self._index = OrderedDict((path, size) for _, path, size in entries)
+        self._total = sum(self._index.values())
+
+    def _read(self, path):
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            if path in self._index:
+                self._index.move_to_end(path)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self._total -= self._index.pop(path, 0)
+            return None
+        with self._lock:
+            # Written by another process since the index was loaded
+            if path not in self._index:
+                self._index[path] = len(data)
+                self._total += len(data)
+        try:
+            os.utime(path)  # recency survives a restart
+        except OSError:
+            pass
+        return data
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        evict = []
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            self._total += len(data) - self._index.pop(path, 0)
+            self._index[path] = len(data)
+            while self._total > self.max_bytes and len(self._index) > 1:
+                old, size = self._index.popitem(last=False)
+                self._total -= size
+                evict.append(old)
+        for old in evict:
+            try:
+                os.remove(old)
+            except FileNotFoundError:
+                pass
+
+    def _fetch(self, source_url):
+        upstream = open_upstream(source_url, {"Accept": "image/webp,image/*"})
+        try:
+            content_type = (upstream.header("Content-Type") or "").split(";")[0].strip()
+            if upstream.status != 200 or not content_type.startswith("image/"):
+                raise ThumbnailError(f"source returned {upstream.status} {content_type or 'without a type'}")
+            buf = bytearray()
+            for chunk in upstream:
+                buf += chunk
+                if len(buf) > self.max_source_bytes:
+                    raise ThumbnailError("source image is too large")
+            return bytes(buf)
+        finally:
+            upstream.close()
+
+    def _cached(self, path, produce):
+        data = self._read(path)
+        if data is not None:
+            THUMBNAIL_CACHE.inc(result="hit")
+            return data, True
+        THUMBNAIL_CACHE.inc(result="miss")
+
+        def fill():
+            data = produce()
+            self._write(path, data)
+            return data
+
+        return self._flight.call(path, fill), False
+
+    def original(self, source_url):
+        """Return ``(bytes, cache_hit)`` of the source image, fetching it on a miss."""
+        def fetch():
+            try:
+                return self._fetch(source_url)
+            except UpstreamError as e:
+                raise ThumbnailError(e.message)
+
+        return self._cached(self.path_for(self.key(source_url), "orig"), fetch)
+
+    def get(self, source_url, width=None):
+        """Return ``(bytes, content_type, cache_hit)`` for ``source_url`` at ``width`` (None for the original)."""
+        if width is None or not can_resize():
+            data, hit = self.original(source_url)
+            return data, sniff_type(data), hit
+
+        def render():
+            original, _ = self.original(source_url)
+            try:
+                return resize(original, width, self.quality, self.max_pixels)
+            except (OSError, ValueError, Image.DecompressionBombError) as e:
+                raise ThumbnailError(f"could not decode image: {e}")
+
+        data, hit = self._cached(self.path_for(self.key(source_url), f"w{width}"), render)
+        return data, sniff_type(data), hit
+
+    def nearest_width(self, width):
+        """Snap a requested width to the smallest configured one that covers it."""
+        for candidate in self.widths:
+            if width <= candidate:
+                return candidate
+        return self.widths[-1]
+
+    def prefetch(self, source_urls, width=None):
+        """
+        Warm the cache for ``source_urls`` on background threads.
+
+        Images already on disk or already queued are skipped. Once
+        ``prefetch_queue`` images are pending the rest are dropped: a
+        prefetch is only a head start on requests the client may make.
+        """
+        variant = f"w{width}" if width is not None and can_resize() else "orig"
+        urls = [
+            u for u in dict.fromkeys(u for u in source_urls if u)
+            if not os.path.exists(self.path_for(self.key(u), variant))
+        ]
+        if not urls:
+            return
+        with self._lock:
+            if self._prefetcher is None:
+                self._prefetcher = ThreadPoolExecutor(self.prefetch_workers, thread_name_prefix="thumb-prefetch")
+            urls = [u for u in urls if u not in self._prefetching]
+            room = max(self.prefetch_queue - len(self._prefetching), 0)
+            urls, dropped = urls[:room], len(urls) - room
+            self._prefetching.update(urls)
+        if dropped > 0:
+            PREFETCH_DROPPED.inc(dropped)
+        for url in urls:
+            self._prefetcher.submit(self._prefetch_one, url, width)
+
+    def _prefetch_one(self, source_url, width):
+        try:
+            self.get(source_url, width)
+        except Exception as e:
+            logger.debug("Prefetching thumbnail %s failed: %s", source_url, e)
+        finally:
+            with self._lock:
+                self._prefetching.discard(source_url)
+
+
+def prefetch_thumbnails(source_urls):
+    """Warm the cache, at the default width, for thumbnails a client is about to request."""
+    if thumbnail_cache is None:
+        return
+    width = thumbnail_cache.nearest_width(thumbnail_settings()["DEFAULT_WIDTH"]) if can_resize() else None
+    thumbnail_cache.prefetch(source_urls, width)
+
+
+def build_thumbnail_cache():
+    conf = thumbnail_settings()
+    if not conf["ENABLED"]:
+        return None
+    return ThumbnailCache(
+        conf["ROOT"], conf["MAX_BYTES"], conf["WIDTHS"], conf["MAX_SOURCE_BYTES"],
+        conf["QUALITY"], conf["PREFETCH_WORKERS"], conf["MAX_PIXELS"], conf["PREFETCH_QUEUE"],
+    )
+
+
+thumbnail_cache = build_thumbnail_cache()
@@ -0,0 +1,176 @@
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import connections
+
+from .extraction import ydl_pool
+from .metrics import Counter, Gauge, stage
+
+# Output codec -> the audio format to ask yt-dlp for, so the source is
+# likely to be in that codec already and FFmpeg can stream-copy it.
+CODECS = {
+    "mp3": {"format": "bestaudio[acodec=mp3]/bestaudio/best"},
+    "m4a": {"format": "bestaudio[acodec^=mp4a]/bestaudio/best"},
+    "opus": {"format": "bestaudio[acodec=opus]/bestaudio/best"},
+}
+
+# Lanes, served lowest first: a single track someone is waiting on beats bulk work
+PRIORITY_SINGLE = 0
+PRIORITY_PLAYLIST = 1
+
+TRANSCODES = Counter(
+    "fetchmate_transcodes_total", "Audio conversions by output codec and whether FFmpeg re-encoded.",
+    ("codec", "method"),
+)
+
+
+def transcode_settings():
+    conf = {
+        "WORKERS": os.cpu_count() or 2,
+        "DEFAULT_CODEC": "mp3",
+        # Bitrate in kbit/s per codec when the client does not pick one
+        "DEFAULT_QUALITY": {"mp3": "192", "m4a": "192", "opus": "128"},
+        "MIN_QUALITY": 64,
+        "MAX_QUALITY": 320,
+    }
+    conf.update(getattr(settings, "DOWNLOADER_TRANSCODE", {}))
+    return conf
+
+
+def audio_target(codec=None, quality=None):
+    """
+    Validate a requested output codec and bitrate, filling in defaults.
+
+    Returns ``(codec, quality)`` as strings, the form used in artifact
+    keys; raises ``ValueError`` with a client-facing message otherwise.
+    """
+    conf = transcode_settings()
+    codec = (codec or conf["DEFAULT_CODEC"]).lower()
+    if codec == "aac":
+        codec = "m4a"
+    if codec not in CODECS:
+        raise ValueError(f"audio_codec must be one of: {', '.join(CODECS)}")
+    if not quality:
+        return codec, conf["DEFAULT_QUALITY"][codec]
+    try:
+        kbps = int(str(quality).lower().rstrip("k"))
+    except ValueError:
+        raise ValueError("audio_quality must be a bitrate in kbit/s, e.g. 192")
+    if not conf["MIN_QUALITY"] <= kbps <= conf["MAX_QUALITY"]:
+        raise ValueError(f"audio_quality must be between {conf['MIN_QUALITY']} and {conf['MAX_QUALITY']}")
+    return codec, str(kbps)
+
+
+def download_format(codec):
+    return CODECS[codec]["format"]
+
+
+def transcode(download, codec, quality, host="", mode=""):
+    """
+    Convert a finished yt-dlp download to ``codec`` in place and return its new path.
+
+    yt-dlp's postprocessor probes the file and stream-copies when its codec
+    already matches, re-encoding otherwise; the source file is removed
+    either way.
+    """
+    from yt_dlp.postprocessor import FFmpegExtractAudioPP
+
+    acodecs = []
+    with ydl_pool.lend("metadata") as ydl, stage("transcode", host, mode):
+        pp = FFmpegExtractAudioPP(ydl, preferredcodec=codec, preferredquality=quality)
+        run_ffmpeg = pp.run_ffmpeg
+
+        def record(path, out_path, acodec, more_opts):
+            # Count the method the postprocessor chose, not a guess from metadata
+            acodecs.append(acodec)
+            return run_ffmpeg(path, out_path, acodec, more_opts)
+
+        pp.run_ffmpeg = record
+        to_delete, download = pp.run(download)
+    TRANSCODES.inc(codec=codec, method="encode" if any(a != "copy" for a in acodecs) else "copy")
+    for path in to_delete:
+        if os.path.exists(path):
+            os.remove(path)
+    return download["filepath"]
+
+
+class TranscodePool:
+    """
+    A fixed set of threads running FFmpeg jobs, in priority order.
+
+    Every conversion in the process goes through one pool sized to the
+    CPU count, so concurrent requests and playlists queue for cores
+    instead of oversubscribing them. Lower ``priority`` values run first
+    and jobs of the same priority run in submission order.
+    """
+
+    def __init__(self, workers):
+        self.size = workers
+        self._queue = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._busy = 0
+        self._threads = []
+
+    def submit(self, fn, *args, priority=PRIORITY_SINGLE, **kwargs):
+        """Queue ``fn(*args, **kwargs)``; returns a ``Future`` that can be cancelled while queued."""
+        future = Future()
+        run = contextvars.copy_context().run
+        with self._cond:
+            self._start()
+            heapq.heappush(self._queue, (priority, next(self._order), future, run, fn, args, kwargs))
+            self._cond.notify()
+        return future
+
+    def _start(self):
+        while len(self._threads) < self.size:
+            thread = threading.Thread(target=self._work, daemon=True, name=f"transcode-{len(self._threads)}")
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                _, _, future, run, fn, args, kwargs = heapq.heappop(self._queue)
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self._busy += 1
+            try:
+                future.set_result(run(fn, *args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                connections.close_all()
+                with self._cond:
+                    self._busy -= 1
+
+    def queued(self, priority=None):
+        with self._cond:
+            return sum(1 for job in self._queue if priority is None or job[0] == priority)
+
+    @property
+    def busy(self):
+        return self._busy
+
+
+def build_transcode_pool():
+    return TranscodePool(transcode_settings()["WORKERS"])
+
+
+transcode_pool = build_transcode_pool()
+
+Gauge(
+    "fetchmate_transcode_queue", "FFmpeg jobs running and waiting, by lane.", ("state",),
+    collect=lambda: {
+        ("running",): transcode_pool.busy,
+        ("single",): transcode_pool.queued(PRIORITY_SINGLE),
+        ("playlist",): transcode_pool.queued(PRIORITY_PLAYLIST),
+    },
+)
@@ -1,7 +1,13 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     path('fetch/', views.fetch_link, name='fetch_link'),
+    path('fetch/async/', async_views.fetch_link_async, name='fetch_link_async'),
+    path('fetch/batch/', views.fetch_batch, name='fetch_batch'),
+    path('stream/', views.stream_format, name='stream_format'),
+    path('thumbnail/<str:token>/', views.thumbnail, name='thumbnail'),
+    path('jobs/', views.create_job, name='create_job'),
+    path('jobs/<uuid:job_id>/', views.job_status, name='job_status'),
+    path('jobs/<uuid:job_id>/result/', views.job_result, name='job_result'),
 ]
-
@@ -1,158 +1,288 @@
 import os
-import tempfile
-import yt_dlp
-import re
 import logging
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from contextlib import ExitStack
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
-from django.http import FileResponse
-from zipfile import ZipFile
-import shutil
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare
+from . import jobs
+from .admission import RateLimited, check_active_jobs, rate_limiter
+from .batch import batch_settings, ndjson_lines, resolve_batch, stream_playlist
+from .cache import url_host
+from .delivery import serve_file
+from .downloads import PlaylistRun, download_mp3, stream_playlist_zip
+from .extraction import download_error_message, extract_metadata, output_files
+from .formats import parse_flag
+from .hosts import HostUnavailable
+from .lazy import download_error
+from .metrics import REGISTRY, metrics_settings, record_error, tag_request
+from .models import DownloadJob
+from .payloads import is_youtube_music_url, metadata_payload, payload_options
+from .playlist import enumerate_playlist, playlist_settings
+from .proxy import UpstreamError, open_format, stream_response
+from .serializers import DownloadJobSerializer
+from .thumbnails import ThumbnailError, can_resize, prefetch_thumbnails, source_for, thumbnail_cache, thumbnail_settings
+from .transcode import audio_target
+from .workspace import QuotaExceeded, StorageUnavailable
 
 logger = logging.getLogger(__name__)
 
-def sanitize_filename(name):
-    return re.sub(r'[\\/*?:"<>|]', "", name)
+def rate_limited_response(error):
+    return Response({"error": error.message}, status=429, headers={"Retry-After": str(error.retry_after)})
+
+def unavailable_response(error):
+    return Response({"error": error.message}, status=503, headers={"Retry-After": str(error.retry_after)})
+
+def admit(user, kind, cost=1):
+    if rate_limiter:
+        rate_limiter.check(user, kind, cost)
+
+def mp3_response(request, download, work_dir, release):
+    # Files in work_dir may be shared with coalesced requests; release()
+    # drops our claim on them once the response has been fully sent.
+    if isinstance(download, PlaylistRun):
+        response = StreamingHttpResponse(stream_playlist_zip(download, on_close=release), content_type="application/zip")
+        response["Content-Disposition"] = 'attachment; filename="playlist.zip"'
+        return response
+
+    outputs = list(output_files(download, work_dir))
+    if not outputs:
+        release()
+        return JsonResponse({"error": "Failed to convert the audio. This may require login/cookies."}, status=400)
+
+    mp3_file, filename = outputs[0]
+    artifact_path = download["requested_downloads"][0].get("artifact_path")
+    if artifact_path and os.path.exists(artifact_path):
+        return serve_file(request, artifact_path, filename, on_close=release, persistent=True)
+    return serve_file(request, mp3_file, filename, on_close=release)
+
+def playlist_stream_response(request, url):
+    conf = playlist_settings()
+    try:
+        offset = max(int(request.data.get("offset", 0)), 0)
+        limit = min(max(int(request.data.get("limit", conf["PAGE_SIZE"])), 1), conf["MAX_PAGE_SIZE"])
+    except (TypeError, ValueError):
+        return Response({"error": "offset and limit must be integers"}, status=400)
+
+    prefs = payload_options(request.data)
+    info = enumerate_playlist(url, offset + 1, offset + limit)
+    if "entries" not in info:
+        return Response(metadata_payload(info, is_youtube_music_url(url), **prefs))
+    return StreamingHttpResponse(ndjson_lines(stream_playlist(info, offset, limit, prefs)), content_type="application/x-ndjson")
 
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def fetch_link(request):
     url = request.data.get("url")
-    convert_mp3 = request.data.get("convert_mp3", False)
+    convert_mp3 = parse_flag(request.data.get("convert_mp3", False))
+    stream = parse_flag(request.data.get("stream", False))
 
     if not url:
         return Response({"error": "URL is required"}, status=400)
 
-    tmp_dir = tempfile.mkdtemp()
+    mode = "mp3" if convert_mp3 else "stream" if stream else "metadata"
+    tag_request(host=url_host(url), mode=mode)
 
-    try:
-        original_url = url
-        if "music.youtube.com" in url.lower():
-            url = url.replace("music.youtube.com", "www.youtube.com")
+    if convert_mp3:
+        try:
+            codec, quality = audio_target(request.data.get("audio_codec"), request.data.get("audio_quality"))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
 
-        is_youtube_music = "music.youtube.com" in original_url.lower()
+    try:
+        admit(request.user, "download" if convert_mp3 else "metadata")
+        if convert_mp3:
+            claim = ExitStack()
+            download, work_dir = claim.enter_context(download_mp3(url, request.user.pk, codec, quality))
+            return mp3_response(request, download, work_dir, claim.close)
 
-        ydl_opts = {
-            "format": "bestaudio/best" if convert_mp3 else "best",
-            "outtmpl": os.path.join(tmp_dir, "%(title)s.%(ext)s"),
-            "quiet": True,
-            "no_warnings": True,
-            "noplaylist": False,
-        }
+        if stream:
+            return playlist_stream_response(request, url)
 
-        if convert_mp3:
-            ydl_opts["postprocessors"] = [{
-                "key": "FFmpegExtractAudio",
-                "preferredcodec": "mp3",
-                "preferredquality": "192",
-            }]
-
-        # ✅ Check for cookies.txt and only include if exists
-        backend_root = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../"))
-        cookies_path = os.path.join(backend_root, "cookies.txt")
-        if os.path.exists(cookies_path):
-            ydl_opts["cookiefile"] = cookies_path
-        else:
-            logger.info("No cookies.txt found, will only download public videos.")
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=convert_mp3)
-
-        # Playlist handling
+        info = extract_metadata(url)
+        payload = metadata_payload(info, is_youtube_music_url(url), **payload_options(request.data))
         if "entries" in info:
-            if convert_mp3:
-                zip_path = os.path.join(tmp_dir, "playlist.zip")
-                with ZipFile(zip_path, "w") as zipf:
-                    for entry in info["entries"]:
-                        filename = sanitize_filename(f"{entry['title']}.mp3")
-                        file_path = os.path.join(tmp_dir, filename)
-                        if os.path.exists(file_path):
-                            zipf.write(file_path, arcname=filename)
-                return FileResponse(open(zip_path, "rb"), as_attachment=True, filename="playlist.zip")
-            else:
-                tracks = [{
-                    "title": e.get("title"),
-                    "uploader": e.get("uploader"),
-                    "thumbnail": e.get("thumbnail"),
-                    "formats": e.get("formats", [])
-                } for e in info["entries"]]
-                return Response({
-                    "playlist_title": info.get("title"),
-                    "uploader": info.get("uploader"),
-                    "tracks": tracks
-                })
-
-        # Single video/audio
-        if convert_mp3:
-            filename = sanitize_filename(f"{info['title']}.mp3")
-            mp3_file = os.path.join(tmp_dir, filename)
-            if not os.path.exists(mp3_file):
-                return Response({"error": "Failed to convert to MP3. This may require login/cookies."}, status=400)
-            return FileResponse(open(mp3_file, "rb"), as_attachment=True, filename=filename)
-
-        raw_formats = info.get("formats", []) or []
-
-        if is_youtube_music:
-            audio_only = sorted([
-                {
-                    "url": f.get("url"),
-                    "ext": "m4a",
-                    "type": "audio",
-                    "bitrate": f.get("abr"),
-                    "size": f.get("filesize") or f.get("filesize_approx"),
-                    "resolution": None,
-                } for f in raw_formats if f.get("acodec") != "none" and f.get("vcodec") == "none"
-            ], key=lambda x: -(x.get("bitrate") or 0))
-            return Response({
-                "title": info.get("title"),
-                "thumbnail": info.get("thumbnail"),
-                "uploader": info.get("uploader"),
-                "format_label": "AUTO",
-                "formats": audio_only[:3]
-            })
-
-        audio_candidates = [
-            {
-                "url": f.get("url"),
-                "ext": f.get("ext"),
-                "type": "audio",
-                "bitrate": f.get("abr"),
-                "size": f.get("filesize") or f.get("filesize_approx"),
-                "resolution": None,
-            } for f in raw_formats if f.get("vcodec") == "none" and f.get("acodec") != "none"
-        ]
-
-        video_candidates = [
-            {
-                "url": f.get("url"),
-                "ext": f.get("ext"),
-                "type": "video",
-                "resolution": f"{f.get('height')}p" if f.get("height") else None,
-                "size": f.get("filesize") or f.get("filesize_approx"),
-                "bitrate": f.get("abr"),
-            } for f in raw_formats if f.get("vcodec") != "none" and f.get("acodec") != "none"
-        ]
-
-        return Response({
-            "title": info.get("title"),
-            "thumbnail": info.get("thumbnail"),
-            "uploader": info.get("uploader"),
-            "formats": audio_candidates[:2] + video_candidates[:5]
-        })
-
-    except yt_dlp.utils.DownloadError as e:
-        msg = str(e)
-        if "Sign in to confirm" in msg:
-            return Response({
-                "error": "This video requires login/cookies. Only public videos are downloadable."
-            }, status=400)
-        logger.warning("YT-DLP download error: %s", e)
-        return Response({"error": "Failed to download the video/audio"}, status=400)
+            prefetch_thumbnails(e.get("thumbnail") for e in info["entries"])
+        return Response(payload)
+
+    except download_error() as e:
+        record_error(e, url_host(url))
+        if "Sign in to confirm" not in str(e):
+            logger.warning("YT-DLP download error: %s", e)
+        return Response({"error": download_error_message(e)}, status=400)
+
+    except RateLimited as e:
+        return rate_limited_response(e)
+
+    except (StorageUnavailable, HostUnavailable) as e:
+        return unavailable_response(e)
+
+    except QuotaExceeded as e:
+        return Response({"error": str(e)}, status=400)
 
     except Exception as e:
         logger.error("Unexpected error in fetch_link: %s", e)
         return Response({"error": "Failed to process the link"}, status=400)
 
-    finally:
-        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def fetch_batch(request):
+    urls = request.data.get("urls")
+    max_urls = batch_settings()["MAX_URLS"]
+
+    if not isinstance(urls, list) or not urls or not all(isinstance(u, str) and u for u in urls):
+        return Response({"error": "urls must be a non-empty list of links"}, status=400)
+    if len(urls) > max_urls:
+        return Response({"error": f"At most {max_urls} links per batch"}, status=400)
+    try:
+        admit(request.user, "metadata", cost=len(urls))
+    except RateLimited as e:
+        return rate_limited_response(e)
+
+    tag_request(mode="batch")
+    # One NDJSON line per link, in the order they finish
+    return StreamingHttpResponse(ndjson_lines(resolve_batch(urls, prefs=payload_options(request.data))), content_type="application/x-ndjson")
+
+
+# ======================
+# Proxy streaming
+# ======================
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def stream_format(request):
+    url = request.query_params.get("url")
+    if not url:
+        return Response({"error": "URL is required"}, status=400)
+
+    tag_request(host=url_host(url), mode="proxy")
+    try:
+        admit(request.user, "stream")
+        info, f, upstream = open_format(url, request.query_params.get("format_id"), request.headers)
+        return stream_response(info, f, upstream)
+
+    except download_error() as e:
+        record_error(e, url_host(url))
+        return Response({"error": download_error_message(e)}, status=400)
+
+    except RateLimited as e:
+        return rate_limited_response(e)
+
+    except HostUnavailable as e:
+        return unavailable_response(e)
+
+    except UpstreamError as e:
+        logger.warning("Proxy stream of %s failed: %s", url, e)
+        return Response({"error": e.message}, status=e.status)
+
+
+# ======================
+# Thumbnails
+# ======================
+@api_view(["GET"])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def thumbnail(request, token):
+    # No auth: <img> tags cannot send a token, and the signed link only
+    # ever names a thumbnail URL the server itself handed out.
+    if thumbnail_cache is None:
+        raise Http404
+    source_url = source_for(token)
+    if source_url is None:
+        return Response({"error": "Invalid thumbnail link"}, status=404)
+
+    conf = thumbnail_settings()
+    width = None
+    if can_resize():
+        try:
+            width = thumbnail_cache.nearest_width(int(request.query_params.get("w", conf["DEFAULT_WIDTH"])))
+        except ValueError:
+            return Response({"error": "w must be an integer"}, status=400)
+
+    tag_request(host=url_host(source_url), mode="thumbnail")
+    etag = f'"{thumbnail_cache.key(source_url)}-{width or "orig"}"'
+    cache_control = f"public, max-age={conf['MAX_AGE']}, immutable"
+    if etag in [t.strip() for t in request.headers.get("If-None-Match", "").split(",")]:
+        response = HttpResponse(status=304)
+    else:
+        try:
+            data, content_type, hit = thumbnail_cache.get(source_url, width)
+        except ThumbnailError as e:
+            logger.warning("Thumbnail %s failed: %s", source_url, e)
+            return Response({"error": "Could not load the thumbnail"}, status=502)
+        response = HttpResponse(data, content_type=content_type)
+        response["X-Cache"] = "HIT" if hit else "MISS"
+    response["ETag"] = etag
+    response["Cache-Control"] = cache_control
+    return response
+
+
+# ======================
+# Download jobs
+# ======================
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def create_job(request):
+    url = request.data.get("url")
+    convert_mp3 = parse_flag(request.data.get("convert_mp3", True))
+
+    if not url:
+        return Response({"error": "URL is required"}, status=400)
+
+    try:
+        admit(request.user, "download")
+        check_active_jobs(request.user)
+    except RateLimited as e:
+        return rate_limited_response(e)
+
+    try:
+        job = jobs.enqueue(
+            request.user, url, convert_mp3=convert_mp3,
+            codec=request.data.get("audio_codec"), quality=request.data.get("audio_quality"),
+        )
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+    return Response({
+        "job_id": str(job.pk),
+        "status": job.status,
+        "status_url": reverse("job_status", args=[job.pk]),
+        "result_url": reverse("job_result", args=[job.pk]),
+    }, status=202)
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def job_status(request, job_id):
+    job = get_object_or_404(DownloadJob, pk=job_id, user_id=request.user.pk)
+    return Response(DownloadJobSerializer(job).data)
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def job_result(request, job_id):
+    job = get_object_or_404(DownloadJob, pk=job_id, user_id=request.user.pk)
+    if job.status == DownloadJob.STATUS_FAILED:
+        return Response({"error": job.error or "Job failed"}, status=400)
+    if job.status != DownloadJob.STATUS_FINISHED:
+        return Response({"error": "Job is not finished yet", "status": job.status}, status=409)
+    if not os.path.exists(job.result_path):
+        return Response({"error": "Result has expired"}, status=410)
+    tag_request(host=url_host(job.url), mode="job")
+    return serve_file(request, job.result_path, job.result_name, persistent=True)
+
+
+# ======================
+# Metrics
+# ======================
+def metrics_view(request):
+    """Prometheus text exposition of this process's metrics."""
+    conf = metrics_settings()
+    if not conf["ENABLED"]:
+        raise Http404
+    token = conf["TOKEN"]
+    if token and not constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return HttpResponse(status=401)
+    return HttpResponse(REGISTRY.expose(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,271 @@
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+from .metrics import ADMISSION_REJECTIONS, dir_size
+
+logger = logging.getLogger(__name__)
+
+LEASE_FILE = ".lease"
+
+
+def workspace_settings():
+    conf = {
+        "ROOT": os.path.join(settings.BASE_DIR, "work"),
+        "MAX_BYTES": 20 * 1024 ** 3,  # across live workspaces, each counted as max(reserve, written)
+        "JOB_MAX_BYTES": 2 * 1024 ** 3,
+        "RESERVE_BYTES": 256 * 1024 ** 2,  # expected size reserved when allocating
+        "MIN_FREE_BYTES": 1024 ** 3,
+        "TMPFS_ROOT": "",  # e.g. /dev/shm/fetchmate; used for small jobs when set
+        "TMPFS_MAX_BYTES": 512 * 1024 ** 2,
+        "TMPFS_JOB_MAX_BYTES": 128 * 1024 ** 2,
+        "STALE_AFTER": 15 * 60,
+        "SWEEP_INTERVAL": 5 * 60,
+        # Start the sweeper when a serving process loads the app, not on the first allocation
+        "SWEEP_ON_START": True,
+    }
+    conf.update(getattr(settings, "DOWNLOADER_WORKSPACE", {}))
+    return conf
+
+
+class StorageUnavailable(Exception):
+    """Not enough disk (or quota) to start another job right now."""
+
+    def __init__(self, message, retry_after=30):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+
+
+class QuotaExceeded(Exception):
+    """A job wrote more than its workspace allows."""
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Workspace:
+    """
+    A job's private working directory with a byte quota.
+
+    It counts against the manager's budget as its reservation until the
+    job has written more than that; ``used`` is refreshed by ``check``.
+    """
+
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self, manager, path, reserve, quota, on_tmpfs=False):
+        self.manager = manager
+        self.path = path
+        self.reserve = reserve
+        self.quota = quota
+        self.on_tmpfs = on_tmpfs
+        self.released = False
+        self.used = 0
+        self._last_check = 0.0
+
+    @property
+    def charge(self):
+        return max(self.reserve, self.used)
+
+    def usage(self):
+        return dir_size(self.path)
+
+    def check(self):
+        self.used = self.usage()
+        if self.quota and self.used > self.quota:
+            raise QuotaExceeded(f"Download exceeds the {self.quota // 1024 ** 2} MiB limit")
+        if self.manager.over_budget(self.on_tmpfs):
+            raise QuotaExceeded("Server is out of space for downloads, try again later")
+
+    def progress_hook(self, d):
+        """yt-dlp progress hook aborting the download once the quota is exceeded."""
+        now = time.monotonic()
+        if d.get("status") == "finished" or now - self._last_check >= self.CHECK_INTERVAL:
+            self._last_check = now
+            self.check()
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.manager._forget(self)
+
+
+class WorkspaceManager:
+    """
+    Allocates per-job directories under ``root`` (or ``tmpfs_root``).
+
+    Allocation reserves ``reserve_bytes`` against ``max_bytes`` and checks
+    the filesystem still has ``min_free_bytes`` spare, refusing with
+    ``StorageUnavailable`` otherwise. Workspaces that grow past their
+    reservation are charged what they wrote, and a download that pushes
+    the total over ``max_bytes`` is aborted with ``QuotaExceeded``. Each directory carries a lease with
+    the owner's host and pid that a background thread keeps fresh; the
+    sweeper removes directories whose owner died or whose lease went stale,
+    so crashed workers do not leak disk.
+    """
+
+    def __init__(self, root, max_bytes, job_max_bytes, reserve_bytes, min_free_bytes,
+                 tmpfs_root="", tmpfs_max_bytes=0, tmpfs_job_max_bytes=0, stale_after=900, sweep_interval=300):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.job_max_bytes = job_max_bytes
+        self.reserve_bytes = reserve_bytes
+        self.min_free_bytes = min_free_bytes
+        self.tmpfs_root = tmpfs_root
+        self.tmpfs_max_bytes = tmpfs_max_bytes
+        self.tmpfs_job_max_bytes = tmpfs_job_max_bytes
+        self.stale_after = stale_after
+        self.sweep_interval = sweep_interval
+        self.host = socket.gethostname()
+        self._live = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._thread_pid = None
+
+    @property
+    def roots(self):
+        return [r for r in (self.root, self.tmpfs_root) if r]
+
+    def _charged(self, on_tmpfs):
+        return sum(w.charge for w in self._live if w.on_tmpfs == on_tmpfs)
+
+    def over_budget(self, on_tmpfs=False):
+        with self._lock:
+            return self._charged(on_tmpfs) > (self.tmpfs_max_bytes if on_tmpfs else self.max_bytes)
+
+    def allocate(self, prefix="job", small=False):
+        """Create a workspace; ``small`` jobs go to tmpfs when it is configured and has room."""
+        self.start()
+        with self._lock:
+            on_tmpfs = bool(
+                small and self.tmpfs_root
+                and self._charged(True) + self.reserve_bytes <= self.tmpfs_max_bytes
+            )
+            root = self.tmpfs_root if on_tmpfs else self.root
+            if not on_tmpfs:
+                if self._charged(False) + self.reserve_bytes > self.max_bytes:
+                    ADMISSION_REJECTIONS.inc(reason="disk_quota")
+                    raise StorageUnavailable("Too many downloads in progress, try again shortly")
+                os.makedirs(root, exist_ok=True)
+                if shutil.disk_usage(root).free - self.reserve_bytes < self.min_free_bytes:
+                    logger.warning("Workspace root %s is low on disk space", root)
+                    ADMISSION_REJECTIONS.inc(reason="disk_pressure")
+                    raise StorageUnavailable("Server is low on disk space, try again later", retry_after=120)
+
+            path = os.path.join(root, f"{prefix}-{uuid.uuid4().hex}")
+            os.makedirs(path)
+            quota = self.tmpfs_job_max_bytes if on_tmpfs else self.job_max_bytes
+            workspace = Workspace(self, path, self.reserve_bytes, quota, on_tmpfs)
+            self._write_lease(path)
+            self._live.add(workspace)
+        return workspace
+
+    def _forget(self, workspace):
+        with self._lock:
+            self._live.discard(workspace)
+
+    def _write_lease(self, path):
+        with open(os.path.join(path, LEASE_FILE), "w") as f:
+            f.write(f"{self.host} {os.getpid()}\n")
+
+    def heartbeat(self):
+        with self._lock:
+            paths = [w.path for w in self._live]
+        now = time.time()
+        for path in paths:
+            try:
+                os.utime(os.path.join(path, LEASE_FILE), (now, now))
+            except OSError:
+                pass
+
+    def is_stale(self, path):
+        lease = os.path.join(path, LEASE_FILE)
+        try:
+            with open(lease) as f:
+                host, pid = f.read().split()
+            if host == self.host and not pid_alive(int(pid)):
+                return True
+            mtime = os.path.getmtime(lease)
+        except (OSError, ValueError):
+            # Missing or half-written lease: fall back to the directory's age
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                return False
+        return time.time() - mtime > self.stale_after
+
+    def sweep(self):
+        """Remove directories left behind by dead or stuck workers; returns how many."""
+        with self._lock:
+            live = {w.path for w in self._live}
+        removed = 0
+        for root in self.roots:
+            try:
+                names = os.listdir(root)
+            except FileNotFoundError:
+                continue
+            for name in names:
+                path = os.path.join(root, name)
+                if path in live or not os.path.isdir(path) or not self.is_stale(path):
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        if removed:
+            logger.info("Swept %s stale workspaces", removed)
+        return removed
+
+    def start(self):
+        """
+        Sweep once and start the heartbeat/sweep thread (idempotent).
+
+        A process forked after ``start`` (gunicorn ``--preload``) inherits
+        the thread object but not the thread, so it starts its own.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread_pid == os.getpid():
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True, name="workspace-sweeper")
+            self._thread_pid = os.getpid()
+        self.sweep()
+        self._thread.start()
+
+    def _run(self):
+        heartbeat_every = max(min(60, self.stale_after / 3), 1)
+        last_sweep = time.monotonic()
+        while True:
+            time.sleep(heartbeat_every)
+            try:
+                self.heartbeat()
+                if time.monotonic() - last_sweep >= self.sweep_interval:
+                    last_sweep = time.monotonic()
+                    self.sweep()
+            except Exception as e:
+                logger.error("Workspace sweeper failed: %s", e)
+
+
+def build_workspace_manager():
+    conf = workspace_settings()
+    return WorkspaceManager(
+        conf["ROOT"], conf["MAX_BYTES"], conf["JOB_MAX_BYTES"], conf["RESERVE_BYTES"], conf["MIN_FREE_BYTES"],
+        conf["TMPFS_ROOT"], conf["TMPFS_MAX_BYTES"], conf["TMPFS_JOB_MAX_BYTES"],
+        conf["STALE_AFTER"], conf["SWEEP_INTERVAL"],
+    )
+
+
+workspaces = build_workspace_manager()
@@ -0,0 +1,167 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def ydl_pool_settings():
+    conf = {
+        "MAX_IDLE": 8,  # idle instances kept per profile; 0 disables pooling
+        "WARMUP": False,  # load and prime yt-dlp when the app starts instead of on the first request
+    }
+    conf.update(getattr(settings, "DOWNLOADER_YDL_POOL", {}))
+    return conf
+
+
+class YDLPool:
+    """
+    Lends reusable ``YoutubeDL`` instances, one pool per option profile.
+
+    A returned instance keeps its instantiated extractors and its request
+    handlers, so later calls reuse open HTTP connections to the same hosts.
+    Every instance shares one cookie jar loaded from ``cookies_path``; when
+    the file's mtime changes the jar and all idle instances are dropped.
+    Cookies are treated as read-only input and never written back.
+
+    ``ydl_class`` may be a dotted path; it is imported when the first
+    instance is created, so yt-dlp is not loaded before it is needed.
+    """
+
+    def __init__(self, profiles, cookies_path, max_idle=8, ydl_class="yt_dlp.YoutubeDL"):
+        self.profiles = profiles
+        self.cookies_path = cookies_path
+        self.max_idle = max_idle
+        self.ydl_class = ydl_class
+        self._idle = {name: [] for name in profiles}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._cookies_mtime = self._mtime()
+        self._cookiejar = None
+
+    def _mtime(self):
+        try:
+            return os.stat(self.cookies_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _check_cookies(self):
+        """Invalidate everything if cookies.txt changed; returns the stale idle instances."""
+        mtime = self._mtime()
+        if mtime == self._cookies_mtime:
+            return []
+        logger.info("cookies.txt changed, reloading yt-dlp instances")
+        self._cookies_mtime = mtime
+        self._cookiejar = None
+        self._generation += 1
+        stale = [ydl for idle in self._idle.values() for ydl in idle]
+        for idle in self._idle.values():
+            idle.clear()
+        return stale
+
+    def _create(self, profile):
+        if isinstance(self.ydl_class, str):
+            self.ydl_class = import_string(self.ydl_class)
+        ydl = self.ydl_class(self.profiles[profile]())
+        with self._lock:
+            jar = self._cookiejar
+        if jar is None:
+            jar = ydl.cookiejar
+            with self._lock:
+                self._cookiejar = self._cookiejar or jar
+                jar = self._cookiejar
+        # cookiejar is a cached property; handlers built later pick this one up
+        ydl.__dict__["cookiejar"] = jar
+        return ydl
+
+    def _acquire(self, profile):
+        with self._lock:
+            stale = self._check_cookies()
+            generation = self._generation
+            ydl = self._idle[profile].pop() if self._idle[profile] else None
+        for old in stale:
+            self._discard(old)
+        return ydl or self._create(profile), generation
+
+    def _release(self, profile, ydl, generation):
+        with self._lock:
+            if generation == self._generation and len(self._idle[profile]) < self.max_idle:
+                self._idle[profile].append(ydl)
+                return
+        self._discard(ydl)
+
+    def _discard(self, ydl):
+        # Without a cookiefile, close() skips saving the shared jar to disk
+        ydl.params.pop("cookiefile", None)
+        try:
+            ydl.close()
+        except Exception as e:
+            logger.debug("Error closing yt-dlp instance: %s", e)
+
+    @contextmanager
+    def lend(self, profile, tmp_dir=None, progress_hooks=None, postprocessor_hooks=None, **params):
+        """
+        Borrow an instance of ``profile`` for the duration of the block.
+
+        ``tmp_dir`` sets where files are written, progress and postprocessor
+        hooks are attached for this use only, and extra ``params`` override
+        options until the instance is returned.
+        """
+        ydl, generation = self._acquire(profile)
+        saved = {key: ydl.params.get(key, _MISSING) for key in params}
+        outtmpl = ydl.params["outtmpl"]
+        hooks = list(ydl._progress_hooks)
+        pp_hooks = list(ydl._postprocessor_hooks)
+        # add_postprocessor_hook also attaches the hook to every registered postprocessor
+        pps = {pp: list(pp._progress_hooks) for pps in ydl._pps.values() for pp in pps}
+
+        ydl.params.update(params)
+        if tmp_dir:
+            ydl.params["outtmpl"] = dict(outtmpl, default=os.path.join(tmp_dir, os.path.basename(outtmpl["default"])))
+        for hook in progress_hooks or ():
+            ydl.add_progress_hook(hook)
+        for hook in postprocessor_hooks or ():
+            ydl.add_postprocessor_hook(hook)
+        try:
+            yield ydl
+        finally:
+            for key, value in saved.items():
+                if value is _MISSING:
+                    ydl.params.pop(key, None)
+                else:
+                    ydl.params[key] = value
+            ydl.params["outtmpl"] = outtmpl
+            ydl._progress_hooks[:] = hooks
+            ydl._postprocessor_hooks[:] = pp_hooks
+            for pp, saved_hooks in pps.items():
+                pp._progress_hooks[:] = saved_hooks
+            ydl._num_downloads = 0
+            ydl._download_retcode = 0
+            self._release(profile, ydl, generation)
+
+    def warm(self, *profiles):
+        """Create one idle instance per profile (all by default) ahead of traffic."""
+        for profile in profiles or self.profiles:
+            with self.lend(profile) as ydl:
+                ydl.get_info_extractor("Youtube")
+
+    def cookie_header(self, url):
+        """Cookie header for ``url`` from the shared jar, or None."""
+        if self._mtime() is None:
+            return None
+        with self.lend("metadata") as ydl:
+            return ydl.cookiejar.get_cookie_header(url) or None
+
+    def clear(self):
+        with self._lock:
+            stale = [ydl for idle in self._idle.values() for ydl in idle]
+            for idle in self._idle.values():
+                idle.clear()
+        for ydl in stale:
+            self._discard(ydl)
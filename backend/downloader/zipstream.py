@@ -0,0 +1,63 @@
+import os
+from zipfile import ZIP_STORED, ZipFile, ZipInfo
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _StreamSink:
+    """Write-only file object collecting ZipFile output until it is drained."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        if data:
+            self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+
+def stream_zip(members, chunk_size=CHUNK_SIZE):
+    """
+    Generate a ZIP archive as a stream of byte chunks.
+
+    ``members`` yields ``(arcname, source)`` pairs, where ``source`` is a
+    file path or ``bytes``. Members are STORED (MP3s do not deflate) and
+    written as soon as they are yielded, so the first bytes go out before
+    later members exist. The sink is not seekable, so ZipFile emits data
+    descriptors and switches to ZIP64 for large members and archives.
+    """
+    sink = _StreamSink()
+    with ZipFile(sink, "w", compression=ZIP_STORED, allowZip64=True) as zipf:
+        for arcname, source in members:
+            if isinstance(source, bytes):
+                zipf.writestr(arcname, source)
+            else:
+                zinfo = ZipInfo.from_file(source, arcname)
+                zinfo.compress_type = ZIP_STORED
+                with open(source, "rb") as src, zipf.open(zinfo, "w") as dst:
+                    while True:
+                        chunk = src.read(chunk_size)
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                        yield from sink.drain()
+            yield from sink.drain()
+    yield from sink.drain()
+
+
+def unique_arcname(name, used):
+    """Return ``name``, suffixed with `` (n)`` if it is already in ``used``."""
+    base, ext = os.path.splitext(name)
+    candidate, n = name, 1
+    while candidate in used:
+        candidate = f"{base} ({n}){ext}"
+        n += 1
+    used.add(candidate)
+    return candidate
@@ -0,0 +1,119 @@
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+
+def auth_settings():
+    conf = {
+        # Seconds a user's active flag and role are trusted before being re-read;
+        # deactivating or demoting a user takes at most this long to apply.
+        "STATE_TTL": 30,
+        "MAX_ENTRIES": 10000,
+    }
+    conf.update(getattr(settings, "USERS_AUTH", {}))
+    return conf
+
+
+class ClaimsUser(TokenUser):
+    """
+    The user behind a validated access token, built without loading the row.
+
+    ``pk`` and ``id`` come from the token, ``is_active`` and ``role`` from
+    the state cache. Code that needs the model instance (or a foreign key
+    value) should use ``pk`` rather than the object itself.
+    """
+
+    def __init__(self, token, is_active, role):
+        super().__init__(token)
+        self.is_active = is_active
+        self.role = role
+
+
+class UserStateCache:
+    """
+    Per-process cache of ``(is_active, role)`` by user id.
+
+    Entries expire after ``ttl`` seconds, so at most one small query per
+    user per ``ttl`` instead of one per request. Saves and deletes made in
+    this process drop the entry right away.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}  # user id -> (expires_at, state or None)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Return ``(is_active, role)`` for ``user_id``, or None if there is no such user."""
+        user_id = str(user_id)  # tokens carry the id as a string
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+        if entry and entry[0] > now:
+            return entry[1]
+        state = (
+            get_user_model().objects.filter(**{api_settings.USER_ID_FIELD: user_id})
+            .values_list("is_active", "role").first()
+        )
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+                if len(self._entries) >= self.max_entries:
+                    self._entries.clear()
+            self._entries[user_id] = (now + self.ttl, state)
+        return state
+
+    def forget(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that trusts the token's identity instead of fetching the user.
+
+    The only database access is the short-lived state cache, which keeps
+    deactivation and role changes effective without a query per request.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+        state = user_states.get(user_id)
+        if state is None:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+        is_active, role = state
+        if api_settings.CHECK_USER_IS_ACTIVE and not is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        return ClaimsUser(validated_token, is_active, role)
+
+
+def build_user_states():
+    conf = auth_settings()
+    return UserStateCache(conf["STATE_TTL"], conf["MAX_ENTRIES"])
+
+
+user_states = build_user_states()
+
+
+def _forget_user(sender, instance, **kwargs):
+    user_states.forget(getattr(instance, api_settings.USER_ID_FIELD))
+
+
+post_save.connect(_forget_user, sender=settings.AUTH_USER_MODEL, dispatch_uid="users.forget_state_on_save")
+post_delete.connect(_forget_user, sender=settings.AUTH_USER_MODEL, dispatch_uid="users.forget_state_on_delete")
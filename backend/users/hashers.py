@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2-SHA256 with the work factor set by ``PASSWORD_PBKDF2_ITERATIONS``.
+
+    Hashes stored with another iteration count still verify; ``must_update``
+    then reports them so ``check_password`` re-hashes at the current cost
+    on the user's next login.
+    """
+
+    @property
+    def iterations(self):
+        return getattr(settings, "PASSWORD_PBKDF2_ITERATIONS", None) or PBKDF2PasswordHasher.iterations
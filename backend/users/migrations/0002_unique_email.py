@@ -0,0 +1,31 @@
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def check_duplicate_emails(apps, schema_editor):
+    CustomUser = apps.get_model("users", "CustomUser")
+    duplicates = list(
+        CustomUser.objects.exclude(email="").values("email")
+        .annotate(n=Count("pk")).filter(n__gt=1).values_list("email", flat=True)[:20]
+    )
+    if duplicates:
+        # Which account keeps an address is a decision for an operator, not a migration
+        raise RuntimeError(
+            "Cannot make email unique, these addresses belong to more than one user: "
+            + ", ".join(duplicates)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_emails, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='customuser',
+            constraint=models.UniqueConstraint(condition=models.Q(('email', ''), _negated=True), fields=('email',), name='users_unique_email'),
+        ),
+    ]
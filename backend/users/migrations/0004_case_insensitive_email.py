@@ -0,0 +1,40 @@
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+
+def check_duplicate_emails(apps, schema_editor):
+    CustomUser = apps.get_model("users", "CustomUser")
+    duplicates = list(
+        CustomUser.objects.exclude(email="").annotate(address=Lower("email")).values("address")
+        .annotate(n=Count("pk")).filter(n__gt=1).values_list("address", flat=True)[:20]
+    )
+    if duplicates:
+        # As in 0002: which account keeps an address is a decision for an operator
+        raise RuntimeError(
+            "Cannot make email unique ignoring case, these addresses belong to more than one user: "
+            + ", ".join(duplicates)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_email_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_emails, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='customuser',
+            name='users_email_idx',
+        ),
+        migrations.RemoveConstraint(
+            model_name='customuser',
+            name='users_unique_email',
+        ),
+        migrations.AddConstraint(
+            model_name='customuser',
+            constraint=models.UniqueConstraint(Lower('email'), condition=models.Q(('email', ''), _negated=True), name='users_unique_email'),
+        ),
+    ]
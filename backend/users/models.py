@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models.functions import Lower
 
 class CustomUser(AbstractUser):
     ROLE_CHOICES = (
@@ -9,5 +10,12 @@ class CustomUser(AbstractUser):
 
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default="user")
 
+    class Meta(AbstractUser.Meta):
+        constraints = [
+            # Addresses are compared case-insensitively (see users.views.users_by_email),
+            # which this index also serves. Blank emails (e.g. createsuperuser) stay allowed.
+            models.UniqueConstraint(Lower("email"), condition=~models.Q(email=""), name="users_unique_email"),
+        ]
+
     def __str__(self):
         return self.username
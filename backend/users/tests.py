@@ -1,3 +1,143 @@
-from django.test import TestCase
+import uuid
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from downloader.admission import RateLimited
+from downloader.models import DownloadJob
+
+from .authentication import user_states
+from .views import get_tokens_for_user, users_by_email
+
+User = get_user_model()
+
+
+def client_for(user):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_tokens_for_user(user)['accessToken']}")
+    return client
+
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class StatelessJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        user_states.clear()
+        self.addCleanup(user_states.clear)
+        self.user = User.objects.create_user(username="alice", email="alice@example.com", password="password1")
+        self.client = client_for(self.user)
+        self.clock = mock.patch("users.authentication.time.monotonic", return_value=1000.0)
+        self.now = self.clock.start()
+        self.addCleanup(self.clock.stop)
+
+    def status_at(self, seconds):
+        # An unknown job is 404 for an authenticated user and 401 otherwise
+        self.now.return_value = 1000.0 + seconds
+        return self.client.get(f"/api/downloader/jobs/{uuid.uuid4()}/").status_code
+
+    def role_at(self, seconds):
+        self.now.return_value = 1000.0 + seconds
+        with mock.patch("downloader.views.admit", side_effect=RateLimited("slow down", 1, "test")) as admit:
+            self.client.post("/api/downloader/jobs/", {"url": "https://example.com/v"})
+        return admit.call_args.args[0].role
+
+    def test_deactivation_elsewhere_applies_after_ttl(self):
+        self.assertEqual(self.status_at(0), 404)
+        # A queryset update sends no signal, like a change made by another process
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.status_at(user_states.ttl - 1), 404)
+        self.assertEqual(self.status_at(user_states.ttl + 1), 401)
+
+    def test_deactivation_in_process_applies_at_once(self):
+        self.assertEqual(self.status_at(0), 404)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.status_at(1), 401)
+
+    def test_deleted_user_is_rejected(self):
+        self.assertEqual(self.status_at(0), 404)
+        User.objects.filter(pk=self.user.pk).delete()
+        self.assertEqual(self.status_at(user_states.ttl + 1), 401)
+
+    def test_role_change_applies_after_ttl(self):
+        self.assertEqual(self.role_at(0), "user")
+        User.objects.filter(pk=self.user.pk).update(role="admin")
+        self.assertEqual(self.role_at(user_states.ttl - 1), "user")
+        self.assertEqual(self.role_at(user_states.ttl + 1), "admin")
+
+    def test_state_is_read_once_per_ttl(self):
+        self.status_at(0)
+        # Only the job lookup; no user row is read
+        with self.assertNumQueries(1):
+            self.assertEqual(self.status_at(1), 404)
+
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class DownloaderViewUserTests(TestCase):
+    def setUp(self):
+        user_states.clear()
+        self.addCleanup(user_states.clear)
+        self.user = User.objects.create_user(username="bob", email="bob@example.com", password="password1", role="admin")
+
+    def test_jobs_are_owned_by_the_token_user(self):
+        client = client_for(self.user)
+        with mock.patch("downloader.views.admit") as admit:
+            response = client.post("/api/downloader/jobs/", {"url": "https://example.com/v"})
+        self.assertEqual(response.status_code, 202)
+        user = admit.call_args.args[0]
+        self.assertEqual((str(user.pk), user.role), (str(self.user.pk), "admin"))
+
+        job = DownloadJob.objects.get(pk=response.data["job_id"])
+        self.assertEqual(job.user_id, self.user.pk)
+        self.assertEqual(client.get(response.data["status_url"]).status_code, 200)
+
+        other = User.objects.create_user(username="eve", email="eve@example.com", password="password1")
+        self.assertEqual(client_for(other).get(response.data["status_url"]).status_code, 404)
+
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class SignupLoginTests(TestCase):
+    def setUp(self):
+        User.objects.create_user(username="carol", email="carol@example.com", password="password1")
+
+    def signup(self, username, email):
+        return self.client.post("/api/users/signup/", {"username": username, "email": email, "password": "password2"})
+
+    def test_taken_email_ignores_case(self):
+        response = self.signup("carol2", "CAROL@Example.com")
+        self.assertEqual((response.status_code, response.data["error"]), (400, "Email already registered."))
+
+    def test_signup_is_a_single_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.signup("dave", "dave@example.com").status_code, 201)
+        statements = [q["sql"] for q in queries if "SAVEPOINT" not in q["sql"]]
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].startswith("INSERT"))
+
+    def test_taken_username(self):
+        response = self.signup("carol", "other@example.com")
+        self.assertEqual((response.status_code, response.data["error"]), (400, "Username already taken."))
+
+    def test_signup_and_login(self):
+        self.assertEqual(self.signup("dave", "Dave@Example.COM").status_code, 201)
+        response = self.client.post("/api/users/login/", {"email": "Dave@example.com", "password": "password2"})
+        self.assertEqual((response.status_code, response.data["user"]["username"]), (200, "dave"))
+
+    def test_blank_emails_do_not_collide(self):
+        User.objects.create_user(username="admin1", password="password1")
+        User.objects.create_user(username="admin2", password="password1")
+
+    def test_login_matches_stored_address_ignoring_case(self):
+        # Rows from before emails were normalized keep the case they were typed in
+        User.objects.create_user(username="erin", email="Erin@EXAMPLE.com", password="password1")
+        response = self.client.post("/api/users/login/", {"email": "erin@example.com", "password": "password1"})
+        self.assertEqual((response.status_code, response.data["user"]["username"]), (200, "erin"))
+
+    def test_login_lookup_uses_the_unique_index(self):
+        plan = users_by_email("carol@example.com").explain()
+        if connection.vendor == "sqlite":
+            self.assertIn("USING INDEX users_unique_email", plan)
+        self.assertNotIn("SCAN users_customuser", plan)
@@ -2,7 +2,13 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import Q, Value
+from django.db.models.functions import Lower
 from rest_framework_simplejwt.tokens import RefreshToken
+import logging
+
+logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
@@ -17,40 +23,50 @@ def get_tokens_for_user(user):
     }
 
 
+def users_by_email(email):
+    """Users whose address matches ``email`` ignoring case, looked up through the users_unique_email index."""
+    # Same expression and condition as the index, so the lookup is a single probe
+    return User.objects.alias(address=Lower("email")).filter(~Q(email=""), address=Lower(Value(email)))
+
+
 # ======================
 # Signup
 # ======================
-# ======================
-# Signup
-# ======================
+def signup_conflict(username):
+    if User.objects.filter(username=username).exists():
+        return Response({'error': 'Username already taken.'}, status=400)
+    return Response({'error': 'Email already registered.'}, status=400)
+
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def signup(request):
     data = request.data
     
     username = data.get('username', '').strip()
-    email = data.get('email', '').strip()
+    email = User.objects.normalize_email(data.get('email', '').strip())
     password = data.get('password', '').strip()
     role = data.get('role', 'user').strip()
 
-    # Optional: log safe info
-    print(f"Signup attempt for email: {email}")  # ✅ safe, no password
+    logger.debug("Signup attempt for email: %s", email)
 
     if not username or not email or not password:
         return Response({'error': 'All fields are required.'}, status=400)
     if len(password) < 8:
         return Response({'error': 'Password must be at least 8 characters.'}, status=400)
-    if User.objects.filter(username=username).exists():
-        return Response({'error': 'Username already taken.'}, status=400)
-    if User.objects.filter(email=email).exists():
-        return Response({'error': 'Email already registered.'}, status=400)
 
-    user = User.objects.create_user(
-        username=username,
-        email=email,
-        password=password,
-        role=role
-    )
+    # One INSERT; the unique indexes on username and lower(email) reject a
+    # taken account, and only then a second query tells the client which
+    try:
+        with transaction.atomic():
+            user = User.objects.create_user(
+                username=username,
+                email=email,
+                password=password,
+                role=role
+            )
+    except IntegrityError:
+        return signup_conflict(username)
 
     tokens = get_tokens_for_user(user)
 
@@ -69,20 +85,20 @@ def signup(request):
 def login_view(request):
     data = request.data
     
-    email = data.get('email', '').strip()
+    email = User.objects.normalize_email(data.get('email', '').strip())
     password = data.get('password', '').strip()
 
-    # Optional: log safe info
-    print(f"Login attempt for email: {email}")  # ✅ safe, no password
+    logger.debug("Login attempt for email: %s", email)
 
     if not email or not password:
         return Response({'error': 'Both email and password are required.'}, status=400)
 
     try:
-        user = User.objects.get(email=email)
+        user = users_by_email(email).get()
     except User.DoesNotExist:
         return Response({'error': 'Invalid credentials.'}, status=400)
 
+    # Re-hashes and saves the password if it was stored at an older cost
     if not user.check_password(password):
         return Response({'error': 'Invalid credentials.'}, status=400)
 
@@ -92,33 +108,3 @@ def login_view(request):
         'user': {'username': user.username, 'email': user.email, 'role': user.role},
         'tokens': tokens
     })
-
-    data = request.data  # DRF already parses JSON
-    
-    # Optional: log incoming data for debugging
-    print(f"Signup attempt for email: {email}")
-    
-    email = data.get('email', '').strip()
-    password = data.get('password', '').strip()
-
-    if not email or not password:
-        return Response({'error': 'Both email and password are required.'}, status=400)
-
-    try:
-        user = User.objects.get(email=email)
-    except User.DoesNotExist:
-        return Response({'error': 'Invalid credentials.'}, status=400)
-
-    if not user.check_password(password):
-        return Response({'error': 'Invalid credentials.'}, status=400)
-
-    tokens = get_tokens_for_user(user)
-    return Response({
-        'message': 'Login successful',
-        'user': {
-            'username': user.username,
-            'email': user.email,
-            'role': user.role
-        },
-        'tokens': tokens
-    })